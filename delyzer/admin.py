@@ -1,6 +1,9 @@
 # Dennis Hilgert
 
 from django.contrib import admin
-from .models import Departure
+from .models import Departure, Direction, Line, Station
 
-admin.site.register(Departure)
\ No newline at end of file
+admin.site.register(Departure)
+admin.site.register(Line)
+admin.site.register(Direction)
+admin.site.register(Station)
\ No newline at end of file
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'delyzer.settings')
+# The read endpoints are served by their async variants, see ASYNC_VIEWS
+os.environ.setdefault('DELYZER_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Load the departures before the first request, see DepartureStore
+from delyzer.utils.store import DepartureStore
+
+DepartureStore.preload()
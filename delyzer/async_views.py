@@ -0,0 +1,318 @@
+# Samuel Matzeit
+from .models import Departure
+from .serializers import DepartureSerializer
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from rest_framework import status
+import asyncio
+import functools
+import logging
+
+from .utils.cache import async_cached_response
+from .utils.query import Query
+from .utils.ranking import Ranking
+from .utils.render import Render
+from .utils.risk import Risk
+from .utils.timeslot import Timeslot
+from .utils.window import Window
+
+logger = logging.getLogger(__name__)
+
+# Threads that run the aggregations of the async views, their number bounds the concurrent aggregations
+# and database connections no matter how many clients are waiting
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_VIEW_WORKERS', 4), thread_name_prefix='delyzer-aggregate')
+
+
+async def aggregate(name:str, compute, *args) -> HttpResponse:
+    """aggregate
+    description:
+        * Runs the blocking aggregation of an async view in the executor, the response is encoded there as well
+        * The event loop keeps serving other requests, e.g. 304 responses, while the aggregation runs
+        * Returns 400 with the error for invalid query parameters and 500 for every other error like the sync views
+
+    Returns:
+        HttpResponse: Response of the view
+
+    Args:
+        name (string): Name of the view for the log
+        compute (function): Function that returns the response, see Render.response
+        args: Arguments of compute
+
+    tests:
+        * Test that the content equals the response of the sync view
+        * Test that an invalid query parameter returns 400
+    """
+
+    logger.info(f"GET request for {name}")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(run, compute, *args))
+
+    except ValueError as e:
+        return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    except Exception as e:
+        logger.error(e)
+        return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def require_get(view):
+    """require_get
+    description:
+        * Decorator of an async view that answers every other method than GET with 405 like the sync views
+        * The view is exempt from the CSRF protection like the views of the rest framework, it never changes data
+
+    Returns:
+        function: Decorated async view
+
+    Args:
+        view (function): Async view
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+        return await view(request, *args, **kwargs)
+
+    # csrf_exempt of Django 4.2 would wrap the view into a sync function
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def run(compute, *args) -> HttpResponse:
+    """run
+    description:
+        * Runs compute inside of an executor thread and closes the database connection of the thread afterwards
+          if it is expired, like Django does at the end of a request
+
+    Returns:
+        HttpResponse: Result of compute
+
+    Args:
+        compute (function): Function to run
+        args: Arguments of compute
+    """
+
+    close_old_connections()
+    try:
+        return compute(*args)
+    finally:
+        close_old_connections()
+
+
+@require_get
+async def departure_detail(request, id: int):
+    """departure_detail
+    description:
+        * GET: returns departure details by its id like views.departure_detail, read with the async ORM
+    """
+
+    try:
+        logger.info("GET request for departure_detail")
+
+        departure_data = await Departure.objects.named().values(*DepartureSerializer.Meta.fields).aget(pk=id)
+
+        serializer = DepartureSerializer(departure_data)
+        return JsonResponse({'departure':serializer.data})
+
+    except Exception as e:
+        logger.error(e)
+        return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@require_get
+@async_cached_response
+async def lines(request):
+    """lines
+    description:
+        * GET: returns all lines like views.lines
+    """
+
+    return await aggregate('lines', lambda: Render.response({'lines':Query.lines()}, request))
+
+
+@require_get
+@async_cached_response
+async def stations(request):
+    """stations
+    description:
+        * GET: returns all stations like views.stations
+    """
+
+    return await aggregate('stations', lambda: Render.response({'stations':Render.indexed(Query.stations()[['Name mit Ort']])}, request))
+
+
+@require_get
+@async_cached_response
+async def lines_by_delay(request):
+    """lines_by_delay
+    description:
+        * GET: returns the average delays of all lines like views.lines_by_delay
+    """
+
+    return await aggregate('lines_by_delay', lambda params: Render.response({
+        'delays':Query.by_delay(window=Window.params(params), ranking=Ranking.params(params))
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def line_by_delay(request, line, direction):
+    """line_by_delay
+    description:
+        * GET: returns the average delay of a line by its direction like views.line_by_delay
+    """
+
+    return await aggregate('line_by_delay', lambda params: Render.response({
+        'delays':Query.by_delay(line, direction, window=Window.params(params))
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def delay_at_time(request):
+    """delay_at_time
+    description:
+        * GET: returns the average delay per timeslot like views.delay_at_time
+    """
+
+    return await aggregate('delay_at_time', lambda params: Render.response({
+        'times':[Query.by_time(**Timeslot.params(params), window=Window.params(params))]
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def line_delay_at_time(request, line, direction):
+    """line_delay_at_time
+    description:
+        * GET: returns the average delay per timeslot of a line by its direction like views.line_delay_at_time
+    """
+
+    return await aggregate('line_delay_at_time', lambda params: Render.response({
+        'times':[Query.by_time(line, direction, **Timeslot.params(params), window=Window.params(params))]
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def line_delay_at_station(request, line, direction):
+    """line_delay_at_station
+    description:
+        * GET: returns the average delay per station of a line by its direction like views.line_delay_at_station
+    """
+
+    return await aggregate('line_delay_at_station', lambda params: Render.response({
+        'delays':Query.delay_at_station(line, direction, window=Window.params(params), ranking=Ranking.params(params))
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def delay_at_station(request):
+    """delay_at_station
+    description:
+        * GET: returns the average delay per station like views.delay_at_station
+    """
+
+    return await aggregate('delay_at_station', lambda params: Render.response({
+        'delays':Query.delay_at_station(window=Window.params(params), ranking=Ranking.params(params))
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def propability_at_station(request, station: str):
+    """propability_at_station
+    description:
+        * GET: returns the delay propability of a station like views.propability_at_station
+    """
+
+    return await aggregate('propability_at_station', lambda params: Render.response({
+        'propability':Query.propability_at_station(
+            station=station, thresholds=Risk.thresholds(params.get('threshold')),
+            window=Window.params(params), ranking=Ranking.params(params)
+        )
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def propability_at_stations(request):
+    """propability_at_stations
+    description:
+        * GET: returns the delay propability per station like views.propability_at_stations
+    """
+
+    return await aggregate('propability_at_stations', lambda params: Render.response({
+        'propability':Query.propability_at_station(
+            thresholds=Risk.thresholds(params.get('threshold')), window=Window.params(params), ranking=Ranking.params(params)
+        )
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def propability_of_line(request, line, direction):
+    """propability_of_line
+    description:
+        * GET: returns the delay propability of a line by its direction like views.propability_of_line
+    """
+
+    return await aggregate('propability_of_line', lambda params: Render.response({
+        'propability':Query.propability_of_line(
+            line, direction, thresholds=Risk.thresholds(params.get('threshold')),
+            window=Window.params(params), ranking=Ranking.params(params)
+        )
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def propability_of_lines(request):
+    """propability_of_lines
+    description:
+        * GET: returns the delay propability per line like views.propability_of_lines
+    """
+
+    return await aggregate('propability_of_lines', lambda params: Render.response({
+        'propability':Query.propability_of_line(
+            thresholds=Risk.thresholds(params.get('threshold')), window=Window.params(params), ranking=Ranking.params(params)
+        )
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def propability_at_stations_of_line(request, line, direction):
+    """propability_at_stations_of_line
+    description:
+        * GET: returns the delay propability per station of a line by its direction like views.propability_at_stations_of_line
+    """
+
+    return await aggregate('propability_at_stations_of_line', lambda params: Render.response({
+        'propability':Query.propability_at_station(
+            line, direction, thresholds=Risk.thresholds(params.get('threshold')),
+            window=Window.params(params), ranking=Ranking.params(params)
+        )
+    }, request), request.GET)
+
+
+@require_get
+@async_cached_response
+async def line_dashboard(request, line, direction):
+    """line_dashboard
+    description:
+        * GET: returns every statistic of a line by its direction in one response like views.line_dashboard
+    """
+
+    def dashboard(params):
+        fields = [field for field in params.get('fields', '').split(',') if field]
+        dashboard = Query.dashboard(
+            line, direction, fields, Risk.thresholds(params.get('threshold')), Window.params(params), Ranking.params(params)
+        )
+        return Render.response(dashboard, request)
+
+    return await aggregate('line_dashboard', dashboard, request.GET)
@@ -0,0 +1,99 @@
+# Dennis Hilgert
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from delyzer.models import Departure, PrunedDate
+from delyzer.utils.archive import DepartureArchive
+from delyzer.utils.retention import Retention
+import datetime, logging, os
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Archive the departures of closed service days into Parquet files and optionally prune them from the database'
+
+
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the allowed arguments for the archive departures command
+
+        Args:
+            parser (CommandParser): Django command parser
+        """
+
+        parser.add_argument(
+            '--directory',
+            default=getattr(settings, 'DEPARTURE_ARCHIVE_DIR', None),
+            help='Directory of the archive, DEPARTURE_ARCHIVE_DIR if not given',
+            required=False
+        )
+        parser.add_argument(
+            '--until',
+            type=datetime.date.fromisoformat,
+            help='Last service date to archive in the format YYYY-MM-DD, yesterday if not given',
+            required=False
+        )
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=0,
+            help='Number of closed service days before today that are not archived yet',
+            required=False
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            default=False,
+            help='Delete the archived departures from the database, the delay rollup keeps their statistics',
+            required=False
+        )
+
+
+
+    def handle(self, *args, **options) -> None:
+        """
+        Handles the execution of the archive departures command. This means:
+
+        * Write the departures of every service date up to until into one Parquet file per service date and line
+        * With --prune record the service date as pruned, so its rollup is never rebuilt, and delete its departures
+          from the database once all of its files are written
+
+        Tests:
+            * Provide no directory and no DEPARTURE_ARCHIVE_DIR: Command should not be executed - instead show an error
+            * Provide today as until: Command should not be executed - instead show an error
+            * Provide --prune: Archived departures should be deleted and the short timeslots should stay the same
+            * Provide --prune and another directory than DEPARTURE_ARCHIVE_DIR: Command should not be executed - instead show an error
+        """
+
+        directory = options.get('directory')
+        if not directory:
+            raise CommandError('Provide --directory or set DEPARTURE_ARCHIVE_DIR')
+        # The analytics endpoints only read the archive of DEPARTURE_ARCHIVE_DIR, pruned departures elsewhere would be lost for them
+        served = getattr(settings, 'DEPARTURE_ARCHIVE_DIR', None)
+        if options.get('prune') and (not served or os.path.realpath(directory) != os.path.realpath(served)):
+            raise CommandError(f'Only departures archived into DEPARTURE_ARCHIVE_DIR can be pruned, got {directory}')
+
+        today = timezone.localdate()
+        until = options.get('until') or today - datetime.timedelta(days=1 + options.get('keep_days'))
+        if until >= today:
+            raise CommandError(f'Only closed service days before {today} can be archived, got {until}')
+
+        try:
+            archive = DepartureArchive(directory)
+        except ImportError as e:
+            raise CommandError(str(e))
+
+        service_dates = Departure.objects.filter(service_date__lte=until).values_list('service_date', flat=True).distinct().order_by('service_date')
+        for service_date in service_dates:
+            # Departures that are saved or changed while the day is archived are pruned by the next run
+            started = timezone.now()
+            archived = archive.write(service_date)
+            logger.info(f'Archived {archived} departures of {service_date} into {directory}')
+
+            if options.get('prune'):
+                PrunedDate.objects.get_or_create(service_date=service_date)
+                # Deleted in batches, so the collector is not blocked by one long transaction
+                pruned = Retention.prune(Departure.objects.filter(service_date=service_date, current_date__lt=started))
+                logger.info(f'Pruned {pruned} departures of {service_date} from the database')
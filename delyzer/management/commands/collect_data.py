@@ -1,11 +1,16 @@
 # Dennis Hilgert
 
 from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
 from vvspy import get_departures
-from delyzer.models import Departure
-from delyzer.serializers import DepartureSerializer
+from delyzer.models import Departure, DelayRollup, PrunedDate, RetentionHorizon, TimeslotRollup
+from delyzer.utils.ingest import DepartureIngestor
+from delyzer.utils.scheduler import PollScheduler, RequestBudget
+from delyzer.utils.catalog import StationCatalog
+from delyzer.utils.cache import ResponseCache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-import sched, time, logging, pandas as pd
+import time, logging, threading, requests
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +19,22 @@ class Command(BaseCommand):
 
 
     def __init__(self) -> None:
-        self.__observe_line: str = ''
-        self.__station_ids: list
+        # Lines whose departures are collected, all departures of the observed stations are collected if empty
+        self.__observe_lines: set = set()
+        self.__station_ids: list = []
 
-        self.__scheduler = sched.scheduler(time.time, time.sleep)
+        self.__scheduler: PollScheduler
+        self.__budget: RequestBudget
         self.__intervall = 12
+        self.__report_intervall: float = 60
+
+        self.__concurrency: int = 8
+        self.__request_timeout: float = 10
+        self.__executor: ThreadPoolExecutor
+        # Every worker thread keeps its own http session to reuse the connection to the api
+        self.__thread_local = threading.local()
+
+        self.__ingestor: DepartureIngestor
 
 
 
@@ -40,12 +56,78 @@ class Command(BaseCommand):
             help='Observe and collect departure data from all stations of the given line',
             required=False
         )
+        parser.add_argument(
+            '--observe-lines',
+            help='Observe and collect departure data from all stations of the given comma separated lines, e.g. S1,S2,U6',
+            required=False
+        )
+        parser.add_argument(
+            '--observe-zones',
+            help='Observe and collect departure data from all stations in the given comma separated fare zones, e.g. 10,20. '
+                 'Combined with --observe-lines only the stations of the lines inside of the zones are observed',
+            required=False
+        )
+        parser.add_argument(
+            '--observe-network',
+            action='store_true',
+            help='Observe and collect departure data from all stations of the network',
+            required=False
+        )
         parser.add_argument(
             '--clear',
             default=False,
             help='Clear database before collecting new data',
             required=False
         )
+        parser.add_argument(
+            '--concurrency',
+            default=8,
+            type=int,
+            help='Maximum number of stations that are requested from the api at the same time',
+            required=False
+        )
+        parser.add_argument(
+            '--request-timeout',
+            default=10,
+            type=float,
+            help='Seconds after which a request to the api for a single station is aborted',
+            required=False
+        )
+        parser.add_argument(
+            '--batch-size',
+            default=500,
+            type=int,
+            help='Maximum number of departures that are inserted into the database with one statement',
+            required=False
+        )
+        parser.add_argument(
+            '--min-intervall',
+            default=12,
+            type=float,
+            help='Minimum seconds between two polls of a station, used shortly before its departures',
+            required=False
+        )
+        parser.add_argument(
+            '--max-intervall',
+            default=900,
+            type=float,
+            help='Maximum seconds between two polls of a station, used between sparse departures and at night',
+            required=False
+        )
+        parser.add_argument(
+            '--max-rps',
+            default=2,
+            type=float,
+            help='Maximum number of requests per second that are sent to the api over all stations',
+            required=False
+        )
+        parser.add_argument(
+            '--report-intervall',
+            default=60,
+            type=float,
+            help='Seconds between two reports of the share of stations that are refreshed in time',
+            required=False
+        )
 
 
 
@@ -54,24 +136,35 @@ class Command(BaseCommand):
         Handles the execution of the data collection command. This means:
 
         * Set the arguments given with the command execution to the local variables
-        * Start the scheduler to collect data of the departures in the specified time intervall
+        * Start the scheduler to collect data of the departures of every station when its next poll is due
         * Stop the scheduler on keyboard interrupt or program exit
 
         Tests:
             * Provide invalid parameters: Command should not be executed - instead show help
-            * Provide not enough parameters (wether observe-line and observe-station): Program should exit with a hint
+            * Provide not enough parameters (wether observe-line, observe-lines, observe-zones, observe-network and observe-station): Program should exit with a hint
             * Provide matching parameters: Program should run until it is terminated
         """
 
         observe_line = options.get('observe_line')
         if observe_line:
-            self.__observe_line = observe_line
+            self.__observe_lines = {observe_line}
             station_ids = self.get_stations_by_line(observe_line)
             if not station_ids:
                 logger.error('Please provide a valid line number')
                 return
             self.__station_ids = station_ids
-        
+
+        observe_lines = self.split_list(options.get('observe_lines'))
+        observe_zones = self.split_list(options.get('observe_zones'))
+        observe_network = options.get('observe_network')
+        if observe_lines or observe_zones or observe_network:
+            self.__observe_lines = set(observe_lines)
+            station_ids = self.get_stations_by_network(observe_lines, observe_zones)
+            if not station_ids:
+                logger.error('Please provide valid line numbers and fare zones')
+                return
+            self.__station_ids = station_ids
+
         observe_station = options.get('observe_station')
         if observe_station:
             station_valid = self.validate_station_id(observe_station)
@@ -81,52 +174,88 @@ class Command(BaseCommand):
             self.__station_ids = [observe_station]
 
         if not self.__station_ids:
-            logger.error('Please provide a line or specific station id')
+            logger.error('Please provide a line, lines, zones, the network or specific station id')
+            return
+
+        concurrency = options.get('concurrency')
+        if concurrency < 1:
+            logger.error('Please provide a concurrency of at least 1')
             return
+        self.__concurrency = concurrency
+        self.__request_timeout = options.get('request_timeout')
+
+        batch_size = options.get('batch_size')
+        if batch_size < 1:
+            logger.error('Please provide a batch size of at least 1')
+            return
+        self.__ingestor = DepartureIngestor(batch_size)
+
+        min_intervall = options.get('min_intervall')
+        max_intervall = options.get('max_intervall')
+        max_rps = options.get('max_rps')
+        if min_intervall <= 0 or max_intervall < min_intervall or max_rps <= 0:
+            logger.error('Please provide positive intervalls with a maximum above the minimum and a positive request rate')
+            return
+        self.__intervall = min_intervall
+        self.__scheduler = PollScheduler(min_intervall, max_intervall)
+        self.__budget = RequestBudget(max_rps, burst=self.__concurrency)
+        self.__report_intervall = options.get('report_intervall')
 
         clear = options.get('clear')
         if clear:
-            Departure.objects.all().delete()
+            with transaction.atomic():
+                Departure.objects.all().delete()
+                DelayRollup.objects.all().delete()
+                TimeslotRollup.objects.all().delete()
+                RetentionHorizon.objects.all().delete()
+                PrunedDate.objects.all().delete()
+                ResponseCache.bump(deleted=True)
+        seen = self.__ingestor.load_seen()
+        logger.info('Recently seen departures: ' + str(seen))
 
         logger.info('Data collection has been started')
         logger.info('Clear: ' + str(clear))
         logger.info('Observe line: -' if not observe_line else 'Observe line: ' + observe_line)
+        logger.info('Observe lines: -' if not observe_lines else 'Observe lines: ' + ', '.join(observe_lines))
+        logger.info('Observe zones: -' if not observe_zones else 'Observe zones: ' + ', '.join(observe_zones))
+        logger.info('Observe network: ' + str(observe_network))
+        logger.info('Observed stations: ' + str(len(self.__station_ids)))
         logger.info('Observe station: -' if not observe_station else 'Observe station: ' + observe_station)
+        logger.info('Concurrency: ' + str(self.__concurrency))
+        logger.info('Intervall: ' + str(min_intervall) + 's - ' + str(max_intervall) + 's, max requests per second: ' + str(max_rps))
 
-        try:
-            self.__scheduler.enter(0, 1, self.fetch_data, (self.__scheduler,))
-            self.__scheduler.run()
-        except KeyboardInterrupt:
-            logger.info('Data collection has been stopped')
+        now = time.time()
+        for station_id in self.__station_ids:
+            self.__scheduler.add(station_id, now)
+
+        with ThreadPoolExecutor(max_workers=self.__concurrency, thread_name_prefix='collector') as executor:
+            self.__executor = executor
+            try:
+                self.run()
+            except KeyboardInterrupt:
+                logger.info('Data collection has been stopped')
+                executor.shutdown(wait=False, cancel_futures=True)
 
 
 
     def get_stations_by_line(self, line: str) -> list:
         """
-        Returns a data frame with all stops of the line. This means:
-
-        * Load the csv file which contains all information regarding the lines and stations
-        * Filter all stations by the given line and return the data
+        Returns the ids of all stops of the line from the station catalog
 
         Args:
             line (str): Line to get the stations from
 
         Returns:
-            pd.DataFrame: DataFrame with the stations of the given line
+            list: Station ids in the format that is needed for the api requests
 
         Tests:
             * Pass in a inexistent line: Function should return an empty list
             * Pass in a valid line: Function should return filled list
+            * Pass in S1: Function should not return the stations that are only served by S11
         """
 
-        # Load the file in cp1252 encoding because it contains umlauts
-        line_stations_df = pd.read_csv('vvs_haltestellen.csv', sep=';', encoding='cp1252')
-        # Filter stations by given line
-        stations = line_stations_df.loc[line_stations_df['Linien (EFA)'].str.match(line)]
-        # Convert all station numbers into the format that is needed for the api requests
-        stations['Nummer (API)'] = stations['Nummer'].apply(lambda nummer: 5000000 + nummer)
-        return stations['Nummer (API)'].tolist()
-    
+        return list(StationCatalog.get().stations_by_line(line))
+
 
 
     def validate_station_id(self, station_id: str) -> bool:
@@ -143,49 +272,230 @@ class Command(BaseCommand):
             * Pass in an inexistent station id: Function should return false
             * Pass in an existent station id: Function should return true
         """
-        stations_df = pd.read_csv('vvs_data.csv')
-        station = stations_df.loc[stations_df['Nummer'].astype(str).str.match(station_id)]
-        return station['Nummer'].tolist().__len__() > 0
 
+        return StationCatalog.get().contains(station_id)
+
+
+
+    def get_stations_by_network(self, lines: list, zones: list) -> list:
+        """
+        Returns the ids of all stations of the given lines and fare zones without duplicates. This means:
+
+        * Take the stations that serve any of the given lines, all stations of the network if no lines are given
+        * Keep the stations that lie in any of the given fare zones, all stations if no zones are given
+
+        Args:
+            lines (list): Line numbers to get the stations from
+            zones (list): Fare zones to get the stations from
+
+        Returns:
+            list: Station ids in the format that is needed for the api requests
+
+        Tests:
+            * Pass in no lines and no zones: Function should return all stations of the network
+            * Pass in two lines that share stations: Function should return every shared station only once
+            * Pass in an inexistent zone: Function should return an empty list
+        """
+
+        catalog = StationCatalog.get()
+        if lines:
+            station_ids = [station_id for line in lines for station_id in catalog.stations_by_line(line)]
+        else:
+            station_ids = list(catalog.network())
+        if zones:
+            zone_station_ids = {station_id for zone in zones for station_id in catalog.stations_by_zone(zone)}
+            station_ids = [station_id for station_id in station_ids if station_id in zone_station_ids]
+        # Keep the first occurrence of every station
+        return list(dict.fromkeys(station_ids))
+
+
+
+    def split_list(self, value: str) -> list:
+        """
+        Splits a comma separated argument into its values
+
+        Args:
+            value (str): Comma separated values or None
+
+        Returns:
+            list: Values without surrounding whitespace and without empty values
+        """
+
+        if not value:
+            return []
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+
+
+    def run(self) -> None:
+        """
+        Runs the polling loop until the command is interrupted. This means:
+
+        * Take the stations whose poll is due from the scheduler, the most overdue first, as long as there are free
+          workers and the request budget allows it
+        * Request their departures concurrently
+        * Collect the data of all stations whose request completed and reschedule each of them
+
+        Tests:
+            * Observe stations with departures in the next minutes: Stations should be polled in the minimum intervall
+            * Observe more stations than the request budget allows: No more requests than max-rps should be sent per second
+            * Observe more stations than the request budget allows: The logged coverage should drop below 100%
+        """
+
+        pending = {}
+        next_report = time.time() + self.__report_intervall
+        while True:
+            now = time.time()
+            if now >= next_report:
+                self.report_coverage(now)
+                next_report = now + self.__report_intervall
+            limit = min(self.__concurrency - len(pending), self.__budget.available(now))
+            for station_id in self.__scheduler.pop_due(now, limit):
+                self.__budget.consume(now)
+                pending[self.__executor.submit(self.fetch_station, station_id)] = station_id
+
+            # Wake up for the next due poll only if there is a free worker, otherwise for the next completed request
+            timeout = None
+            if len(pending) < self.__concurrency:
+                timeout = self.__scheduler.seconds_until_due(now)
+                if timeout is not None:
+                    timeout = max(timeout, self.__budget.seconds_until_available(now))
+                    timeout = min(timeout, max(next_report - now, 0))
+            if not pending:
+                time.sleep(timeout if timeout is not None else self.__intervall)
+                continue
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if done:
+                self.fetch_data({future: pending.pop(future) for future in done})
+
+
+
+    def report_coverage(self, now: float) -> None:
+        """
+        Logs the share of observed stations that were refreshed within their target window
+
+        Args:
+            now (float): Current timestamp in seconds
+        """
+
+        stations = len(self.__station_ids)
+        coverage = self.__scheduler.coverage(stations, now)
+        logger.info('Data collection: Coverage %.1f%% of %s stations refreshed within their target window', coverage * 100, stations)
+        if coverage < 0.9:
+            logger.warning('Data collection: The request budget does not keep up with the observed stations')
 
 
-    def fetch_data(self, scheduler: sched.scheduler) -> None:
+
+    def fetch_data(self, completed: dict) -> None:
         """
-        Fetchs data from the vvs api for the given stations in the specified time intervall. This means:
+        Collects the data of the stations whose requests to the vvs api are completed. This means:
 
-        * Iterate through all station ids and request the departure information for each station id
-        * Iterate through all departures and check if the data is in real time and if the departure belongs to the observed line if set
+        * Iterate through the departures of every completed station and check if the data is in real time and if the departure belongs to the observed line if set
         * Map the data to the fields needed for serialization
-        * Save the data to the database
+        * Schedule the next poll of every station by its upcoming departures
+        * Validate and save the data of all completed stations to the database in one transaction
+
+        A station that fails, times out or returns departures that can't be read is logged, polled again after the minimum intervall
+        and does not stall the other stations. A batch that can't be saved is logged and the collection continues.
 
         Args:
-            scheduler (sched.scheduler): Scheduler
+            completed (dict): Completed futures of the station requests by their station id
 
         Tests:
             * Provide an invalid station id in __station_ids: Function should log a warning and continue with the next station id
             * Provide valid station ids in __station_ids: Function should save all the departures related to the given station ids
+            * Provide a station whose request times out: Function should save the departures of all other stations
+            * Provide a station whose request returns an error status: Function should poll it again after the minimum intervall
+            * Provide a station without upcoming departures: Function should poll it again after the maximum intervall
+            * Provide a station whose response can't be parsed: Function should log an error and save the departures of all other stations
+            * Let the database be locked while saving: Function should log an error and the collector should keep running
         """
 
         logger.debug('Data collection: Running fetch')
-        scheduler.enter(self.__intervall, 1, self.fetch_data, (scheduler,))
-
-        for station_id in self.__station_ids:
-            departures = get_departures(station_id, limit=100)
+        rows = []
+        for future, station_id in completed.items():
+            now = datetime.now()
+            try:
+                departures = future.result()
+            except requests.RequestException as e:
+                logger.warning('Data collection: Request for station %s failed: %s', station_id, e)
+                self.__scheduler.add(station_id, time.time() + self.__intervall)
+                continue
+            except Exception as e:
+                # e.g. an unexpected response that the vvs api client could not parse
+                logger.error('Data collection: Departures of station %s could not be read: %s', station_id, e)
+                self.__scheduler.add(station_id, time.time() + self.__intervall)
+                continue
+            if departures is None:
+                # The api answered with an error status or invalid json
+                logger.warning('Data collection: Station %s did not return a valid response', station_id)
+                self.__scheduler.add(station_id, time.time() + self.__intervall)
+                continue
             if not departures:
-                logger.warn('Data collection: No departures were returned from station ' + station_id)
+                logger.warning('Data collection: No departures were returned from station %s', station_id)
+                self.__scheduler.refreshed(station_id, time.time(), self.__scheduler.next_intervall([], now))
                 continue
             logger.debug('Data collection: Mapping fetched data')
-            for departure in departures:
-                # If departure is not in real time skip this entry
-                if departure.serving_line.real_time == False:
-                    continue
-                # If departure does not belong to the observed line skip this entry
-                if self.__observe_line and not departure.serving_line.number == self.__observe_line:
-                    continue
-                # Map the data of the departure to the data fields to be saved
-                data = self.map_data(departure)
-                # Check if the data matches the required types and save it to the database
-                self.serialize_data(data)
+            observed = []
+            station_rows = []
+            try:
+                for departure in departures:
+                    # If departure is not in real time skip this entry
+                    if departure.serving_line.real_time == False:
+                        continue
+                    # If departure does not belong to the observed lines skip this entry
+                    if self.__observe_lines and departure.serving_line.number not in self.__observe_lines:
+                        continue
+                    observed.append(departure)
+                    # Map the data of the departure to the data fields to be saved
+                    station_rows.append(self.map_data(departure))
+            except Exception as e:
+                logger.error('Data collection: Departures of station %s could not be mapped: %s', station_id, e)
+                self.__scheduler.add(station_id, time.time() + self.__intervall)
+                continue
+            rows.extend(station_rows)
+            self.__scheduler.refreshed(station_id, time.time(), self.__scheduler.next_intervall(observed, now))
+
+        # Check if the data matches the required types and save it to the database
+        try:
+            saved = self.__ingestor.ingest(rows)
+        except Exception as e:
+            # e.g. a locked database, the stations are polled again at their next poll and the collector keeps running
+            logger.error('Data collection: Departures of %s stations could not be saved: %s', len(completed), e)
+            return
+        logger.debug('Data collection: Fetch of %s stations saved %s departures', len(completed), saved)
+
+
+
+    def fetch_station(self, station_id) -> list:
+        """
+        Requests the departures of a single station from the vvs api. Runs inside a worker thread of the executor.
+
+        Args:
+            station_id (str | int): Id of the station
+
+        Returns:
+            list: Departures of the station or None if the api did not return a valid response
+
+        Raises:
+            requests.RequestException: If the request failed or exceeded the request timeout
+
+        Tests:
+            * Pass in a valid station id: Function should return the departures of the station
+            * Pass in a station id while the api is not reachable: Function should raise a RequestException
+        """
+
+        session = getattr(self.__thread_local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.__thread_local.session = session
+        return get_departures(
+            station_id,
+            limit=100,
+            session=session,
+            request_params={'timeout': self.__request_timeout}
+        )
 
 
 
@@ -214,25 +524,6 @@ class Command(BaseCommand):
         data['planned_departure_time'] = departure.datetime.time()
         data['delay'] = 0 if departure.serving_line.delay == None else departure.serving_line.delay
         data['current_date'] = datetime.now()
+        data['service_date'] = departure.datetime.date()
+        data['weekday'] = data['service_date'].isoweekday()
         return data
-
-
-
-    def serialize_data(self, data: dict) -> None:
-        """
-        Checks if the data has all required fields to save to the database and then saves to the database
-
-        Args:
-            data (dict): Data to be serialized
-
-        Tests:
-            * Pass in data that doesn't have the required fields: Function should log a warning message (error not needed because corrupt data is not our fault)
-            * Pass in data that does have all required fields: Function should save the data to the database
-        """
-
-        serializer = DepartureSerializer(data=data)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            logger.warn('Data does not satisfy the departure serializer')
-            logger.warn(data)
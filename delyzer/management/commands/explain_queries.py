@@ -0,0 +1,113 @@
+# Dennis Hilgert
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from delyzer.utils.query import Query
+from delyzer.utils.window import Window
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Print the query plan of the database queries of every analytics endpoint'
+
+
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the allowed arguments for the explain queries command
+
+        Args:
+            parser (CommandParser): Django command parser
+        """
+
+        parser.add_argument(
+            '--line',
+            default='S1',
+            help='Line number used for the line specific endpoints',
+            required=False
+        )
+        parser.add_argument(
+            '--direction',
+            default='Herrenberg',
+            help='Direction used for the line specific endpoints',
+            required=False
+        )
+        parser.add_argument(
+            '--station',
+            default='Stadtmitte',
+            help='Station name used for the station specific endpoints',
+            required=False
+        )
+
+
+
+    def handle(self, *args, **options) -> None:
+        """
+        Handles the execution of the explain queries command. This means:
+
+        * Run the aggregation of every endpoint and capture the executed sql statements
+        * Print every statement with the query plan of the database
+
+        Tests:
+            * Run the command on a migrated database: Command should print a query plan for every endpoint
+            * Run the command on a database with the indexes: Query plans should use the departure indexes instead of a full scan
+        """
+
+        line = options.get('line')
+        direction = options.get('direction')
+        station = options.get('station')
+        ranking = {'limit': 10, 'order': 'desc', 'min_samples': 20}
+        window = Window.params({'from': str(datetime.date.today() - datetime.timedelta(days=30)), 'weekdays': '1-5', 'hours': '6-9'})
+
+        endpoints = {
+            'lines/': lambda: Query.lines(),
+            'stations/': lambda: Query.stations(),
+            'delay/lines': lambda: Query.by_delay(),
+            'delay/line/<line>/<direction>': lambda: Query.by_delay(line, direction),
+            'delay/times': lambda: Query.by_time(),
+            'delay/times/<line>/<direction>': lambda: Query.by_time(line, direction),
+            'delay/times/<line>/<direction>?slot=15&split=days': lambda: Query.by_time(line, direction, 15, split=True),
+            'delay/stations': lambda: Query.delay_at_station(),
+            'delay/stations/<line>/<direction>': lambda: Query.delay_at_station(line, direction),
+            'propability/stations': lambda: Query.propability_at_station(),
+            'propability/station/<station>': lambda: Query.propability_at_station(station=station),
+            'propability/stations/<line>/<direction>': lambda: Query.propability_at_station(line, direction),
+            'propability/line/<line>/<direction>': lambda: Query.propability_of_line(line, direction),
+            'propability/lines': lambda: Query.propability_of_line(),
+            'propability/lines?threshold=2,3,5': lambda: Query.propability_of_line(thresholds=[2, 3, 5]),
+            'dashboard/<line>/<direction>': lambda: Query.dashboard(line, direction),
+            'delay/stations?limit=10&min_samples=20': lambda: Query.delay_at_station(ranking=ranking),
+            'propability/lines?threshold=2,3,5&limit=10&min_samples=20': lambda: Query.propability_of_line(thresholds=[2, 3, 5], ranking=ranking),
+            'delay/stations/<line>/<direction>?from=&weekdays=1-5&hours=6-9': lambda: Query.delay_at_station(line, direction, window=window),
+        }
+
+        for endpoint, aggregate in endpoints.items():
+            with CaptureQueriesContext(connection) as context:
+                aggregate()
+            self.stdout.write(self.style.MIGRATE_HEADING(endpoint))
+            for query in context.captured_queries:
+                self.stdout.write('  ' + query['sql'])
+                for step in self.explain(query['sql']):
+                    self.stdout.write('    ' + step)
+
+
+
+    def explain(self, sql: str) -> list:
+        """
+        Returns the query plan of the given sql statement
+
+        Args:
+            sql (str): Executed sql statement with its parameters
+
+        Returns:
+            list: Steps of the query plan
+        """
+
+        prefix = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else connection.ops.explain_query_prefix()
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + ' ' + sql)
+            # The description of a step is the last column for sqlite as well as for other databases
+            return [str(row[-1]) for row in cursor.fetchall()]
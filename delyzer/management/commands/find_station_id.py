@@ -1,6 +1,7 @@
 # Dennis Hilgert
 
 from django.core.management.base import BaseCommand, CommandParser
+from delyzer.utils.catalog import StationCatalog
 import logging, pandas as pd
 
 logger = logging.getLogger(__name__)
@@ -36,8 +37,8 @@ class Command(BaseCommand):
         """
 
         station_name = options.get('station_name')
-        stations_df = pd.read_csv('vvs_data.csv')
-        stations_result = stations_df.loc[stations_df['Name mit Ort'].str.contains(station_name)]
+        stations = StationCatalog.get().search(station_name)
+        stations_result = pd.DataFrame({'Nummer': list(stations.keys()), 'Name mit Ort': list(stations.values())})
         if stations_result.empty:
             logger.info(f'Es existiert keine Station mit dem Namen "{station_name}".')
             return
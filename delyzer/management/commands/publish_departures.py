@@ -0,0 +1,72 @@
+# Dennis Hilgert
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from delyzer.utils.store import DepartureStore
+import logging, os, time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Publish the departure store into a directory that every server worker maps instead of loading its own copy'
+
+
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the allowed arguments for the publish departures command
+
+        Args:
+            parser (CommandParser): Django command parser
+        """
+
+        parser.add_argument(
+            '--directory',
+            default=getattr(settings, 'DEPARTURE_STORE_DIR', None),
+            help='Directory of the published departures, DEPARTURE_STORE_DIR if not given',
+            required=False
+        )
+        parser.add_argument(
+            '--intervall',
+            type=int,
+            default=30,
+            help='Seconds between two checks for new departures',
+            required=False
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help='Publish the departures once and exit',
+            required=False
+        )
+
+
+
+    def handle(self, *args, **options) -> None:
+        """
+        Handles the execution of the publish departures command. This means:
+
+        * Load the departures into a departure store of this process
+        * Publish the columns whenever the data version changed, workers map the new columns at their next request
+        * Top up the store with the departures saved since the last check, so it is loaded only once
+
+        Tests:
+            * Provide no directory and no DEPARTURE_STORE_DIR: Command should not be executed - instead show an error
+            * Provide --once: Command should publish the departures and exit
+            * Save departures while the command runs: Command should publish a new version within the intervall
+        """
+
+        directory = options.get('directory')
+        if not directory:
+            raise CommandError('Provide --directory or set DEPARTURE_STORE_DIR')
+        os.makedirs(directory, exist_ok=True)
+
+        store = DepartureStore()
+        while True:
+            store.refresh()
+            if store.publish(directory):
+                logger.info(f'Published {len(store)} departures into {directory}')
+            if options.get('once'):
+                return
+            time.sleep(options.get('intervall'))
@@ -0,0 +1,58 @@
+# Dennis Hilgert
+
+from django.core.management.base import BaseCommand, CommandParser
+from delyzer.utils.retention import Retention
+from delyzer.utils.rollup import Rollup
+import datetime, logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Rebuild the delay rollup from the saved departures'
+
+
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the allowed arguments for the rebuild rollup command
+
+        Args:
+            parser (CommandParser): Django command parser
+        """
+
+        parser.add_argument(
+            '--since',
+            type=datetime.date.fromisoformat,
+            help='First service date to rebuild in the format YYYY-MM-DD, all service dates if not given',
+            required=False
+        )
+        parser.add_argument(
+            '--until',
+            type=datetime.date.fromisoformat,
+            help='Last service date to rebuild in the format YYYY-MM-DD, all service dates if not given',
+            required=False
+        )
+
+
+
+    def handle(self, *args, **options) -> None:
+        """
+        Handles the execution of the rebuild rollup command.
+
+        Tests:
+            * Provide an invalid date: Command should not be executed - instead show help
+            * Provide no dates: Command should rebuild the rollup of all service dates
+            * Provide a since before the retention horizon: Command should only rebuild the service dates since the horizon
+            * Provide no dates after archive_departures --prune: Command should keep the rollup of the pruned service dates
+        """
+
+        since = options.get('since')
+        until = options.get('until')
+        # The rollup is the only data of the service dates before the retention horizon
+        horizon = Retention.horizon()
+        if horizon is not None and (since is None or since < horizon):
+            logger.info(f'Departures before {horizon} were deleted by the retention, their rollup is kept')
+            since = horizon
+        logger.info('Rebuilding rollup from ' + (str(since) if since else '-') + ' until ' + (str(until) if until else '-'))
+        created = Rollup.rebuild(since, until)
+        logger.info(f'Rollup has been rebuilt with {created} rows')
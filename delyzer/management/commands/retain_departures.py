@@ -0,0 +1,102 @@
+# Dennis Hilgert
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from delyzer.models import Departure, DelayRollup, TimeslotRollup
+from delyzer.utils.archive import DepartureArchive
+from delyzer.utils.retention import Retention
+import datetime, logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Fold the departures of the service dates before the retention horizon into the delay rollup and delete them'
+
+
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """
+        Adds the allowed arguments for the retain departures command
+
+        Args:
+            parser (CommandParser): Django command parser
+        """
+
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=getattr(settings, 'DEPARTURE_RETENTION_DAYS', None),
+            help='Number of service days before today whose departures are kept, DEPARTURE_RETENTION_DAYS if not given',
+            required=False
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Maximum number of departures that are deleted in one transaction',
+            required=False
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.1,
+            help='Seconds to wait between two deleted batches, so the collector can save its departures in between',
+            required=False
+        )
+
+
+
+    def handle(self, *args, **options) -> None:
+        """
+        Handles the execution of the retain departures command. This means:
+
+        * Fold every service date before the horizon into the delay rollup if the rollup misses departures of it
+        * Fold every service date before the horizon into the timeslot rollup, with the archived departures if
+          DEPARTURE_ARCHIVE_DIR is set, also the ones that archive_departures --prune deleted before
+        * Move the retention horizon forward, the analytics endpoints answer the older service dates from the rollup from now on
+        * Delete the departures of the older service dates in batches
+
+        Tests:
+            * Provide no keep days and no DEPARTURE_RETENTION_DAYS: Command should not be executed - instead show an error
+            * Provide 0 keep days: Command should not be executed - instead show an error
+            * Provide 1 keep day: Departures before yesterday should be deleted and the rollup should stay the same
+        """
+
+        keep_days = options.get('keep_days')
+        if keep_days is None:
+            raise CommandError('Provide --keep-days or set DEPARTURE_RETENTION_DAYS')
+        # The collector still updates the departures of yesterday, see DepartureIngestor.load_seen
+        if keep_days < 1:
+            raise CommandError(f'Keep at least 1 service day before today, got {keep_days}')
+        if options.get('batch_size') < 1:
+            raise CommandError('Provide a batch size of at least 1')
+
+        archive = None
+        archive_directory = getattr(settings, 'DEPARTURE_ARCHIVE_DIR', None)
+        if archive_directory:
+            try:
+                archive = DepartureArchive(archive_directory)
+            except ImportError as e:
+                raise CommandError(f'{e}, the archived departures of DEPARTURE_ARCHIVE_DIR could not be folded')
+
+        horizon = timezone.localdate() - datetime.timedelta(days=keep_days)
+        departures = Departure.objects.filter(service_date__lt=horizon)
+        service_dates = departures.values_list('service_date', flat=True).distinct().order_by('service_date')
+        for service_date in service_dates:
+            if Retention.fold(service_date):
+                logger.info(f'Folded the departures of {service_date} into the rollup')
+
+        rolled_up = DelayRollup.objects.filter(service_date__lt=horizon).values_list('service_date', flat=True).distinct()
+        folded = TimeslotRollup.objects.filter(service_date__lt=horizon).values_list('service_date', flat=True).distinct()
+        for service_date in sorted((set(service_dates) | set(rolled_up)) - set(folded)):
+            slots = Retention.fold_timeslots(service_date, archive)
+            logger.info(f'Folded the departures of {service_date} into {slots} short timeslots')
+
+        horizon = Retention.advance(horizon)
+        logger.info(f'Departures are kept since {horizon}')
+
+        deleted = Retention.prune(
+            Departure.objects.filter(service_date__lt=horizon), options.get('batch_size'), options.get('pause')
+        )
+        logger.info(f'Deleted {deleted} departures before {horizon}')
@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-17 20:42
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Max
+import django.utils.timezone
+
+KEY_FIELDS = ['station_id', 'line_number', 'direction', 'planned_departure_time', 'service_date']
+
+
+def backfill_service_date(apps, schema_editor):
+    """
+    Derives the service date of existing departures from the time they were observed.
+    A departure planned more than 12 hours before the observation time belongs to the next day,
+    one planned more than 12 hours after it (e.g. planned 23:55 and observed 00:02) to the previous day.
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    batch = []
+    for departure in Departure.objects.only('id', 'current_date', 'planned_departure_time').iterator(chunk_size=2000):
+        observed = django.utils.timezone.localtime(departure.current_date)
+        service_date = observed.date()
+        planned = datetime.datetime.combine(service_date, departure.planned_departure_time)
+        if observed.replace(tzinfo=None) - planned > datetime.timedelta(hours=12):
+            service_date += datetime.timedelta(days=1)
+        elif planned - observed.replace(tzinfo=None) > datetime.timedelta(hours=12):
+            service_date -= datetime.timedelta(days=1)
+        departure.service_date = service_date
+        batch.append(departure)
+        if len(batch) >= 2000:
+            Departure.objects.bulk_update(batch, ['service_date'])
+            batch = []
+    if batch:
+        Departure.objects.bulk_update(batch, ['service_date'])
+
+
+def remove_repeated_observations(apps, schema_editor):
+    """
+    Keeps only the last observation of every departure, which holds its final observed delay
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    last_observations = Departure.objects.values(*KEY_FIELDS).annotate(last_id=Max('id')).values('last_id')
+    Departure.objects.exclude(id__in=last_observations).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0008_alter_departure_current_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='departure',
+            name='service_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(backfill_service_date, migrations.RunPython.noop),
+        migrations.RunPython(remove_repeated_observations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='departure',
+            constraint=models.UniqueConstraint(fields=('station_id', 'line_number', 'direction', 'planned_departure_time', 'service_date'), name='unique_departure'),
+        ),
+    ]
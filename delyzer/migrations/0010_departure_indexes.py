@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0009_departure_service_date_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line_number', 'direction', 'station_id', 'delay'], name='departure_line_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line_number', 'direction', 'planned_departure_time', 'delay'], name='departure_line_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['station_id', 'delay'], name='departure_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['planned_departure_time', 'delay'], name='departure_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['service_date'], name='departure_service_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['current_date'], name='departure_current_date_idx'),
+        ),
+    ]
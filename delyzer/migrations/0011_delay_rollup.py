@@ -0,0 +1,60 @@
+# Generated by Django 4.2 on 2026-10-17 20:48
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractHour, ExtractMinute
+import django.utils.timezone
+
+
+def build_rollup(apps, schema_editor):
+    """
+    Aggregates the existing departures into the rollup by line, direction, station, 30 min timeslot and service date
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    DelayRollup = apps.get_model('delyzer', 'DelayRollup')
+    slot = (ExtractHour('planned_departure_time') * 60 + ExtractMinute('planned_departure_time')) / 30
+    aggregates = Departure.objects.annotate(slot=slot).values('line_number', 'direction', 'station_id', 'slot', 'service_date').annotate(
+        count=Count('id'),
+        delay_sum=Sum('delay'),
+        delay_square_sum=Sum(F('delay') * F('delay')),
+        late_count=Count('id', filter=Q(delay__gt=2))
+    ).order_by()
+    DelayRollup.objects.bulk_create((DelayRollup(**aggregate) for aggregate in aggregates.iterator(chunk_size=2000)), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0010_departure_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DelayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.CharField(default='', max_length=8)),
+                ('direction', models.CharField(default='', max_length=128)),
+                ('station_id', models.IntegerField(default=-1)),
+                ('slot', models.SmallIntegerField(default=0)),
+                ('service_date', models.DateField(default=django.utils.timezone.localdate)),
+                ('count', models.IntegerField(default=0)),
+                ('delay_sum', models.BigIntegerField(default=0)),
+                ('delay_square_sum', models.BigIntegerField(default=0)),
+                ('late_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='delayrollup',
+            index=models.Index(fields=['station_id'], name='rollup_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='delayrollup',
+            index=models.Index(fields=['service_date'], name='rollup_service_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='delayrollup',
+            constraint=models.UniqueConstraint(fields=('line_number', 'direction', 'station_id', 'slot', 'service_date'), name='unique_delay_rollup'),
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
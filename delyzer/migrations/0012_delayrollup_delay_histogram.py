@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-17 21:34
+
+from django.db import migrations, models
+from django.db.models import Count, Value
+from django.db.models.functions import ExtractHour, ExtractMinute, Greatest, Least
+import numpy as np
+
+# Bins and data type of the histograms at the time of this migration, see Risk.BINS and Risk.DTYPE
+BINS = 31
+DTYPE = np.dtype('<u2')
+
+
+def build_histograms(apps, schema_editor):
+    """
+    Counts the delay histogram of every existing rollup row from the saved departures
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    DelayRollup = apps.get_model('delyzer', 'DelayRollup')
+    key_fields = ['line_number', 'direction', 'station_id', 'slot', 'service_date']
+    slot = (ExtractHour('planned_departure_time') * 60 + ExtractMinute('planned_departure_time')) / 30
+    delay_bin = Greatest(Least('delay', Value(BINS - 1)), Value(0))
+    counts = Departure.objects.annotate(slot=slot, delay_bin=delay_bin).values(*key_fields, 'delay_bin').annotate(count=Count('id')).order_by()
+
+    histograms = {}
+    for count in counts.iterator(chunk_size=2000):
+        key = tuple(count[field] for field in key_fields)
+        histograms.setdefault(key, np.zeros(BINS, dtype=np.int64))[count['delay_bin']] += count['count']
+
+    rollups = []
+    for rollup in DelayRollup.objects.iterator(chunk_size=2000):
+        histogram = histograms.get(tuple(getattr(rollup, field) for field in key_fields))
+        if histogram is not None:
+            rollup.delay_histogram = histogram.astype(DTYPE).tobytes()
+            rollups.append(rollup)
+    DelayRollup.objects.bulk_update(rollups, ['delay_histogram'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0011_delay_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delayrollup',
+            name='delay_histogram',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
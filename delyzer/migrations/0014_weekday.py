@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-17 22:18
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractIsoWeekDay
+
+
+def set_weekday(apps, schema_editor):
+    """
+    Sets the weekday of the existing departures and rollup rows from their service date
+    """
+    for model in ['Departure', 'DelayRollup']:
+        apps.get_model('delyzer', model).objects.update(weekday=ExtractIsoWeekDay('service_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0013_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delayrollup',
+            name='weekday',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='weekday',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line_number', 'direction', 'service_date'], name='departure_line_date_idx'),
+        ),
+        migrations.RunPython(set_weekday, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,190 @@
+# Generated by Django 4.2 on 2026-10-17 23:40
+
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_dimensions(apps, schema_editor):
+    """
+    Saves the lines, directions and stations of the existing departures and sets the ids of the departures
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    Line = apps.get_model('delyzer', 'Line')
+    Direction = apps.get_model('delyzer', 'Direction')
+    Station = apps.get_model('delyzer', 'Station')
+
+    lines = Departure.objects.values('line_number').annotate(name=Min('line_name')).order_by()
+    Line.objects.bulk_create([Line(number=line['line_number'], name=line['name']) for line in lines], batch_size=500)
+    names = set(Departure.objects.values_list('direction', flat=True).distinct()) \
+        | set(Departure.objects.values_list('direction_from', flat=True).distinct())
+    Direction.objects.bulk_create([Direction(name=name) for name in names], batch_size=500)
+    ids = set(Departure.objects.values_list('station_id', flat=True).distinct()) \
+        | set(Departure.objects.values_list('destination_id', flat=True).distinct())
+    Station.objects.bulk_create([Station(id=id) for id in ids], batch_size=500)
+
+    Departure.objects.update(
+        line=Subquery(Line.objects.filter(number=OuterRef('line_number')).values('id')[:1]),
+        to_direction=Subquery(Direction.objects.filter(name=OuterRef('direction')).values('id')[:1]),
+        from_direction=Subquery(Direction.objects.filter(name=OuterRef('direction_from')).values('id')[:1])
+    )
+
+
+def fill_names(apps, schema_editor):
+    """
+    Sets the line numbers, line names, directions and origins of the departures from their ids again
+    """
+    Departure = apps.get_model('delyzer', 'Departure')
+    Line = apps.get_model('delyzer', 'Line')
+    Direction = apps.get_model('delyzer', 'Direction')
+
+    Departure.objects.update(
+        line_number=Subquery(Line.objects.filter(id=OuterRef('line')).values('number')[:1]),
+        line_name=Subquery(Line.objects.filter(id=OuterRef('line')).values('name')[:1]),
+        direction=Subquery(Direction.objects.filter(id=OuterRef('to_direction')).values('name')[:1]),
+        direction_from=Subquery(Direction.objects.filter(id=OuterRef('from_direction')).values('name')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0014_weekday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Direction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Line',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=8, unique=True)),
+                ('name', models.CharField(default='', max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Station',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='departure',
+            name='unique_departure',
+        ),
+        migrations.RemoveIndex(
+            model_name='departure',
+            name='departure_line_station_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='departure',
+            name='departure_line_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='departure',
+            name='departure_station_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='departure',
+            name='departure_line_date_idx',
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='line',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.line'),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='to_direction',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.direction'),
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='from_direction',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.direction'),
+        ),
+        migrations.RunPython(fill_dimensions, fill_names),
+        migrations.RemoveField(
+            model_name='departure',
+            name='line_number',
+        ),
+        migrations.RemoveField(
+            model_name='departure',
+            name='line_name',
+        ),
+        migrations.RemoveField(
+            model_name='departure',
+            name='direction',
+        ),
+        migrations.RemoveField(
+            model_name='departure',
+            name='direction_from',
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='line',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.line'),
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='to_direction',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.direction'),
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='from_direction',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.direction'),
+        ),
+        # The station ids become foreign keys of the stations and keep their columns
+        migrations.RenameField(
+            model_name='departure',
+            old_name='station_id',
+            new_name='station',
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='station',
+            field=models.ForeignKey(db_column='station_id', db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.station'),
+        ),
+        migrations.RenameField(
+            model_name='departure',
+            old_name='destination_id',
+            new_name='destination',
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='destination',
+            field=models.ForeignKey(db_column='destination_id', db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='delyzer.station'),
+        ),
+        migrations.AlterField(
+            model_name='departure',
+            name='delay',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line', 'to_direction', 'station', 'delay'], name='departure_line_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line', 'to_direction', 'planned_departure_time', 'delay'], name='departure_line_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['station', 'delay'], name='departure_station_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['line', 'to_direction', 'service_date'], name='departure_line_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='departure',
+            constraint=models.UniqueConstraint(fields=('station', 'line', 'to_direction', 'planned_departure_time', 'service_date'), name='unique_departure'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-17 23:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0015_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionHorizon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField(default=django.utils.timezone.localdate)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
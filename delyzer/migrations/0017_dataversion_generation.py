@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0016_retention_horizon'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='generation',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 00:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0017_dataversion_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeslotRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.CharField(default='', max_length=8)),
+                ('direction', models.CharField(default='', max_length=128)),
+                ('slot', models.SmallIntegerField(default=0)),
+                ('service_date', models.DateField(default=django.utils.timezone.localdate)),
+                ('weekday', models.SmallIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('delay_sum', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timeslotrollup',
+            index=models.Index(fields=['service_date'], name='timeslot_service_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslotrollup',
+            constraint=models.UniqueConstraint(fields=('line_number', 'direction', 'slot', 'service_date'), name='unique_timeslot_rollup'),
+        ),
+    ]
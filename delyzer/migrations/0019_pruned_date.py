@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 01:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delyzer', '0018_timeslot_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrunedDate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField(unique=True)),
+                ('pruned', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
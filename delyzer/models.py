@@ -3,20 +3,228 @@
 from django.db import models
 from django.utils import timezone
 
+# Fields that identify a physical departure. Repeated observations of it only update the existing row
+DEPARTURE_KEY_FIELDS = ['station', 'line', 'to_direction', 'planned_departure_time', 'service_date']
+
+# Values of the dimension tables by the names of the departure data of the collector and the api, see DepartureQuerySet.named
+DEPARTURE_NAMES = {
+  'line_number': 'line__number',
+  'line_name': 'line__name',
+  'direction': 'to_direction__name',
+  'direction_from': 'from_direction__name',
+}
+
+# Fields that identify a row of the delay rollup
+ROLLUP_KEY_FIELDS = ['line_number', 'direction', 'station_id', 'slot', 'service_date']
+
+# Length of the timeslots of the delay rollup in minutes
+SLOT_MINUTES = 30
+
+# Length of the timeslots of the timeslot rollup in minutes, the shortest timeslot of the analytics endpoints
+FINE_SLOT_MINUTES = 5
+
+# A departure counts as late if its delay in minutes is greater than this
+LATE_DELAY = 2
+
+class Line(models.Model):
+  """
+  Database model to save a line once, departures reference it instead of repeating its number and name
+  """
+
+  number = models.CharField(max_length=8, unique=True)
+  name = models.CharField(max_length=64, default='')
+
+  def __str__(self):
+    return self.number
+
+
+class Direction(models.Model):
+  """
+  Database model to save the name of a direction or origin of the lines once
+  """
+
+  name = models.CharField(max_length=128, unique=True)
+
+  def __str__(self):
+    return self.name
+
+
+class Station(models.Model):
+  """
+  Database model to save a station once, its id is the station id of the vvs api
+  """
+
+  id = models.IntegerField(primary_key=True)
+
+  def __str__(self):
+    return str(self.id)
+
+
+class DepartureQuerySet(models.QuerySet):
+  """
+  Queries of the departures
+  """
+
+  def named(self, *names):
+    """
+    Adds the line number, line name, direction and origin of the dimension tables with the names of the api,
+    so they can be filtered and selected like fields of the departure. Only the given names are added, all of them
+    if none is given, every name joins its dimension table.
+    """
+    return self.annotate(**{name: models.F(DEPARTURE_NAMES[name]) for name in names or DEPARTURE_NAMES})
+
+
 class Departure(models.Model):
   """
-  Database model to save a departure
+  Database model to save a departure. Lines, directions and stations are saved in their own tables,
+  a departure only keeps their ids.
   """
 
-  station_id = models.IntegerField(default=-1)
-  destination_id = models.IntegerField(default=-1)
-  direction = models.CharField(max_length=128, default='')
-  direction_from = models.CharField(max_length=128, default='')
-  line_number = models.CharField(max_length=8, default='')
-  line_name = models.CharField(max_length=64, default='')
+  # The columns keep the names of the former integer fields of the station ids. The ids get no index of their own,
+  # the indexes below start with them and the rows of the dimension tables are never deleted
+  station = models.ForeignKey(Station, on_delete=models.PROTECT, db_column='station_id', db_index=False, related_name='+')
+  destination = models.ForeignKey(Station, on_delete=models.PROTECT, db_column='destination_id', db_index=False, related_name='+')
+  to_direction = models.ForeignKey(Direction, on_delete=models.PROTECT, db_index=False, related_name='+')
+  from_direction = models.ForeignKey(Direction, on_delete=models.PROTECT, db_index=False, related_name='+')
+  line = models.ForeignKey(Line, on_delete=models.PROTECT, db_index=False, related_name='+')
   planned_departure_time = models.TimeField(default=timezone.now)
-  delay = models.IntegerField(default=0)
+  # Delay in minutes
+  delay = models.SmallIntegerField(default=0)
   current_date = models.DateTimeField(default=timezone.now)
+  service_date = models.DateField(default=timezone.localdate)
+  # ISO weekday of the service date, 1 is monday and 7 is sunday
+  weekday = models.SmallIntegerField(default=0)
+
+  objects = DepartureQuerySet.as_manager()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=DEPARTURE_KEY_FIELDS,
+        name='unique_departure'
+      )
+    ]
+    # Access paths of the analytics endpoints, the delay is included so the aggregates are answered from the index
+    indexes = [
+      models.Index(fields=['line', 'to_direction', 'station', 'delay'], name='departure_line_station_idx'),
+      models.Index(fields=['line', 'to_direction', 'planned_departure_time', 'delay'], name='departure_line_time_idx'),
+      models.Index(fields=['station', 'delay'], name='departure_station_idx'),
+      models.Index(fields=['planned_departure_time', 'delay'], name='departure_time_idx'),
+      models.Index(fields=['service_date'], name='departure_service_date_idx'),
+      models.Index(fields=['line', 'to_direction', 'service_date'], name='departure_line_date_idx'),
+      models.Index(fields=['current_date'], name='departure_current_date_idx'),
+    ]
+
+  def __str__(self):
+    return str(self.line)
+
+
+class DelayRollup(models.Model):
+  """
+  Database model to save the aggregated delays of all departures of a line and direction at a station
+  in one timeslot of a service day. It is updated by the collector whenever departures are saved.
+  """
+
+  line_number = models.CharField(max_length=8, default='')
+  direction = models.CharField(max_length=128, default='')
+  station_id = models.IntegerField(default=-1)
+  slot = models.SmallIntegerField(default=0)
+  service_date = models.DateField(default=timezone.localdate)
+  # ISO weekday of the service date, 1 is monday and 7 is sunday
+  weekday = models.SmallIntegerField(default=0)
+  count = models.IntegerField(default=0)
+  delay_sum = models.BigIntegerField(default=0)
+  delay_square_sum = models.BigIntegerField(default=0)
+  late_count = models.IntegerField(default=0)
+  # Number of departures per minute of delay, encoded by Risk.encode, so the propability of any threshold can be computed
+  delay_histogram = models.BinaryField(default=bytes)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=ROLLUP_KEY_FIELDS,
+        name='unique_delay_rollup'
+      )
+    ]
+    indexes = [
+      models.Index(fields=['station_id'], name='rollup_station_idx'),
+      models.Index(fields=['service_date'], name='rollup_service_date_idx'),
+    ]
+
+  def __str__(self):
+    return self.line_number
+
+
+class TimeslotRollup(models.Model):
+  """
+  Database model to save the aggregated delays of all departures of a line and direction in a short timeslot of a
+  service day. The command retain_departures folds the departures into it before it deletes them, so the short
+  timeslots of the analytics endpoints are still answered for the service dates before the retention horizon.
+  """
+
+  line_number = models.CharField(max_length=8, default='')
+  direction = models.CharField(max_length=128, default='')
+  # Index of the timeslot of FINE_SLOT_MINUTES
+  slot = models.SmallIntegerField(default=0)
+  service_date = models.DateField(default=timezone.localdate)
+  # ISO weekday of the service date, 1 is monday and 7 is sunday
+  weekday = models.SmallIntegerField(default=0)
+  count = models.IntegerField(default=0)
+  delay_sum = models.BigIntegerField(default=0)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=['line_number', 'direction', 'slot', 'service_date'],
+        name='unique_timeslot_rollup'
+      )
+    ]
+    indexes = [
+      models.Index(fields=['service_date'], name='timeslot_service_date_idx'),
+    ]
+
+  def __str__(self):
+    return self.line_number
+
+
+class DataVersion(models.Model):
+  """
+  Database model with a single row that counts the changes of the delay rollup. The collector increments the version
+  in the transaction that saves departures, so cached responses of the analytics endpoints can be checked against it.
+  """
+
+  version = models.BigIntegerField(default=0)
+  updated = models.DateTimeField(default=timezone.now)
+  # Counts the deletions of departures, the departure store is only loaded again if it changed
+  generation = models.BigIntegerField(default=0)
+
+  def __str__(self):
+    return str(self.version)
+
+
+class RetentionHorizon(models.Model):
+  """
+  Database model with a single row that saves the first service date whose departures are kept in the database.
+  The command retain_departures moves it forward, the departures of the service dates before it are only kept
+  in the delay rollup.
+  """
+
+  service_date = models.DateField(default=timezone.localdate)
+  updated = models.DateTimeField(default=timezone.now)
+
+  def __str__(self):
+    return str(self.service_date)
+
+
+class PrunedDate(models.Model):
+  """
+  Database model to save the service dates whose departures the command archive_departures --prune deleted from the
+  database. Their departures are only kept in the archive and in the delay rollup, so the rollup of these service
+  dates is never rebuilt.
+  """
+
+  service_date = models.DateField(unique=True)
+  pruned = models.DateTimeField(default=timezone.now)
 
   def __str__(self):
-    return self.line_number
\ No newline at end of file
+    return str(self.service_date)
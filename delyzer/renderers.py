@@ -0,0 +1,89 @@
+# Samuel Matzeit
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+import json
+import pandas as pd
+
+from .utils.render import Render
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer of newline delimited json, one json document per line. Selected with format=ndjson or the Accept header
+    application/x-ndjson. Views stream their rows themselves, the renderer is only used for responses with data.
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode(self.charset)
+
+
+class TableRenderer(BaseRenderer):
+    """
+    Base of the renderers of the table formats, see Render.FORMATS. The views encode their responses themselves with
+    Render, the renderers only select the format and encode the responses of the rest framework, e.g. errors.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or Render.unavailable(self.format) is not None:
+            return b''
+        if self.format == 'msgpack':
+            return Render.msgpack(data)
+        return Render.table(pd.DataFrame(data if isinstance(data, list) else [data]), self.format)
+
+
+class CSVRenderer(TableRenderer):
+    """
+    Renderer of comma separated values with a header row. Selected with format=csv or the Accept header text/csv.
+    """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+
+class ArrowRenderer(TableRenderer):
+    """
+    Renderer of the Apache Arrow IPC stream format. Selected with format=arrow or the Accept header
+    application/vnd.apache.arrow.stream, needs pyarrow.
+    """
+
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+
+
+class ParquetRenderer(TableRenderer):
+    """
+    Renderer of Apache Parquet files. Selected with format=parquet or the Accept header application/vnd.apache.parquet,
+    needs pyarrow.
+    """
+
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+    charset = None
+
+
+class MessagePackRenderer(TableRenderer):
+    """
+    Renderer of MessagePack. Selected with format=msgpack or the Accept header application/msgpack, needs msgpack.
+    """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+
+
+class FormatNegotiation(DefaultContentNegotiation):
+    """
+    Content negotiation of the rest framework that falls back to the renderers of the Accept header for an unknown
+    format instead of answering 404, so the views refuse it with 400 like the async views, see Render.format.
+    """
+
+    def filter_renderers(self, renderers, format):
+        return [renderer for renderer in renderers if renderer.format == format] or renderers
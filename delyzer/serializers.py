@@ -8,6 +8,16 @@ class DepartureSerializer(serializers.ModelSerializer):
   Serializer to check if given data satisfies the required fields to save it to the database
   """
 
+  # Values of the dimension tables, departures are read with Departure.objects.named
+  station_id = serializers.IntegerField(default=-1)
+  destination_id = serializers.IntegerField(default=-1)
+  direction = serializers.CharField(max_length=128, default='')
+  direction_from = serializers.CharField(max_length=128, default='')
+  line_number = serializers.CharField(max_length=8, default='')
+  line_name = serializers.CharField(max_length=64, default='')
+  # Range of the small integer column, not every database checks it
+  delay = serializers.IntegerField(min_value=-32768, max_value=32767, default=0)
+
   class Meta:
     model = Departure
     fields = [
@@ -20,5 +30,9 @@ class DepartureSerializer(serializers.ModelSerializer):
       'line_name',
       'planned_departure_time',
       'delay',
-      'current_date'
+      'current_date',
+      'service_date',
+      'weekday'
     ]
+    # Repeated observations of a departure are valid, the collector updates the existing row
+    validators = []
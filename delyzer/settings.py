@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -164,3 +165,53 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Formats of the endpoints, selected with the query parameter format or the Accept header. Arrow and Parquet need
+# pyarrow, MessagePack needs msgpack, without them the formats are answered with 406
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'delyzer.renderers.CSVRenderer',
+        'delyzer.renderers.ArrowRenderer',
+        'delyzer.renderers.ParquetRenderer',
+        'delyzer.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'delyzer.renderers.FormatNegotiation',
+}
+
+
+# Response cache of the analytics endpoints, per process and evicted least recently used
+
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Directory of the lock and result files that let the processes of the server compute a response once for all of them,
+# e.g. BASE_DIR / '.response_locks'. Without it concurrent requests are only coalesced inside of each process
+
+RESPONSE_CACHE_LOCK_DIR = None
+
+# Directory that the command publish_departures publishes the departure store into. If set, every worker maps the
+# published departures read only instead of loading its own copy, e.g. BASE_DIR / '.departure_store'
+
+DEPARTURE_STORE_DIR = None
+
+# Directory of the Parquet archive that the command archive_departures writes the closed service days into. If set, the
+# timeslots shorter than the rollup also contain the archived departures that were pruned from the database,
+# e.g. BASE_DIR / '.departure_archive'
+
+DEPARTURE_ARCHIVE_DIR = None
+
+# Number of service days before today whose departures the command retain_departures keeps in the database. Older
+# departures are deleted, the analytics endpoints answer their service dates from the delay rollup. None keeps all departures
+
+DEPARTURE_RETENTION_DAYS = None
+
+# Serve the read endpoints with their async variants, see async_views. delyzer/asgi.py turns it on, so the
+# ASGI server answers many slow clients on one event loop while at most ASYNC_VIEW_WORKERS aggregations run at once
+
+ASYNC_VIEWS = os.environ.get('DELYZER_ASYNC_VIEWS', '0') == '1'
+
+ASYNC_VIEW_WORKERS = 4
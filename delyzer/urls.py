@@ -15,26 +15,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from delyzer import views
+from delyzer import async_views, views
+
+# Under ASGI the read endpoints are served by their async variants, see ASYNC_VIEWS
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('departures/', views.departure_list),
-    path('departures/<int:id>', views.departure_detail),
-    path('lines/', views.lines),
-    path('stations/', views.stations),
-    path('delay/lines', views.lines_by_delay),
-    path('delay/line/<str:line>/<str:direction>', views.line_by_delay),
-    path('delay/times', views.delay_at_time),
-    path('delay/times/<str:line>/<str:direction>', views.line_delay_at_time),
-    path('delay/stations', views.delay_at_station),
-    path('delay/stations/<str:line>/<str:direction>', views.line_delay_at_station),
-    path('propability/stations', views.propability_at_stations),
-    path('propability/station/<str:station>', views.propability_at_station),
-    path('propability/stations/<str:line>/<str:direction>', views.propability_at_stations_of_line),
-    path('propability/line/<str:line>/<str:direction>', views.propability_of_line),
-    path('propability/lines', views.propability_of_lines),
+    path('departures/<int:id>', read_views.departure_detail),
+    path('lines/', read_views.lines),
+    path('stations/', read_views.stations),
+    path('delay/lines', read_views.lines_by_delay),
+    path('delay/line/<str:line>/<str:direction>', read_views.line_by_delay),
+    path('delay/times', read_views.delay_at_time),
+    path('delay/times/<str:line>/<str:direction>', read_views.line_delay_at_time),
+    path('delay/stations', read_views.delay_at_station),
+    path('delay/stations/<str:line>/<str:direction>', read_views.line_delay_at_station),
+    path('propability/stations', read_views.propability_at_stations),
+    path('propability/station/<str:station>', read_views.propability_at_station),
+    path('propability/stations/<str:line>/<str:direction>', read_views.propability_at_stations_of_line),
+    path('propability/line/<str:line>/<str:direction>', read_views.propability_of_line),
+    path('propability/lines', read_views.propability_of_lines),
+    path('dashboard/<str:line>/<str:direction>', read_views.line_dashboard),
 
 ]
@@ -0,0 +1,239 @@
+# Samuel Matzeit
+import numpy as np
+import pandas as pd
+import datetime
+import logging
+import os
+import urllib.parse
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError:
+    # The archive needs pyarrow
+    pyarrow = None
+
+from ..models import Departure
+
+logger = logging.getLogger(__name__)
+
+class DepartureArchive:
+    """Class DepartureArchive
+    description:
+        * Parquet files of the departures of closed service days, written by the command archive_departures
+        * One file per service date and line in the directories service_date=<date>/line_number=<line>, so a scan only
+          opens the files of its time window and line
+        * Strings are dictionary encoded, the numbers are saved with the smallest type that fits them
+        * Scans map the files and only read the columns they need, see DepartureArchive.frame
+    """
+
+    # Values of the departures that are archived
+    FIELDS = [
+        'id', 'station_id', 'destination_id', 'direction', 'direction_from', 'line_number', 'line_name',
+        'planned_departure_time', 'delay', 'current_date', 'service_date', 'weekday'
+    ]
+
+    # Columns of the files, line_number and service_date are the partitions of the directory
+    SCHEMA = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('station_id', pyarrow.int32()),
+        ('destination_id', pyarrow.int32()),
+        ('direction', pyarrow.dictionary(pyarrow.int16(), pyarrow.string())),
+        ('direction_from', pyarrow.dictionary(pyarrow.int16(), pyarrow.string())),
+        ('line_name', pyarrow.dictionary(pyarrow.int16(), pyarrow.string())),
+        ('planned_departure_time', pyarrow.time32('s')),
+        ('delay', pyarrow.int16()),
+        ('current_date', pyarrow.timestamp('ms', tz='UTC')),
+        ('weekday', pyarrow.int8()),
+    ]) if pyarrow is not None else None
+
+    PARTITIONING = pyarrow.schema([
+        ('service_date', pyarrow.date32()),
+        ('line_number', pyarrow.string()),
+    ]) if pyarrow is not None else None
+
+    # Name of the file of a partition
+    FILE = 'departures.parquet'
+
+    def __init__(self, directory:str) -> None:
+        if pyarrow is None:
+            raise ImportError('The departure archive needs the package pyarrow')
+        self.__directory = directory
+
+    def days(self) -> list:
+        """days
+        description:
+            * Returns the archived service dates
+
+        Returns:
+            list: Service dates in ascending order
+        """
+
+        if not os.path.isdir(self.__directory):
+            return []
+        return sorted(
+            datetime.date.fromisoformat(entry.name.partition('=')[2])
+            for entry in os.scandir(self.__directory) if entry.is_dir() and entry.name.startswith('service_date=')
+        )
+
+    def write(self, service_date:datetime.date) -> int:
+        """write
+        description:
+            * Writes the departures of the service date from the database into one file per line
+            * Departures of an archived file that are not in the database anymore are kept, so a day can be archived
+              again after late departures were saved even if the first run pruned it
+            * Every file is written next to the old one and replaces it at once
+
+        Returns:
+            int: Number of archived departures of the service date
+
+        Args:
+            service_date (datetime.date): Closed service date
+
+        tests:
+            * Test if the archived departures of a day equal its departures in the database
+            * Test if archiving a day twice doesn't duplicate a departure
+            * Test if departures that were pruned after the first run are kept by the second run
+        """
+
+        departures = Departure.objects.named().filter(service_date=service_date).order_by('id').values_list(*DepartureArchive.FIELDS)
+        departures_df = pd.DataFrame.from_records(list(departures), columns=DepartureArchive.FIELDS)
+        archived = 0
+        for line, line_df in departures_df.groupby('line_number', sort=False):
+            table = self.table(line_df)
+            path = self.path(service_date, line)
+            if os.path.exists(path):
+                previous = pyarrow.parquet.read_table(path, schema=DepartureArchive.SCHEMA)
+                kept = pyarrow.compute.invert(pyarrow.compute.is_in(previous['id'], value_set=table['id']))
+                table = pyarrow.concat_tables([previous.filter(kept), table]).sort_by('id')
+                table = table.unify_dictionaries().combine_chunks()
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Scans skip files that start with a dot, so they never see the temporary file
+            temporary = os.path.join(os.path.dirname(path), '.' + DepartureArchive.FILE + '.tmp')
+            pyarrow.parquet.write_table(table, temporary, compression='zstd', use_dictionary=True)
+            os.replace(temporary, path)
+            archived += len(table)
+        return archived
+
+    def table(self, departures_df:pd.DataFrame) -> 'pyarrow.Table':
+        """table
+        description:
+            * Converts departures of the database into the columns of the archive
+
+        Returns:
+            pyarrow.Table: Departures with the SCHEMA of the archive
+
+        Args:
+            departures_df (pd.DataFrame): Values of FIELDS of the departures
+        """
+
+        times = departures_df['planned_departure_time']
+        return pyarrow.table({
+            'id': pyarrow.array(departures_df['id'], pyarrow.int64()),
+            'station_id': pyarrow.array(departures_df['station_id'], pyarrow.int32()),
+            'destination_id': pyarrow.array(departures_df['destination_id'], pyarrow.int32()),
+            'direction': pyarrow.array(departures_df['direction'], pyarrow.string()).dictionary_encode().cast(DepartureArchive.SCHEMA.field('direction').type),
+            'direction_from': pyarrow.array(departures_df['direction_from'], pyarrow.string()).dictionary_encode().cast(DepartureArchive.SCHEMA.field('direction_from').type),
+            'line_name': pyarrow.array(departures_df['line_name'], pyarrow.string()).dictionary_encode().cast(DepartureArchive.SCHEMA.field('line_name').type),
+            'planned_departure_time': pyarrow.array([time.hour * 3600 + time.minute * 60 + time.second for time in times], pyarrow.int32()).cast(pyarrow.time32('s')),
+            'delay': pyarrow.array(departures_df['delay'], pyarrow.int16()),
+            'current_date': pyarrow.array(departures_df['current_date']).cast(DepartureArchive.SCHEMA.field('current_date').type, safe=False),
+            'weekday': pyarrow.array(departures_df['weekday'], pyarrow.int8()),
+        }, schema=DepartureArchive.SCHEMA)
+
+    def path(self, service_date:datetime.date, line:str) -> str:
+        """path
+        description:
+            * Returns the file of the service date and line, the line is encoded like pyarrow encodes partitions
+
+        Returns:
+            string: Path of the file
+        """
+
+        return os.path.join(
+            self.__directory, f'service_date={service_date.isoformat()}', f'line_number={urllib.parse.quote(line, safe="")}',
+            DepartureArchive.FILE
+        )
+
+    def dataset(self) -> 'pyarrow.dataset.Dataset':
+        """dataset
+        description:
+            * Returns the archived files as one dataset, the files are mapped instead of read into buffers
+
+        Returns:
+            pyarrow.dataset.Dataset: Dataset of the archive
+        """
+
+        return pyarrow.dataset.dataset(
+            self.__directory,
+            schema=pyarrow.unify_schemas([DepartureArchive.SCHEMA, DepartureArchive.PARTITIONING]),
+            format='parquet',
+            partitioning=pyarrow.dataset.partitioning(DepartureArchive.PARTITIONING, flavor='hive'),
+            filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+            exclude_invalid_files=False,
+            ignore_prefixes=['.', '_']
+        )
+
+    def frame(self, line:str=None, direction:str=None, window:dict=None, exclude:np.ndarray=None) -> pd.DataFrame:
+        """frame
+        description:
+            * Returns the archived departures of the line, direction and time window as delay data for the Filter functions,
+              with the columns of DepartureStore.frame
+            * The line and the service dates of the window only open the files of their partitions, the other filters
+              are applied while the row groups are read and only the needed columns are read
+
+        Returns:
+            DataFrame: Delay data with the columns id, line_number, direction, station_id, delay, seconds and weekday
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            window (dict): Time window, see Window.params
+            exclude (np.ndarray): Sorted ids of departures that are left out, e.g. because they are still in the database
+
+        tests:
+            * Test if the result of an archived and pruned day equals the delay data of the day before it was pruned
+            * Test if a departure that is archived and still in the database is returned once
+        """
+
+        columns = ['id', 'line_number', 'direction', 'station_id', 'delay', 'planned_departure_time', 'weekday']
+        if not self.days():
+            return pd.DataFrame({column: [] for column in columns[:-2] + ['seconds', 'weekday']})
+
+        field = pyarrow.dataset.field
+        expression = None
+        window = window or {}
+        conditions = [
+            field('line_number') == line if line is not None else None,
+            field('direction') == direction if direction is not None else None,
+            field('service_date') >= window['since'] if 'since' in window else None,
+            field('service_date') <= window['until'] if 'until' in window else None,
+            field('weekday').isin(window['weekdays']) if 'weekdays' in window else None,
+        ]
+        for condition in conditions:
+            if condition is not None:
+                expression = condition if expression is None else expression & condition
+
+        table = self.dataset().to_table(columns=columns, filter=expression)
+        seconds = table['planned_departure_time'].cast(pyarrow.int32()).to_numpy()
+        archive_df = pd.DataFrame({
+            'id': table['id'].to_numpy(),
+            'line_number': table['line_number'].to_numpy(zero_copy_only=False).astype(object),
+            'direction': table['direction'].cast(pyarrow.string()).to_numpy(zero_copy_only=False).astype(object),
+            'station_id': table['station_id'].to_numpy().astype(np.int64),
+            'delay': table['delay'].to_numpy().astype(np.int64),
+            'seconds': seconds,
+            'weekday': table['weekday'].to_numpy(),
+        })
+
+        mask = np.ones(len(archive_df), dtype=bool)
+        if 'hours' in window:
+            mask &= np.isin(seconds // 3600, window['hours'])
+        if exclude is not None and len(exclude):
+            positions = np.minimum(np.searchsorted(exclude, archive_df['id'].to_numpy()), len(exclude) - 1)
+            mask &= exclude[positions] != archive_df['id'].to_numpy()
+        return archive_df[mask].reset_index(drop=True)
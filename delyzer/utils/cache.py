@@ -0,0 +1,595 @@
+# Samuel Matzeit
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+try:
+    import fcntl
+except ImportError:
+    # Locks across processes are only available on POSIX systems
+    fcntl = None
+
+from ..models import DataVersion
+from .render import Render
+
+logger = logging.getLogger(__name__)
+
+# Id of the single row of the data version
+DATA_VERSION_ID = 1
+
+class ResponseCache:
+    """Class ResponseCache
+    description:
+        * Cache of the rendered responses of the analytics endpoints inside of the process
+        * An entry is only valid for the data version it was computed for, so new departures invalidate every entry
+        * Entries are evicted least recently used when the maximum number of entries or bytes is exceeded
+    """
+
+    def __init__(self, max_entries:int=256, max_bytes:int=32 * 1024 * 1024) -> None:
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+
+    def get(self, key:str, version:int) -> tuple:
+        """get
+        description:
+            * Returns the cached response of the key if it was computed for the given version
+            * Marks the entry as recently used
+
+        Returns:
+            tuple: Content and content type of the response, None if there is no valid entry
+
+        Args:
+            key (string): Key of the request
+            version (int): Current data version
+
+        tests:
+            * Test if a put entry is returned for the same version
+            * Test if a put entry is not returned for another version
+        """
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.__entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key:str, version:int, content:bytes, content_type:str) -> None:
+        """put
+        description:
+            * Saves the response of the key for the given version and evicts the least recently used entries
+            * Responses larger than the maximum bytes are not cached
+
+        Args:
+            key (string): Key of the request
+            version (int): Data version the response was computed for
+            content (bytes): Content of the response
+            content_type (string): Content type of the response
+
+        tests:
+            * Test if the oldest entry is evicted when the maximum number of entries is exceeded
+            * Test if the size of the entries never exceeds the maximum bytes
+        """
+
+        if len(content) > self.__max_bytes:
+            return
+
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__size -= len(previous[1])
+            self.__entries[key] = (version, content, content_type)
+            self.__size += len(content)
+            while len(self.__entries) > self.__max_entries or self.__size > self.__max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__size -= len(evicted[1])
+
+    def clear(self) -> None:
+        """clear
+        description:
+            * Removes all entries
+        """
+
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+    @staticmethod
+    def version() -> tuple:
+        """version
+        description:
+            * Returns the current data version and the time of its last change
+
+        Returns:
+            tuple: Version and datetime of the last change
+        """
+
+        data_version = DataVersion.objects.filter(pk=DATA_VERSION_ID).values_list('version', 'updated').first()
+        if data_version is None:
+            return 0, None
+        return data_version
+
+    @staticmethod
+    async def aversion() -> tuple:
+        """aversion
+        description:
+            * Returns the current data version like version, read with the async ORM
+
+        Returns:
+            tuple: Version and datetime of the last change
+        """
+
+        data_version = await DataVersion.objects.filter(pk=DATA_VERSION_ID).values_list('version', 'updated').afirst()
+        if data_version is None:
+            return 0, None
+        return data_version
+
+    @staticmethod
+    def generation() -> tuple:
+        """generation
+        description:
+            * Returns the current data version and the number of deletions of departures, see DepartureStore.refresh
+
+        Returns:
+            tuple: Version and generation
+        """
+
+        data_version = DataVersion.objects.filter(pk=DATA_VERSION_ID).values_list('version', 'generation').first()
+        if data_version is None:
+            return 0, 0
+        return data_version
+
+    @staticmethod
+    def bump(deleted:bool=False) -> None:
+        """bump
+        description:
+            * Increments the data version, has to be called inside of the transaction that changes the delay rollup
+            * Every deletion of departures has to increment the generation as well with deleted, otherwise the
+              departure store keeps the deleted departures
+
+        Args:
+            deleted (bool): Wether departures were deleted
+
+        tests:
+            * Test if the version is greater after bump
+            * Test if the version is created if it doesn't exist
+            * Test if only deleted increments the generation
+        """
+
+        changes = {'version': F('version') + 1, 'updated': timezone.now()}
+        if deleted:
+            changes['generation'] = F('generation') + 1
+        updated = DataVersion.objects.filter(pk=DATA_VERSION_ID).update(**changes)
+        if not updated:
+            DataVersion.objects.create(pk=DATA_VERSION_ID, version=1, generation=1 if deleted else 0)
+
+
+response_cache = ResponseCache(
+    getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 256),
+    getattr(settings, 'RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+)
+
+
+class SingleFlight:
+    """Class SingleFlight
+    description:
+        * Lets concurrent requests with the same key and data version wait for one computation and share its response,
+          so many requests after a new data version or an evicted entry cause one computation instead of one each
+        * Inside of the process the requests wait on a lock of the key (sync views) or on the future of the running
+          computation (async views)
+        * If a directory is given, processes wait on a lock file of the key and share the response through a result
+          file of the data version, the result files are removed after SHARED_SECONDS
+        * The keys share a fixed number of lock files, so arbitrary query parameters can't fill the directory
+    """
+
+    # Seconds a result file is kept for the other processes
+    SHARED_SECONDS = 300
+    # Number of lock files, keys of the same lock file wait for each other
+    LOCK_STRIPES = 256
+
+    def __init__(self, directory:str=None) -> None:
+        if directory and fcntl is None:
+            logger.warning('Locks across processes are not available on this system, requests are only coalesced per process')
+            directory = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__directory = directory
+        self.__lock = threading.Lock()
+        # Lock and number of waiting requests of every key
+        self.__keys = {}
+        # Future of the running async computation of every event loop and key
+        self.__flights = {}
+
+    def run(self, key:tuple, compute) -> HttpResponse:
+        """run
+        description:
+            * Returns the cached response of the key or computes it, only one request per key computes at a time
+
+        Returns:
+            HttpResponse: Cached or computed response
+
+        Args:
+            key (tuple): Key and data version, see cached
+            compute (function): Function that computes the response
+
+        tests:
+            * Test if 10 concurrent requests with the same key compute the response once
+            * Test if requests with different keys compute at the same time
+            * Test if an error response is not shared with the waiting requests
+        """
+
+        with self.__lock:
+            entry = self.__keys.setdefault(key[0], [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                response = SingleFlight.cached(key)
+                if response is not None:
+                    return response
+                handle = self.acquire(key)
+                try:
+                    response = self.read(key)
+                    if response is None:
+                        response = compute()
+                        self.share(key, response)
+                    return response
+                finally:
+                    self.release(handle)
+        finally:
+            with self.__lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.__keys[key[0]]
+
+    async def arun(self, key:tuple, compute) -> HttpResponse:
+        """arun
+        description:
+            * Returns the cached response of the key or computes it like run, for async views
+            * The lock file is acquired in a thread, so the event loop never waits on another process
+
+        Returns:
+            HttpResponse: Cached or computed response
+
+        Args:
+            key (tuple): Key and data version, see cached
+            compute (function): Async function that computes the response
+
+        tests:
+            * Test if 10 concurrent async requests with the same key compute the response once
+        """
+
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key[0])
+        while True:
+            response = SingleFlight.cached(key)
+            if response is not None:
+                return response
+            flight = self.__flights.get(flight_key)
+            if flight is None:
+                break
+            await asyncio.shield(flight)
+            if flight.result() is not True:
+                # The computation failed or wasn't cacheable, so every waiting request computes its own response
+                return await compute()
+
+        flight = loop.create_future()
+        self.__flights[flight_key] = flight
+        shared = False
+        try:
+            handle = await loop.run_in_executor(None, self.acquire, key) if self.__directory else None
+            try:
+                response = self.read(key)
+                if response is None:
+                    response = await compute()
+                    self.share(key, response)
+                shared = cacheable(response)
+                return response
+            finally:
+                self.release(handle)
+        finally:
+            del self.__flights[flight_key]
+            flight.set_result(shared)
+
+    @staticmethod
+    def cached(key:tuple) -> HttpResponse:
+        """cached
+        description:
+            * Returns the response of the key from the response cache of the process
+
+        Returns:
+            HttpResponse: Cached response, None if there is no valid entry
+
+        Args:
+            key (tuple): Key and data version, see cached
+        """
+
+        content = response_cache.get(*key)
+        if content is None:
+            return None
+        return HttpResponse(content[0], content_type=content[1])
+
+    def path(self, key:tuple, suffix:str) -> str:
+        """path
+        description:
+            * Returns the path of the result file of the key
+
+        Returns:
+            string: Path inside of the directory
+
+        Args:
+            key (tuple): Key and data version, see cached
+            suffix (string): Data version of the result file
+        """
+
+        return os.path.join(self.__directory, hashlib.sha1(key[0].encode('utf-8')).hexdigest() + '.' + suffix)
+
+    def stripe(self, key:tuple) -> str:
+        """stripe
+        description:
+            * Returns the path of the lock file of the key, one of LOCK_STRIPES lock files
+
+        Returns:
+            string: Path inside of the directory
+
+        Args:
+            key (tuple): Key and data version, see cached
+
+        tests:
+            * Test if requests with 1000 different query parameters leave at most LOCK_STRIPES lock files
+        """
+
+        stripe = int(hashlib.sha1(key[0].encode('utf-8')).hexdigest(), 16) % SingleFlight.LOCK_STRIPES
+        return os.path.join(self.__directory, 'stripe-%03d.lock' % stripe)
+
+    def acquire(self, key:tuple):
+        """acquire
+        description:
+            * Waits for the lock file of the key, if there is a directory
+
+        Returns:
+            file: Open lock file, None without a directory
+
+        Args:
+            key (tuple): Key and data version, see cached
+        """
+
+        if self.__directory is None:
+            return None
+        handle = open(self.stripe(key), 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def release(self, handle) -> None:
+        """release
+        description:
+            * Releases the lock file
+
+        Args:
+            handle (file): Open lock file, see acquire
+        """
+
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def read(self, key:tuple) -> HttpResponse:
+        """read
+        description:
+            * Returns the response that another process computed for the key and data version
+
+        Returns:
+            HttpResponse: Shared response, None if there is no result file
+
+        Args:
+            key (tuple): Key and data version, see cached
+        """
+
+        if self.__directory is None:
+            return None
+        try:
+            with open(self.path(key, str(key[1])), 'rb') as file:
+                content_type, content = file.read().split(b'\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        response_cache.put(key[0], key[1], content, content_type.decode('utf-8'))
+        return HttpResponse(content, content_type=content_type.decode('utf-8'))
+
+    def share(self, key:tuple, response) -> None:
+        """share
+        description:
+            * Saves a successful response in the response cache and in the result file for the other processes
+            * Removes the expired result files, and the lock files of single keys that older versions left behind
+
+        Args:
+            key (tuple): Key and data version, see cached
+            response (HttpResponse): Computed response
+        """
+
+        if not cacheable(response):
+            return
+        response_cache.put(key[0], key[1], response.content, response['Content-Type'])
+        if self.__directory is None:
+            return
+
+        path = self.path(key, str(key[1]))
+        with open(path + '.tmp', 'wb') as file:
+            file.write(response['Content-Type'].encode('utf-8') + b'\n' + response.content)
+        os.replace(path + '.tmp', path)
+
+        expired = time.time() - SingleFlight.SHARED_SECONDS
+        for entry in os.scandir(self.__directory):
+            if not entry.name.startswith('stripe-') and entry.stat().st_mtime < expired:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+single_flight = SingleFlight(getattr(settings, 'RESPONSE_CACHE_LOCK_DIR', None))
+
+
+def cached_response(view):
+    """cached_response
+    description:
+        * Decorator of an analytics view that caches its responses by path, query parameters and data version
+        * Responses carry an ETag and Last-Modified header of the data version, a request with the current
+          ETag in If-None-Match or a newer If-Modified-Since is answered with 304 without computing the response
+        * Only successful responses are cached
+        * Responses are compressed if the client accepts it, see Render.encoding
+        * Concurrent requests of the same key compute the response once, see SingleFlight
+
+    Returns:
+        function: Decorated view
+
+    Args:
+        view (function): View that returns a JsonResponse
+
+    tests:
+        * Test if the second request returns the cached content without database queries for the aggregation
+        * Test if a request with the ETag of the first response returns 304
+        * Test if a request after new departures were saved returns a new ETag
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, etag, last_modified, response = cached(request, *ResponseCache.version())
+        if response is None:
+            response = single_flight.run(key, lambda: view(request, *args, **kwargs))
+            if not cacheable(response):
+                return response
+        return validated(request, response, key, etag, last_modified)
+
+    return wrapper
+
+
+def async_cached_response(view):
+    """async_cached_response
+    description:
+        * Decorator of an async analytics view like cached_response
+        * The data version is read with the async ORM, so a 304 or a cached response never waits for a thread
+
+    Returns:
+        function: Decorated async view
+
+    Args:
+        view (function): Async view that returns a JsonResponse
+
+    tests:
+        * Test if the async view returns the same ETag and content as the sync view
+        * Test if a request with the ETag of the first response returns 304
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key, etag, last_modified, response = cached(request, *await ResponseCache.aversion())
+        if response is None:
+            response = await single_flight.arun(key, lambda: view(request, *args, **kwargs))
+            if not cacheable(response):
+                return response
+        return validated(request, response, key, etag, last_modified)
+
+    return wrapper
+
+
+def cached(request, version:int, updated) -> tuple:
+    """cached
+    description:
+        * Returns the cache key and validators of the request and the response if it doesn't need to be computed,
+          either 304 or the cached content
+
+    Returns:
+        tuple: Key, ETag, Last-Modified timestamp and the response, None if the view has to compute it
+
+    Args:
+        request (HttpRequest): Request of the view
+        version (int): Current data version
+        updated (datetime): Time of the last change of the data version
+    """
+
+    # The date is part of the key because responses with timeslots contain the current date
+    query = urllib.parse.urlencode(sorted(request.GET.lists()), doseq=True)
+    key = '|'.join([request.path, query, str(timezone.localdate())])
+    # The format of the Accept header selects another representation, the query parameter format is part of the query
+    accepted = Render.accepted(request.headers.get('Accept'))
+    if accepted != 'json':
+        key += '|' + accepted
+    # Every content encoding is another representation of the response with its own ETag
+    encoding = Render.encoding(request.headers.get('Accept-Encoding'))
+    etag = '"%s-%s%s"' % (version, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], '-' + encoding if encoding else '')
+    last_modified = int(updated.timestamp()) if updated else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content = response_cache.get(key, version)
+        if content is not None:
+            response = HttpResponse(content[0], content_type=content[1])
+    return (key, version), etag, last_modified, response
+
+
+def cacheable(response) -> bool:
+    """cacheable
+    description:
+        * Returns wether a computed response is cached and shared, only successful responses that are not streamed are
+
+    Returns:
+        bool: Wether the response is cached
+
+    Args:
+        response (HttpResponse): Computed response
+    """
+
+    return response.status_code == 200 and not response.streaming
+
+
+def validated(request, response, key:tuple, etag:str, last_modified:int):
+    """validated
+    description:
+        * Adds the validators of the data version to the response
+        * Compresses successful responses with the content encoding the client accepts, the compressed content is
+          cached like the content, so a cached response is compressed only once per data version
+
+    Returns:
+        HttpResponse: Response with the headers ETag, Last-Modified, Cache-Control and Vary
+
+    Args:
+        request (HttpRequest): Request of the view
+        response (HttpResponse): Response of the request
+        key (tuple): Key and data version, see cached
+        etag (string): ETag of the response
+        last_modified (int): Timestamp of the last change of the data, None if unknown
+    """
+
+    encoding = Render.encoding(request.headers.get('Accept-Encoding'))
+    # Parquet is compressed already
+    if (encoding and cacheable(response) and len(response.content) >= Render.MIN_COMPRESS_BYTES
+            and response['Content-Type'] != Render.FORMATS['parquet']):
+        encoded_key = key[0] + '|' + encoding
+        compressed = response_cache.get(encoded_key, key[1])
+        if compressed is None:
+            compressed = (Render.compress(response.content, encoding), response['Content-Type'])
+            response_cache.put(encoded_key, key[1], *compressed)
+        response.content = compressed[0]
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the response but have to revalidate it, which costs a 304 if nothing changed
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,260 @@
+# Dennis Hilgert
+
+from django.conf import settings
+import logging, os, pickle, threading, pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Station numbers in vvs_haltestellen.csv have to be shifted into the format of the api and of vvs_data.csv
+STATION_ID_OFFSET = 5000000
+
+class StationCatalog:
+    """
+    Lookup tables of the stations and lines of the network, compiled once from vvs_data.csv and vvs_haltestellen.csv.
+    The compiled tables are cached in a binary file that is only rebuilt when one of the csv files changes.
+    """
+
+    CACHE_VERSION = 1
+
+    __instance = None
+    __lock = threading.Lock()
+
+    def __init__(self, stations_path=None, lines_path=None, cache_path=None) -> None:
+        self.__stations_path = stations_path or settings.BASE_DIR / 'vvs_data.csv'
+        self.__lines_path = lines_path or settings.BASE_DIR / 'vvs_haltestellen.csv'
+        self.__cache_path = cache_path or settings.BASE_DIR / '.station_catalog.pickle'
+
+        self.__mtimes: tuple = None
+        # Name of every station by its station id
+        self.__names: dict = {}
+        # Station ids of every line and every fare zone, in the order of vvs_haltestellen.csv
+        self.__line_stations: dict = {}
+        self.__zone_stations: dict = {}
+        # Lines of every station by its station id
+        self.__station_lines: dict = {}
+        self.__network: tuple = ()
+
+
+
+    @classmethod
+    def get(cls) -> 'StationCatalog':
+        """
+        Returns the catalog of the process and reloads it if one of the csv files changed since it was loaded
+
+        Returns:
+            StationCatalog: Loaded catalog
+
+        Tests:
+            * Call it twice: Function should return the same catalog without reading the csv files again
+            * Call it after vvs_data.csv was modified: Function should return the catalog with the new data
+        """
+
+        with cls.__lock:
+            if cls.__instance is None:
+                cls.__instance = StationCatalog()
+            cls.__instance.refresh()
+            return cls.__instance
+
+
+
+    def refresh(self) -> None:
+        """
+        Loads the catalog from the cache file, or compiles it from the csv files if they changed since the cache was written
+        """
+
+        mtimes = (os.path.getmtime(self.__stations_path), os.path.getmtime(self.__lines_path))
+        if mtimes == self.__mtimes:
+            return
+
+        tables = self.read_cache(mtimes)
+        if tables is None:
+            logger.info('Compiling station catalog from csv files')
+            tables = self.compile()
+            self.write_cache(mtimes, tables)
+
+        self.__names = tables['names']
+        self.__line_stations = tables['line_stations']
+        self.__zone_stations = tables['zone_stations']
+        self.__station_lines = tables['station_lines']
+        self.__network = tables['network']
+        self.__mtimes = mtimes
+
+
+
+    def compile(self) -> dict:
+        """
+        Parses the csv files into the lookup tables. Lines and zones are matched by their exact tokens,
+        so that e.g. S1 does not match the stations of S11.
+
+        Returns:
+            dict: Lookup tables of the catalog
+        """
+
+        stations_df = pd.read_csv(self.__stations_path, sep=',', encoding='utf-8')
+        names = dict(zip(stations_df['Nummer'].astype(int), stations_df['Name mit Ort']))
+
+        # Load the file in cp1252 encoding because it contains umlauts
+        lines_df = pd.read_csv(self.__lines_path, sep=';', encoding='cp1252', dtype={'Linien (EFA)': str, 'Tarifzonen': str})
+        line_stations, zone_stations, station_lines = {}, {}, {}
+        network = []
+        for number, lines, zones in zip(lines_df['Nummer'], lines_df['Linien (EFA)'].fillna(''), lines_df['Tarifzonen'].fillna('')):
+            station_id = int(number) + STATION_ID_OFFSET
+            network.append(station_id)
+            station_lines[station_id] = tuple(line for line in lines.split(',') if line)
+            for line in station_lines[station_id]:
+                line_stations.setdefault(line, []).append(station_id)
+            for zone in zones.split(','):
+                if zone:
+                    zone_stations.setdefault(zone, []).append(station_id)
+
+        return {
+            'names': names,
+            'line_stations': {line: tuple(ids) for line, ids in line_stations.items()},
+            'zone_stations': {zone: tuple(ids) for zone, ids in zone_stations.items()},
+            'station_lines': station_lines,
+            'network': tuple(network),
+        }
+
+
+
+    def read_cache(self, mtimes: tuple) -> dict:
+        """
+        Reads the compiled lookup tables from the cache file
+
+        Args:
+            mtimes (tuple): Modification times of the csv files the tables have to be compiled from
+
+        Returns:
+            dict: Lookup tables or None if there is no valid cache for the given csv files
+        """
+
+        try:
+            with open(self.__cache_path, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if cache.get('version') != self.CACHE_VERSION or cache.get('mtimes') != mtimes:
+            return None
+        return cache['tables']
+
+
+
+    def write_cache(self, mtimes: tuple, tables: dict) -> None:
+        """
+        Writes the compiled lookup tables to the cache file. A failing write is logged because the catalog works without it.
+
+        Args:
+            mtimes (tuple): Modification times of the csv files the tables were compiled from
+            tables (dict): Compiled lookup tables
+        """
+
+        temporary_path = str(self.__cache_path) + '.tmp'
+        try:
+            with open(temporary_path, 'wb') as cache_file:
+                pickle.dump({'version': self.CACHE_VERSION, 'mtimes': mtimes, 'tables': tables}, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self.__cache_path)
+        except OSError as e:
+            logger.warning('Station catalog cache could not be written: %s', e)
+
+
+
+    def names(self) -> dict:
+        """
+        Returns:
+            dict: Name of every station by its station id
+        """
+
+        return self.__names
+
+
+
+    def name(self, station_id: int) -> str:
+        """
+        Returns:
+            str: Name of the station or None if the station id does not exist
+        """
+
+        return self.__names.get(int(station_id))
+
+
+
+    def contains(self, station_id) -> bool:
+        """
+        Checks if a given station id is existent
+
+        Args:
+            station_id (str | int): Id of the station
+
+        Returns:
+            bool: Wether the station id exists or not
+        """
+
+        try:
+            return int(station_id) in self.__names
+        except ValueError:
+            return False
+
+
+
+    def search(self, name: str) -> dict:
+        """
+        Returns all stations whose name contains the given name
+
+        Args:
+            name (str): Part of the station name
+
+        Returns:
+            dict: Names of the matching stations by their station id
+        """
+
+        return {station_id: station_name for station_id, station_name in self.__names.items() if name in str(station_name)}
+
+
+
+    def station_ids(self, name: str) -> list:
+        """
+        Returns:
+            list: Ids of all stations with exactly the given name
+        """
+
+        return [station_id for station_id, station_name in self.__names.items() if station_name == name]
+
+
+
+    def stations_by_line(self, line: str) -> tuple:
+        """
+        Returns:
+            tuple: Ids of all stations of the given line
+        """
+
+        return self.__line_stations.get(line, ())
+
+
+
+    def stations_by_zone(self, zone: str) -> tuple:
+        """
+        Returns:
+            tuple: Ids of all stations in the given fare zone
+        """
+
+        return self.__zone_stations.get(zone, ())
+
+
+
+    def lines_by_station(self, station_id: int) -> tuple:
+        """
+        Returns:
+            tuple: Lines that serve the given station
+        """
+
+        return self.__station_lines.get(int(station_id), ())
+
+
+
+    def network(self) -> tuple:
+        """
+        Returns:
+            tuple: Ids of all stations of the network
+        """
+
+        return self.__network
@@ -0,0 +1,90 @@
+# Dennis Hilgert
+
+from delyzer.models import Direction, Line, Station, DEPARTURE_NAMES
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DimensionCache:
+    """
+    Keeps the ids of the lines, directions and stations in memory, so the collector resolves the dimension values
+    of its departures without a query. Unknown values are saved once per fetch cycle.
+    """
+
+    def __init__(self) -> None:
+        # Id of every known line by its number
+        self.__lines: dict = {}
+        # Id of every known direction by its name
+        self.__directions: dict = {}
+        self.__stations: set = set()
+
+
+
+    def load(self) -> int:
+        """
+        Loads all lines, directions and stations from the database
+
+        Returns:
+            int: Number of loaded dimension values
+        """
+
+        self.__lines = dict(Line.objects.values_list('number', 'id'))
+        self.__directions = dict(Direction.objects.values_list('name', 'id'))
+        self.__stations = set(Station.objects.values_list('id', flat=True))
+        return len(self.__lines) + len(self.__directions) + len(self.__stations)
+
+
+
+    def resolve(self, rows: list) -> None:
+        """
+        Saves the lines, directions and stations of the given departure data that are not known yet.
+        A value that was saved by another process in the meantime is kept and only its id is loaded.
+
+        Args:
+            rows (list): Validated departure data
+
+        Tests:
+            * Pass in departures of known lines, directions and stations: Function should not touch the database
+            * Pass in a departure of a new line: Function should save the line once, with the line name of the departure
+        """
+
+        lines = {}
+        directions = set()
+        stations = set()
+        for data in rows:
+            if data['line_number'] not in self.__lines:
+                lines.setdefault(data['line_number'], data['line_name'])
+            directions.update(name for name in (data['direction'], data['direction_from']) if name not in self.__directions)
+            stations.update(id for id in (data['station_id'], data['destination_id']) if id not in self.__stations)
+
+        if lines:
+            Line.objects.bulk_create([Line(number=number, name=name) for number, name in lines.items()], ignore_conflicts=True)
+            self.__lines.update(Line.objects.filter(number__in=lines).values_list('number', 'id'))
+        if directions:
+            Direction.objects.bulk_create([Direction(name=name) for name in directions], ignore_conflicts=True)
+            self.__directions.update(Direction.objects.filter(name__in=directions).values_list('name', 'id'))
+        if stations:
+            Station.objects.bulk_create([Station(id=id) for id in stations], ignore_conflicts=True)
+            self.__stations.update(stations)
+        if lines or directions or stations:
+            logger.info('Saved %s new lines, %s new directions and %s new stations', len(lines), len(directions), len(stations))
+
+
+
+    def departure(self, data: dict) -> dict:
+        """
+        Maps validated departure data to the fields of the departure model, the dimension values must be resolved before.
+        The station ids are already the ids of the stations.
+
+        Args:
+            data (dict): Validated departure data
+
+        Returns:
+            dict: Arguments of the departure model
+        """
+
+        departure = {field: value for field, value in data.items() if field not in DEPARTURE_NAMES}
+        departure['line_id'] = self.__lines[data['line_number']]
+        departure['to_direction_id'] = self.__directions[data['direction']]
+        departure['from_direction_id'] = self.__directions[data['direction_from']]
+        return departure
@@ -0,0 +1,275 @@
+# Samuel Matzeit
+from django.db.models import QuerySet
+import json
+import pandas as pd
+import logging
+
+from ..models import Departure
+from ..serializers import DepartureSerializer
+from .window import Window
+
+logger = logging.getLogger(__name__)
+
+class Export:
+    """Class Export
+    description:
+        * Helper class to return the saved departures page by page or as a stream
+        * Filters are applied inside of the database, pages are read with a cursor on the id (keyset pagination)
+        * Rows are formatted with the fields of the DepartureSerializer, so every mode returns the same values
+    """
+
+    # Number of departures of a page if no limit is given and the maximum limit of a page
+    DEFAULT_LIMIT = 1000
+    MAX_LIMIT = 10000
+
+    # Number of departures that are read from the database at once while streaming
+    CHUNK_SIZE = 2000
+
+    # Number of departures of a record batch or row group of the table formats
+    BATCH_SIZE = 50000
+
+    def filters(params) -> dict:
+        """filters
+        description:
+            * Parses the filters of the query parameters line, direction, station, since and until
+            * since and until are service dates in the format YYYY-MM-DD and both included, from and to are accepted
+              for them like on the analytics endpoints
+
+        Returns:
+            dict: Filter arguments of the departure QuerySet
+
+        Args:
+            params (QueryDict): Query parameters of the request
+
+        Raises:
+            ValueError: If station is not a number, since or until is not a date or given twice
+
+        tests:
+            * Test if no parameters return no filters
+            * Test if station=5006118 returns the filter station_id=5006118
+            * Test if an invalid date raises a ValueError
+            * Test if from=2026-10-16 returns the same filters as since=2026-10-16
+            * Test if since and from together raise a ValueError
+        """
+
+        filters = {}
+        if params.get('line'):
+            filters['line_number'] = params.get('line')
+        if params.get('direction'):
+            filters['direction'] = params.get('direction')
+        if params.get('station'):
+            filters['station_id'] = Export.number(params.get('station'), 'station')
+        for name, alias, lookup in [('since', 'from', 'service_date__gte'), ('until', 'to', 'service_date__lte')]:
+            if params.get(name) and params.get(alias):
+                raise ValueError(f'Provide either {name} or {alias}, not both')
+            given = name if params.get(name) else alias
+            if params.get(given):
+                filters[lookup] = Window.date(params.get(given), given)
+        return filters
+
+    def cursor(params) -> int:
+        """cursor
+        description:
+            * Parses the query parameter cursor, the id of the last departure of the previous page
+
+        Returns:
+            int: Id after which the page starts, None for the first page
+
+        Args:
+            params (QueryDict): Query parameters of the request
+        """
+
+        if not params.get('cursor'):
+            return None
+        return Export.number(params.get('cursor'), 'cursor')
+
+    def limit(params) -> int:
+        """limit
+        description:
+            * Parses the query parameter limit, the number of departures of a page
+
+        Returns:
+            int: Number of departures of a page, DEFAULT_LIMIT if not given
+
+        Args:
+            params (QueryDict): Query parameters of the request
+
+        Raises:
+            ValueError: If limit is not between 1 and MAX_LIMIT
+        """
+
+        if not params.get('limit'):
+            return Export.DEFAULT_LIMIT
+        limit = Export.number(params.get('limit'), 'limit')
+        if not 1 <= limit <= Export.MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {Export.MAX_LIMIT}, got {limit}')
+        return limit
+
+    def departures(filters:dict, cursor:int=None) -> QuerySet:
+        """departures
+        description:
+            * Returns the filtered departures after the cursor ordered by id
+
+        Returns:
+            QuerySet: Values of the serializer fields of the departures
+
+        Args:
+            filters (dict): Filter arguments, see Export.filters
+            cursor (int): Only departures with a greater id are returned if given
+
+        tests:
+            * Test if the departures are ordered by id
+            * Test if no departure has an id lower or equal to the cursor
+        """
+
+        departures = Departure.objects.named().filter(**filters)
+        if cursor is not None:
+            departures = departures.filter(id__gt=cursor)
+        return departures.order_by('id').values_list(*DepartureSerializer.Meta.fields)
+
+    def page(departures:QuerySet, limit:int) -> tuple:
+        """page
+        description:
+            * Returns the first departures of the QuerySet and the cursor of the next page
+            * One departure more than the limit is read to know if there is a next page
+
+        Returns:
+            tuple: Formatted departures and the cursor of the next page, None if it is the last page
+
+        Args:
+            departures (QuerySet): Departures ordered by id, see Export.departures
+            limit (int): Number of departures of the page
+
+        tests:
+            * Test if the page has at most limit departures
+            * Test if the cursor of the last page is None
+            * Test if following the cursors returns every departure exactly once
+        """
+
+        rows = list(departures[:limit + 1])
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return Export.format(rows[:limit]), next_cursor
+
+    def ndjson(departures:QuerySet):
+        """ndjson
+        description:
+            * Yields the departures as newline delimited json, one departure per line
+            * Reads the departures in chunks from the database, so the memory use does not grow with the number of departures
+
+        Returns:
+            Generator: Encoded lines of CHUNK_SIZE departures at a time
+
+        Args:
+            departures (QuerySet): Departures ordered by id, see Export.departures
+
+        tests:
+            * Test if every line is a departure in the format of departure_detail
+            * Test if an empty QuerySet yields nothing
+        """
+
+        for chunk in Export.chunks(departures):
+            yield Export.encode(chunk)
+
+    def frames(departures:QuerySet, serialized:bool=False):
+        """frames
+        description:
+            * Yields the departures as DataFrames of BATCH_SIZE departures for the table formats, see Render.stream
+            * The columns keep the values of the database: times, dates and the current date in UTC, serialized
+              departures have the values of the json formats instead
+
+        Returns:
+            Generator: DataFrames with the serializer fields as columns, one empty DataFrame if there are no departures
+
+        Args:
+            departures (QuerySet): Departures ordered by id, see Export.departures
+            serialized (bool): Wether the values are formatted like the DepartureSerializer, see Export.format
+
+        tests:
+            * Test if the concatenated DataFrames contain every departure once
+            * Test if no departures yield one DataFrame with the columns and no rows
+        """
+
+        empty = True
+        for chunk in Export.chunks(departures, Export.BATCH_SIZE):
+            empty = False
+            if serialized:
+                yield pd.DataFrame(Export.format(chunk), columns=DepartureSerializer.Meta.fields)
+            else:
+                yield pd.DataFrame.from_records(chunk, columns=DepartureSerializer.Meta.fields)
+        if empty:
+            yield pd.DataFrame(columns=DepartureSerializer.Meta.fields)
+
+    def chunks(departures:QuerySet, size:int=CHUNK_SIZE):
+        """chunks
+        description:
+            * Reads the departures in chunks from the database, so the memory use does not grow with the number of departures
+
+        Returns:
+            Generator: Lists of the values of size departures at a time
+
+        Args:
+            departures (QuerySet): Departures ordered by id, see Export.departures
+            size (int): Number of departures of a chunk
+        """
+
+        chunk = []
+        for row in departures.iterator(chunk_size=Export.CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def format(rows:list) -> list:
+        """format
+        description:
+            * Formats the values of the departures like the DepartureSerializer
+
+        Returns:
+            list: Departures as dicts
+
+        Args:
+            rows (list): Values of the serializer fields of the departures
+        """
+
+        fields = [(name, field.to_representation) for name, field in DepartureSerializer().fields.items()]
+        return [
+            {name: None if value is None else to_representation(value) for (name, to_representation), value in zip(fields, row)}
+            for row in rows
+        ]
+
+    def encode(rows:list) -> bytes:
+        """encode
+        description:
+            * Encodes formatted departures as newline delimited json
+
+        Returns:
+            bytes: One json line per departure
+
+        Args:
+            rows (list): Values of the serializer fields of the departures
+        """
+
+        return ''.join(json.dumps(departure, ensure_ascii=False) + '\n' for departure in Export.format(rows)).encode('utf-8')
+
+    def number(value:str, name:str) -> int:
+        """number
+        description:
+            * Parses a query parameter that has to be a whole number
+
+        Returns:
+            int: Parsed number
+
+        Args:
+            value (string): Value of the query parameter
+            name (string): Name of the query parameter for the error message
+
+        Raises:
+            ValueError: If the value is not a whole number
+        """
+
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a whole number, got "{value}"')
@@ -1,8 +1,10 @@
 # Samuel Matzeit
 import pandas as pd
-import datetime
 import logging
 
+from .catalog import StationCatalog
+from .timeslot import Timeslot
+
 logger = logging.getLogger(__name__)
 
 class Filter:
@@ -12,58 +14,63 @@ class Filter:
         * Contains independet functions that return the modified object
     """
 
-    def by_line(delay_df:pd.DataFrame, line:str, direction:str) -> pd.DataFrame:
-        """by_line
+    def by_time(delay_df:pd.DataFrame, width:int=Timeslot.DEFAULT_WIDTH, fill:str=Timeslot.DEFAULT_FILL, split:bool=False) -> pd.DataFrame:
+        """by_time
         description:
-            * Filters delay_df by line and direction
+            * Filters delay_df by time
+            * Returns a DataFrame with timeslots of the given width and the delay, see Timeslot.frame
+            * If split, the timeslots of weekdays and weekend are returned separately
 
         Returns:
-            DataFrame: Delay data grouped and ordered by line and direction
+            DataFrame: Delay data grouped and ordered by time
 
         Args:
-            delay_df (pd.DataFrame): Delay data
-            line (string): Line name
-            direction (string): Direction name  
+            delay_df (pd.DataFrame): Delay data with the column planned_departure_time or seconds,
+                and with the column service_date or weekday if split
+            width (int): Width of the timeslots in minutes, one of Timeslot.WIDTHS
+            fill (string): Way to fill timeslots without departures, one of Timeslot.FILLS
+            split (bool): Wether the timeslots of weekdays and weekend are returned separately
             
         tests:
-            * Test if filter by line works
-            * test if filter by direction works
-            * test if return type is a dataframe
+            * Test if filter by time results in timeslots of the given width
+            * Test if the timeslots have relating delays
+            * Test if return type is a dataframe
         """
-        
-        delay_df = pd.DataFrame(delay_df.loc[delay_df['line_number'] == line])
-        delay_df = pd.DataFrame(delay_df.loc[delay_df['direction'] == direction])
 
-        return delay_df
+        return Timeslot.frame(Filter.slots(delay_df, width, split), width, fill, split)
 
-    def by_time(delay_df:pd.DataFrame) -> pd.DataFrame:
-        """by_time
+    def slots(delay_df:pd.DataFrame, width:int, split:bool=False) -> pd.DataFrame:
+        """slots
         description:
-            * Filters delay_df by time
-            * Returns a DataFrame with 30 min timeslots and the delay
-            * Timeslots are are always for the whole day
+            * Returns the timeslot index of every departure of delay_df, see Timeslot.frame
+            * The timeslot of a departure is computed from its seconds since midnight without a loop in python
 
         Returns:
-            DataFrame: Delay data grouped and ordered by time
+            DataFrame: Delay data with the columns slot, delay_sum and count (and days)
 
         Args:
-            delay_df (pd.DataFrame): Delay data
-            
-        tests:
-            * Test if filter by time results in 30 min timeslots
-            * Test if the 30 min timeslots have relating delays
-            * Test if return type is a dataframe
+            delay_df (pd.DataFrame): Delay data, see Filter.by_time
+            width (int): Width of the timeslots in minutes
+            split (bool): Wether the column days is added
         """
-    
-        
-        delay_df['planned_departure_time'] = delay_df['planned_departure_time'].apply(lambda x: datetime.datetime.combine(datetime.datetime.today(), x))
-        delay_df.set_index('planned_departure_time', inplace=True)
-
-        delay_df = delay_df['delay'].resample('30min').mean().round(2).reset_index().ffill()
-        
-        delay_df.rename(columns={'planned_departure_time':'timeslot_start'}, inplace=True)
 
-        return delay_df
+        # Delay data of the DepartureStore already has the seconds since midnight and the weekday
+        if 'seconds' in delay_df.columns:
+            seconds = delay_df['seconds'].to_numpy()
+        else:
+            seconds = Timeslot.seconds(delay_df['planned_departure_time'])
+        slot_df = pd.DataFrame({
+            'slot': seconds // (width * 60),
+            'delay_sum': delay_df['delay'].to_numpy(),
+            'count': 1,
+        })
+        if split:
+            if 'weekday' in delay_df.columns:
+                weekdays = delay_df['weekday'].to_numpy()
+            else:
+                weekdays = pd.to_datetime(delay_df['service_date']).dt.dayofweek.to_numpy() + 1
+            slot_df['days'] = Timeslot.days(weekdays)
+        return slot_df
         
     def by_delay(delay_df:pd.DataFrame):
         """by_delay
@@ -92,7 +99,7 @@ class Filter:
     def join_station_name(delay_df:pd.DataFrame) -> pd.DataFrame:
         """join_station_name
         description:
-            * Loads vvs_data.csv
+            * Looks up the station names in the station catalog
             * Joins station name to delay_df by station_id/Nummer
             * Returns a Dataframe with the joined names at every entry in the DataFrame
 
@@ -107,106 +114,10 @@ class Filter:
             * Test if every entrie of the return value has the column 'Name mit Ort'
             * Test if return type is a DataFrame
         """
-        try:
-            stations_info_df = pd.read_csv('vvs_data.csv', sep=',', encoding='utf-8')
-            stations_info_df = stations_info_df[['Nummer', "Name mit Ort"]]
+        station_names = StationCatalog.get().names()
 
-        except Exception as e:
-            raise e
-        
         delay_df = delay_df.set_index("station_id")
 
-        delay_df = delay_df.join(stations_info_df.set_index('Nummer'), on='station_id', how="left")
-
-        return delay_df
-
-    def delay_at_station(delay_df:pd.DataFrame) -> pd.DataFrame:
-        """delay_at_station
-        description:
-            * Filters delay_df by the delay and orders by station
-            * returns DataFrame including the joined station Name
-
-        Returns:
-            DataFrame: Delay data grouped by stations and ordered by delay
-
-        Args:
-            delay_df (pd.DataFrame): Delay data
-            
-        tests:
-            * Test if delay_at_station groups the stations right
-            * Test if the average delay value is correct
-            * Test if every entrie of the return value has the column 'Name mit Ort'
-            (* Test if return type is a DataFrame)
-        """
-        delay_df = delay_df.groupby(['station_id'], as_index=False).agg({'delay': 'mean'}).round(2)
-        #delay_series = delay_series.sort_values('delay')
-
-
-        if not delay_df.empty:
-
-            delay_df = Filter.join_station_name(delay_df)
-        
-            try:
-                delay_df = delay_df[['Name mit Ort', 'delay']]
-            except Exception as e:
-                raise e
-            delay_df = delay_df.sort_values('delay', ascending=False)
-
-        return delay_df
-    
-    def propability_at_station(delay_df:pd.DataFrame) -> pd.DataFrame:
-        """propability_at_station
-        description:
-            * Filters delay_df by the delay propability in % and groups by stations
-            * Returns DataFrame including the joined station Name
-
-        Returns:
-            DataFrame: Delay data grouped by stations and ordered by propability
-
-        Args:
-            delay_df (pd.DataFrame): Delay data
-            
-        tests:
-            * Test if delay_at_station groups the stations right
-            * Test if the propability value is between 0 and 100
-            * Test if every entrie of the return value has the column 'Name mit Ort'
-            (* Test if return type is a DataFrame)
-        """
-        delay_series = delay_df.groupby(['station_id'], as_index=False)['delay'].apply(lambda delay: ((delay>2).sum()/len(delay))*100).round(2)
-
-        delay_df = pd.DataFrame(delay_series)
-
-        if not delay_df.empty:
-
-            delay_df = Filter.join_station_name(delay_df)
-        
-            delay_df = delay_df[['Name mit Ort', 'delay']]
-        
-
-            delay_df = delay_df.sort_values('delay', ascending=False)
-
-        return delay_df
-        
-    def propability_of_line(delay_df:pd.DataFrame):
-        """propability_of_line
-        description:
-            * Filters delay_df by the delay propability in % and groups by trains
-            * Returns DataFrame ordered by propability
-
-        Returns:
-            DataFrame: Delay data grouped by lines and ordered by propability
-
-        Args:
-            delay_df (pd.DataFrame): Delay data
-            
-        tests:
-            * Test if delay_at_station groups the lines right
-            * Test if the propability value is between 0 and 100
-            * Test if the propability value is calculated right
-            (* Test if return type is a DataFrame)
-        """
-        delay_series = delay_df.groupby(['line_number','direction'], as_index=False)['delay'].apply(lambda delay: ((delay>2).sum()/len(delay))*100).round(2)
-        delay_df = pd.DataFrame(delay_series).sort_values('delay', ascending=False)
-
+        delay_df['Name mit Ort'] = delay_df.index.map(station_names)
 
         return delay_df
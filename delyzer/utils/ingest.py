@@ -0,0 +1,165 @@
+# Dennis Hilgert
+
+from django.db import transaction
+from django.utils import timezone
+from delyzer.models import Departure, DEPARTURE_KEY_FIELDS
+from delyzer.serializers import DepartureSerializer
+from delyzer.utils.dimensions import DimensionCache
+from delyzer.utils.rollup import Rollup
+import datetime, logging
+
+logger = logging.getLogger(__name__)
+
+# Model attributes of the key fields, the keys of the recently seen departures are made of the dimension ids
+DEPARTURE_KEY_ATTNAMES = [Departure._meta.get_field(field).attname for field in DEPARTURE_KEY_FIELDS]
+
+class DepartureIngestor:
+    """
+    Validates the departures of a whole fetch cycle at once and writes them to the database in batches.
+    Every physical departure is stored only once, repeated observations update the delay of the existing row.
+    """
+
+    def __init__(self, batch_size: int = 500, seen_days: int = 1) -> None:
+        self.__batch_size = batch_size
+        # Last saved delay of every recently observed departure by its key, used to skip unchanged observations
+        self.__seen: dict = {}
+        self.__seen_days = seen_days
+        self.__seen_since: datetime.date = None
+        self.__dimensions = DimensionCache()
+
+
+
+    def load_seen(self) -> int:
+        """
+        Loads the ids of the dimension tables and the keys and delays of the departures of the last service days
+        from the database, so that the recently seen departures survive a restart of the collector
+
+        Returns:
+            int: Number of departures that were loaded
+
+        Tests:
+            * Call it with an empty database: Function should return 0
+            * Call it after departures were saved: Function should return the number of departures of the last service days
+        """
+
+        self.__dimensions.load()
+        self.__seen_since = timezone.localdate() - datetime.timedelta(days=self.__seen_days)
+        departures = Departure.objects.filter(service_date__gte=self.__seen_since).values_list(*DEPARTURE_KEY_FIELDS, 'delay')
+        self.__seen = {departure[:-1]: departure[-1] for departure in departures.iterator(chunk_size=2000)}
+        return len(self.__seen)
+
+
+
+    def prune_seen(self) -> None:
+        """
+        Removes the departures of past service days from the recently seen departures
+        """
+
+        since = timezone.localdate() - datetime.timedelta(days=self.__seen_days)
+        if self.__seen_since == since:
+            return
+        service_date_index = DEPARTURE_KEY_FIELDS.index('service_date')
+        self.__seen = {key: delay for key, delay in self.__seen.items() if key[service_date_index] >= since}
+        self.__seen_since = since
+
+
+
+    def ingest(self, rows: list) -> int:
+        """
+        Validates the given rows and saves all new or changed departures inside of one transaction. This means:
+
+        * Validate all rows in one pass of the departure serializer
+        * Report every invalid row and drop it from the batch
+        * Save the lines, directions and stations that are not known yet and map the rows to their ids
+        * Drop every row whose departure was already saved with the same delay
+        * Upsert the remaining rows with bulk statements of the configured batch size, an existing departure keeps
+          its row and gets the last observed delay
+        * Add the new departures and the changed delays to the delay rollup in the same transaction
+
+        Args:
+            rows (list): Mapped departure data of one fetch cycle
+
+        Returns:
+            int: Number of rows that were inserted or updated
+
+        Tests:
+            * Pass in an empty list: Function should not touch the database and return 0
+            * Pass in only valid rows: Function should save all rows and return their count
+            * Pass in valid and invalid rows: Function should log a warning for each invalid row and save the valid ones
+            * Pass in the same rows twice: Function should return 0 the second time and not add any rows
+            * Pass in a known departure with a changed delay: Function should update the delay of the existing row
+        """
+
+        if not rows:
+            return 0
+
+        self.prune_seen()
+        validated = self.validate(rows)
+        self.__dimensions.resolve(validated)
+        changed = {}
+        for data in validated:
+            departure = self.__dimensions.departure(data)
+            key = tuple(departure[field] for field in DEPARTURE_KEY_ATTNAMES)
+            if key in self.__seen and self.__seen[key] == data['delay']:
+                continue
+            changed[key] = (data, departure)
+        if not changed:
+            return 0
+
+        rollup_changes = {}
+        for key, (data, _) in changed.items():
+            rollup_key = Rollup.key(data)
+            change = Rollup.change(data['delay'], self.__seen.get(key))
+            previous = rollup_changes.get(rollup_key, (0, 0, 0, 0, 0))
+            rollup_changes[rollup_key] = tuple(value + delta for value, delta in zip(previous, change))
+
+        departures = [Departure(**departure) for _, departure in changed.values()]
+        with transaction.atomic():
+            Departure.objects.bulk_create(
+                departures,
+                batch_size=self.__batch_size,
+                update_conflicts=True,
+                unique_fields=DEPARTURE_KEY_FIELDS,
+                update_fields=['delay', 'current_date']
+            )
+            Rollup.apply(rollup_changes, self.__batch_size)
+
+        for key, (data, _) in changed.items():
+            self.__seen[key] = data['delay']
+        return len(departures)
+
+
+
+    def validate(self, rows: list) -> list:
+        """
+        Checks if the rows have all required fields to save to the database
+
+        Args:
+            rows (list): Mapped departure data
+
+        Returns:
+            list: Validated data of all rows that satisfy the departure serializer
+
+        Tests:
+            * Pass in data that doesn't have the required fields: Function should log a warning message (error not needed because corrupt data is not our fault)
+            * Pass in data that does have all required fields: Function should return the validated data
+        """
+
+        serializer = DepartureSerializer(data=rows, many=True)
+        if serializer.is_valid():
+            return serializer.validated_data
+
+        # The errors of a list serializer are aligned with the given rows, valid rows have no errors
+        valid_rows = []
+        for data, errors in zip(rows, serializer.errors):
+            if errors:
+                logger.warning('Data does not satisfy the departure serializer: %s', errors)
+                logger.warning(data)
+                continue
+            valid_rows.append(data)
+
+        if not valid_rows:
+            return []
+        serializer = DepartureSerializer(data=valid_rows, many=True)
+        serializer.is_valid()
+        return serializer.validated_data
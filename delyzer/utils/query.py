@@ -0,0 +1,470 @@
+# Samuel Matzeit
+from django.db.models import ExpressionWrapper, F, FloatField, QuerySet, Sum
+from django.db.models.functions import Cast, Round
+import pandas as pd
+import datetime
+import logging
+
+from ..models import DelayRollup, TimeslotRollup, SLOT_MINUTES, FINE_SLOT_MINUTES, LATE_DELAY
+from .catalog import StationCatalog
+from .filter import Filter
+from .risk import Risk
+from .store import DepartureStore
+from .ranking import Ranking
+from .retention import Retention
+from .timeslot import Timeslot
+from .window import Window
+
+logger = logging.getLogger(__name__)
+
+# Fields of the line dashboard in the order of the response
+DASHBOARD_FIELDS = ['summary', 'delays', 'propability', 'times']
+
+class Query:
+    """Class Query
+    description:
+        * Helper class to aggregate the delay data inside of the database.
+        * Aggregates are answered from the delay rollup that the collector maintains
+        * Filters are applied with WHERE and aggregates with GROUP BY, only the result rows are loaded
+        * Contains independet functions that return a DataFrame in the same format as the Filter functions
+    """
+
+    def rollups(line:str=None, direction:str=None, station_ids:list=None, window:dict=None) -> QuerySet:
+        """rollups
+        description:
+            * Returns the rollup rows filtered by line, direction, stations and time window
+            * Every filter is only applied if it is given
+
+        Returns:
+            QuerySet: Filtered rollup rows
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            station_ids (list): Station ids
+            window (dict): Time window, see Window.params
+
+        tests:
+            * Test if filter by line works
+            * Test if filter by direction works
+            * Test if no filter returns all rollup rows
+        """
+
+        rollups = DelayRollup.objects.all()
+        if line is not None:
+            rollups = rollups.filter(line_number=line)
+        if direction is not None:
+            rollups = rollups.filter(direction=direction)
+        if station_ids is not None:
+            rollups = rollups.filter(station_id__in=station_ids)
+        return Window.rollups(rollups, window)
+
+    def average() -> ExpressionWrapper:
+        """average
+        description:
+            * Aggregate of the average delay of the departures of the grouped rollup rows
+
+        Returns:
+            ExpressionWrapper: Aggregate expression
+        """
+
+        return ExpressionWrapper(Cast(Sum('delay_sum'), FloatField()) / Sum('count'), output_field=FloatField())
+
+    def propability() -> ExpressionWrapper:
+        """propability
+        description:
+            * Aggregate of the share of departures with a delay > LATE_DELAY minutes in %
+
+        Returns:
+            ExpressionWrapper: Aggregate expression
+        """
+
+        late = Cast(Sum('late_count'), FloatField())
+        return Round(ExpressionWrapper(late * 100 / Sum('count'), output_field=FloatField()), 2)
+
+    def lines() -> pd.DataFrame:
+        """lines
+        description:
+            * Returns every combination of line and direction once, ordered by line and direction
+
+        Returns:
+            DataFrame: Lines with the columns line_number and direction
+
+        tests:
+            * Test if every line is just once in the return value
+            * Test if return type is a dataframe
+        """
+
+        lines = DelayRollup.objects.values('line_number', 'direction').distinct().order_by('line_number', 'direction')
+        return pd.DataFrame(list(lines), columns=['line_number', 'direction'])
+
+    def stations() -> pd.DataFrame:
+        """stations
+        description:
+            * Returns every station once with its joined station name
+
+        Returns:
+            DataFrame: Stations indexed by station_id with the column 'Name mit Ort'
+
+        tests:
+            * Test if every station is just once in the return value
+            * Test if every entrie of the return value has the column 'Name mit Ort'
+        """
+
+        stations = DelayRollup.objects.values('station_id').distinct().order_by()
+        stations_df = pd.DataFrame(list(stations), columns=['station_id'])
+        return Filter.join_station_name(stations_df)
+
+    def by_delay(line:str=None, direction:str=None, window:dict=None, ranking:dict=None) -> pd.DataFrame:
+        """by_delay
+        description:
+            * Returns the average delays of all lines grouped by line and direction
+            * Ordered by delays
+
+        Returns:
+            DataFrame: Delay data grouped and ordered by delay
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            window (dict): Time window, see Window.params
+            ranking (dict): Limit, order and minimum number of departures, see Ranking.params
+
+        tests:
+            * Test if by delay returns the right order by delays
+            * Test if every line is just once in the return value
+            * Test if the average delay equals Filter.by_delay
+        """
+
+        delays = Query.rollups(line, direction, window=window).values('line_number', 'direction') \
+            .annotate(delay=Round(Query.average(), 2))
+        delays = Ranking.queryset(delays, ranking)
+        return pd.DataFrame(list(delays), columns=['line_number', 'direction', 'delay'])
+
+    def by_time(line:str=None, direction:str=None, width:int=Timeslot.DEFAULT_WIDTH, fill:str=Timeslot.DEFAULT_FILL, split:bool=False, window:dict=None) -> pd.DataFrame:
+        """by_time
+        description:
+            * Returns the average delay per timeslot of the planned departure time, see Timeslot.frame
+            * Timeslots that are a multiple of the rollup timeslots are summed up from the rollup,
+              shorter timeslots are grouped from the departures of the DepartureStore with Filter.by_time
+            * Service dates before the retention horizon have no departures anymore, their shorter timeslots
+              are summed up from the timeslot rollup, see Query.folded
+            * If split, the timeslots of weekdays and weekend are returned separately
+
+        Returns:
+            DataFrame: Delay data grouped and ordered by time
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            width (int): Width of the timeslots in minutes, one of Timeslot.WIDTHS
+            fill (string): Way to fill timeslots without departures, one of Timeslot.FILLS
+            split (bool): Wether the timeslots of weekdays and weekend are returned separately
+            window (dict): Time window, see Window.params
+
+        tests:
+            * Test if by time results in timeslots of the given width
+            * Test if the timeslots have relating delays
+            * Test if the result equals Filter.by_time
+        """
+
+        if width % SLOT_MINUTES != 0:
+            horizon = Retention.horizon()
+            if horizon is None:
+                return Filter.by_time(DepartureStore.get().frame(line, direction, window), width, fill, split)
+
+            # The store may still hold departures before the horizon while they are deleted
+            slot_dfs = []
+            raw_window = Window.clamp(window, since=horizon)
+            if raw_window is not None:
+                slot_dfs.append(Filter.slots(DepartureStore.get().frame(line, direction, raw_window), width, split))
+            folded_window = Window.clamp(window, until=horizon - datetime.timedelta(days=1))
+            if folded_window is not None:
+                slot_dfs.append(Query.folded(line, direction, width, split, folded_window))
+            return Timeslot.frame(pd.concat(slot_dfs, ignore_index=True), width, fill, split)
+
+        slot = F('slot') if width == SLOT_MINUTES else F('slot') * SLOT_MINUTES / width
+        group = ['timeslot'] + (['weekday'] if split else [])
+        delays = Query.rollups(line, direction, window=window).annotate(timeslot=slot).values(*group) \
+            .annotate(delay_sum=Sum('delay_sum'), count=Sum('count')).order_by()
+
+        slot_df = pd.DataFrame(list(delays), columns=group + ['delay_sum', 'count']).rename(columns={'timeslot': 'slot'})
+        if split:
+            slot_df['days'] = Timeslot.days(slot_df['weekday'])
+        return Timeslot.frame(slot_df, width, fill, split)
+
+    def folded(line:str=None, direction:str=None, width:int=Timeslot.DEFAULT_WIDTH, split:bool=False, window:dict=None) -> pd.DataFrame:
+        """folded
+        description:
+            * Returns the timeslots shorter than the rollup timeslots for the service dates whose departures were
+              deleted by the retention, summed up from the timeslot rollup they were folded into before
+
+        Returns:
+            DataFrame: Delay data with the columns slot, delay_sum and count (and days), see Timeslot.frame
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            width (int): Width of the timeslots in minutes, a multiple of FINE_SLOT_MINUTES
+            split (bool): Wether the column days is added
+            window (dict): Time window, see Window.params
+
+        tests:
+            * Test if the result equals Filter.by_time of the departures before they were deleted
+        """
+
+        rollups = TimeslotRollup.objects.all()
+        if line is not None:
+            rollups = rollups.filter(line_number=line)
+        if direction is not None:
+            rollups = rollups.filter(direction=direction)
+        group = ['timeslot'] + (['weekday'] if split else [])
+        slots = Window.rollups(rollups, window, FINE_SLOT_MINUTES).annotate(timeslot=F('slot') * FINE_SLOT_MINUTES / width) \
+            .values(*group).annotate(delay_sum=Sum('delay_sum'), count=Sum('count')).order_by()
+
+        # An empty result must keep the integer columns, the timeslots of the departures are appended to it
+        slot_df = pd.DataFrame(list(slots), columns=group + ['delay_sum', 'count'], dtype='int64').rename(columns={'timeslot': 'slot'})
+        if split:
+            slot_df['days'] = Timeslot.days(slot_df['weekday'])
+        return slot_df
+
+    def delay_at_station(line:str=None, direction:str=None, window:dict=None, ranking:dict=None) -> pd.DataFrame:
+        """delay_at_station
+        description:
+            * Returns the average delay grouped by station
+            * returns DataFrame including the joined station Name
+
+        Returns:
+            DataFrame: Delay data grouped by stations and ordered by delay
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            window (dict): Time window, see Window.params
+            ranking (dict): Limit, order and minimum number of departures, see Ranking.params
+
+        tests:
+            * Test if delay_at_station groups the stations right
+            * Test if the average delay value is correct
+            * Test if every entrie of the return value has the column 'Name mit Ort'
+        """
+
+        delays = Query.rollups(line, direction, window=window).values('station_id') \
+            .annotate(delay=Round(Query.average(), 2))
+        return Query.with_station_name(Ranking.queryset(delays, ranking))
+
+    def propability_at_station(line:str=None, direction:str=None, station:str=None, thresholds:list=None, window:dict=None, ranking:dict=None) -> pd.DataFrame:
+        """propability_at_station
+        description:
+            * Returns the delay propability in % grouped by station for every threshold
+            * Returns DataFrame including the joined station Name
+
+        Returns:
+            DataFrame: Delay data grouped by stations and ordered by propability
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            station (string): Station name, only the stations with this name are returned if given
+            thresholds (list): Thresholds in minutes, see Query.propabilities
+            window (dict): Time window, see Window.params
+            ranking (dict): Limit, order and minimum number of departures, see Ranking.params
+
+        tests:
+            * Test if propability_at_station groups the stations right
+            * Test if the propability value is between 0 and 100
+            * Test if the propability of a station name that doesn't exist is an empty DataFrame
+        """
+
+        station_ids = None
+        if station is not None:
+            station_ids = StationCatalog.get().station_ids(station)
+
+        propability_df = Query.propabilities(Query.rollups(line, direction, station_ids, window), ['station_id'], thresholds, ranking)
+        return Query.with_station_name(propability_df, list(propability_df.columns[1:]))
+
+    def propability_of_line(line:str=None, direction:str=None, thresholds:list=None, window:dict=None, ranking:dict=None) -> pd.DataFrame:
+        """propability_of_line
+        description:
+            * Returns the delay propability in % grouped by line and direction for every threshold
+            * Returns DataFrame ordered by propability
+
+        Returns:
+            DataFrame: Delay data grouped by lines and ordered by propability
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            thresholds (list): Thresholds in minutes, see Query.propabilities
+            window (dict): Time window, see Window.params
+            ranking (dict): Limit, order and minimum number of departures, see Ranking.params
+
+        tests:
+            * Test if propability_of_line groups the lines right
+            * Test if the propability value is between 0 and 100
+            * Test if the propability value is calculated right
+        """
+
+        return Query.propabilities(Query.rollups(line, direction, window=window), ['line_number', 'direction'], thresholds, ranking)
+
+    def propabilities(rollups:QuerySet, group:list, thresholds:list=None, ranking:dict=None) -> pd.DataFrame:
+        """propabilities
+        description:
+            * Returns the delay propability in % of the rollup rows grouped by the given columns
+            * The default threshold is answered by the count of late departures inside of the database
+            * Other thresholds are answered by the delay histograms of the rollup rows, added up per group with Risk.by_group
+            * Column delay holds the propability of the first threshold, column delay_gt_<t> every threshold if more than one is given
+            * The groups are ranked by the propability of the first threshold, see Ranking
+
+        Returns:
+            DataFrame: Group columns and propabilities ordered by the propability of the first threshold
+
+        Args:
+            rollups (QuerySet): Filtered rollup rows
+            group (list): Columns to group by
+            thresholds (list): Thresholds in minutes, Risk.DEFAULT_THRESHOLD if not given
+            ranking (dict): Limit, order and minimum number of departures, see Ranking.params
+
+        tests:
+            * Test if the propabilities of the default threshold are equal for both ways of computation
+            * Test if the propability falls with higher thresholds
+            * Test if more than one threshold returns a column for every threshold
+        """
+
+        thresholds = thresholds or [Risk.DEFAULT_THRESHOLD]
+        if thresholds == [LATE_DELAY]:
+            propabilities = Ranking.queryset(rollups.values(*group).annotate(delay=Query.propability()), ranking)
+            return pd.DataFrame(list(propabilities), columns=group + ['delay'])
+
+        rows = list(rollups.values_list(*group, 'count', 'delay_histogram').order_by())
+        rollup_df = pd.DataFrame([row[:-1] for row in rows], columns=group + ['count'])
+        counts = Risk.decode_all([row[-1] for row in rows])
+        kept = Ranking.having(rollup_df, group, ranking).to_numpy()
+        return Ranking.frame(Risk.by_group(rollup_df[kept], group, thresholds, counts[kept]), ranking)
+
+    def dashboard(line:str, direction:str, fields:list=None, thresholds:list=None, window:dict=None, ranking:dict=None) -> dict:
+        """dashboard
+        description:
+            * Returns every statistic of one line and direction, computed from one read of its rollup rows
+            * summary: average delay, delay propability and number of departures of the line like by_delay and propability_of_line
+            * delays: average delay grouped by station like delay_at_station
+            * propability: delay propability grouped by station like propability_at_station
+            * times: average delay per 30 min timeslot like by_time
+            * The stations of delays and propability are ranked, see Ranking
+
+        Returns:
+            dict: DataFrame of every selected field
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            fields (list): Fields to compute, every field of DASHBOARD_FIELDS if not given
+            thresholds (list): Thresholds in minutes of the propabilities, see Query.propabilities
+            window (dict): Time window, see Window.params
+            ranking (dict): Limit, order and minimum number of departures of the stations, see Ranking.params
+
+        Raises:
+            ValueError: If a field is not in DASHBOARD_FIELDS
+
+        tests:
+            * Test if every field equals the result of its single endpoint
+            * Test if only the selected fields are returned
+            * Test if a line that doesn't exist returns empty DataFrames
+        """
+
+        fields = fields or DASHBOARD_FIELDS
+        unknown = [field for field in fields if field not in DASHBOARD_FIELDS]
+        if unknown:
+            raise ValueError(f'fields must be of {", ".join(DASHBOARD_FIELDS)}, got "{", ".join(unknown)}"')
+        thresholds = thresholds or [Risk.DEFAULT_THRESHOLD]
+        # The histograms are only needed for other thresholds than the one counted in late_count
+        histograms = thresholds != [LATE_DELAY] and ('summary' in fields or 'propability' in fields)
+        columns = ['station_id', 'slot', 'count', 'delay_sum', 'late_count'] + (['delay_histogram'] if histograms else [])
+
+        rows = list(Query.rollups(line, direction, window=window).values_list(*columns).order_by())
+        rollup_df = pd.DataFrame(rows, columns=columns)
+        rollup_df['line_number'] = line
+        rollup_df['direction'] = direction
+        counts = Risk.decode_all(rollup_df['delay_histogram'].tolist()) if histograms else None
+
+        dashboard = {}
+        if 'summary' in fields:
+            group = ['line_number', 'direction']
+            propability_df = Query.propability_of(rollup_df, group, thresholds, counts)
+            propability_df.columns = group + [column.replace('delay', 'propability', 1) for column in propability_df.columns[2:]]
+            summary_df = Query.average_of(rollup_df, group).merge(propability_df, on=group)
+            summary_df['count'] = int(rollup_df['count'].sum())
+            dashboard['summary'] = summary_df
+        if 'delays' in fields or 'propability' in fields:
+            kept = Ranking.having(rollup_df, ['station_id'], ranking).to_numpy()
+            station_df = rollup_df[kept]
+            station_counts = counts[kept] if counts is not None else None
+        if 'delays' in fields:
+            delay_df = Ranking.frame(Query.average_of(station_df, ['station_id']), ranking)
+            dashboard['delays'] = Query.with_station_name(delay_df)
+        if 'propability' in fields:
+            propability_df = Ranking.frame(Query.propability_of(station_df, ['station_id'], thresholds, station_counts), ranking)
+            dashboard['propability'] = Query.with_station_name(propability_df, list(propability_df.columns[1:]))
+        if 'times' in fields:
+            dashboard['times'] = Timeslot.frame(rollup_df, SLOT_MINUTES)
+        return dashboard
+
+    def average_of(rollup_df:pd.DataFrame, group:list) -> pd.DataFrame:
+        """average_of
+        description:
+            * Returns the average delay of loaded rollup rows grouped by the given columns, ordered by delay
+
+        Returns:
+            DataFrame: Group columns and the column delay
+
+        Args:
+            rollup_df (pd.DataFrame): Rollup rows with the columns count and delay_sum
+            group (list): Columns to group by
+        """
+
+        if rollup_df.empty:
+            return pd.DataFrame(columns=group + ['delay'])
+        sums_df = rollup_df.groupby(group, as_index=False, sort=False)[['delay_sum', 'count']].sum()
+        sums_df['delay'] = (sums_df['delay_sum'] / sums_df['count']).round(2)
+        return sums_df[group + ['delay']].sort_values('delay', ascending=False, kind='stable').reset_index(drop=True)
+
+    def propability_of(rollup_df:pd.DataFrame, group:list, thresholds:list, counts=None) -> pd.DataFrame:
+        """propability_of
+        description:
+            * Returns the delay propability in % of loaded rollup rows grouped by the given columns, ordered by propability
+            * Uses the count of late departures for the default threshold and the histograms for all other thresholds
+
+        Returns:
+            DataFrame: Group columns and propabilities, see Query.propabilities
+
+        Args:
+            rollup_df (pd.DataFrame): Rollup rows with the columns count and late_count
+            group (list): Columns to group by
+            thresholds (list): Thresholds in minutes
+            counts (ndarray): Histogram of every rollup row, required for other thresholds than LATE_DELAY
+        """
+
+        if thresholds != [LATE_DELAY]:
+            return Risk.by_group(rollup_df, group, thresholds, counts)
+        if rollup_df.empty:
+            return pd.DataFrame(columns=group + ['delay'])
+        sums_df = rollup_df.groupby(group, as_index=False, sort=False)[['late_count', 'count']].sum()
+        sums_df['delay'] = (sums_df['late_count'] * 100 / sums_df['count']).round(2)
+        return sums_df[group + ['delay']].sort_values('delay', ascending=False, kind='stable').reset_index(drop=True)
+
+    def with_station_name(rows, columns:list=['delay']) -> pd.DataFrame:
+        """with_station_name
+        description:
+            * Converts aggregated rows with station_id and delay to a DataFrame with the joined station name
+
+        Returns:
+            DataFrame: Delay data with the column 'Name mit Ort' and the given columns
+
+        Args:
+            rows (Iterable): Rows with the key station_id and the given columns
+            columns (list): Columns of the rows next to station_id
+        """
+
+        delay_df = pd.DataFrame(rows if isinstance(rows, pd.DataFrame) else list(rows), columns=['station_id'] + columns)
+        delay_df = Filter.join_station_name(delay_df)
+        return delay_df[['Name mit Ort'] + columns]
@@ -0,0 +1,132 @@
+# Samuel Matzeit
+from django.db.models import QuerySet, Sum
+import pandas as pd
+import logging
+
+from .export import Export
+
+logger = logging.getLogger(__name__)
+
+class Ranking:
+    """Class Ranking
+    description:
+        * Helper class to return only the top rows of the ranked endpoints
+        * The ranking is given by the query parameters limit (number of rows), order (desc or asc) and min_samples
+          (minimum number of departures of a row)
+        * Aggregates inside of the database are ranked with HAVING, ORDER BY and LIMIT, loaded rows with a partial selection
+    """
+
+    # Orders of the rows by delay, desc returns the highest delays first
+    ORDERS = ['desc', 'asc']
+    DEFAULT_ORDER = 'desc'
+
+    def params(params) -> dict:
+        """params
+        description:
+            * Parses the query parameters limit, order and min_samples
+
+        Returns:
+            dict: Ranking with the keys limit, order and min_samples, limit and min_samples are None if not given
+
+        Args:
+            params (QueryDict): Query parameters of the request
+
+        Raises:
+            ValueError: If one of the parameters is invalid
+
+        tests:
+            * Test if no parameters return every row ordered descending
+            * Test if limit=0 raises a ValueError
+            * Test if order=up raises a ValueError
+        """
+
+        ranking = {'limit': None, 'order': Ranking.DEFAULT_ORDER, 'min_samples': None}
+        if params.get('limit'):
+            ranking['limit'] = Export.number(params.get('limit'), 'limit')
+            if ranking['limit'] < 1:
+                raise ValueError(f'limit must be at least 1, got {ranking["limit"]}')
+        if params.get('order'):
+            if params.get('order') not in Ranking.ORDERS:
+                raise ValueError(f'order must be one of {", ".join(Ranking.ORDERS)}, got "{params.get("order")}"')
+            ranking['order'] = params.get('order')
+        if params.get('min_samples'):
+            ranking['min_samples'] = Export.number(params.get('min_samples'), 'min_samples')
+            if ranking['min_samples'] < 1:
+                raise ValueError(f'min_samples must be at least 1, got {ranking["min_samples"]}')
+        return ranking
+
+    def queryset(rows:QuerySet, ranking:dict=None, column:str='delay') -> QuerySet:
+        """queryset
+        description:
+            * Ranks grouped rollup rows inside of the database
+            * min_samples is applied with HAVING on the summed up count, limit with LIMIT
+
+        Returns:
+            QuerySet: Ranked rows
+
+        Args:
+            rows (QuerySet): Rollup rows grouped with values() and annotated with column
+            ranking (dict): Ranking, see Ranking.params, ordered descending without limit if not given
+            column (string): Column to order by
+
+        tests:
+            * Test if limit=10 returns the first 10 rows of the unlimited result
+            * Test if no row has less departures than min_samples
+        """
+
+        ranking = ranking or {}
+        if ranking.get('min_samples'):
+            rows = rows.annotate(samples=Sum('count')).filter(samples__gte=ranking['min_samples'])
+        rows = rows.order_by(column if ranking.get('order') == 'asc' else '-' + column)
+        if ranking.get('limit'):
+            rows = rows[:ranking['limit']]
+        return rows
+
+    def having(rollup_df:pd.DataFrame, group:list, ranking:dict=None) -> pd.Series:
+        """having
+        description:
+            * Returns which loaded rollup rows belong to a group with at least min_samples departures
+
+        Returns:
+            Series: True for every rollup row that is kept
+
+        Args:
+            rollup_df (pd.DataFrame): Rollup rows with the column count
+            group (list): Columns of the groups
+            ranking (dict): Ranking, see Ranking.params
+        """
+
+        if not (ranking or {}).get('min_samples') or rollup_df.empty:
+            return pd.Series(True, index=rollup_df.index)
+        samples = rollup_df.groupby(group, sort=False, dropna=False)['count'].transform('sum')
+        return samples >= ranking['min_samples']
+
+    def frame(delay_df:pd.DataFrame, ranking:dict=None, column:str='delay') -> pd.DataFrame:
+        """frame
+        description:
+            * Ranks rows that are already aggregated
+            * With a limit only the top rows are selected instead of sorting every row, ties keep their order
+
+        Returns:
+            DataFrame: Ranked rows
+
+        Args:
+            delay_df (pd.DataFrame): Aggregated rows ordered by column descending
+            ranking (dict): Ranking, see Ranking.params, unchanged if not given
+            column (string): Column to order by
+
+        tests:
+            * Test if limit=10 returns the first 10 rows of the unlimited result
+            * Test if order=asc returns the lowest delays first
+        """
+
+        ranking = ranking or {}
+        if delay_df.empty or (not ranking.get('limit') and ranking.get('order', Ranking.DEFAULT_ORDER) == 'desc'):
+            return delay_df
+        limit = ranking.get('limit') or len(delay_df)
+        values = pd.to_numeric(delay_df[column])
+        if ranking.get('order') == 'asc':
+            index = values.nsmallest(limit, keep='first').index
+        else:
+            index = values.nlargest(limit, keep='first').index
+        return delay_df.loc[index].reset_index(drop=True)
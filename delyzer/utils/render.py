@@ -0,0 +1,494 @@
+# Samuel Matzeit
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import status
+import gzip
+import json
+import pandas as pd
+import logging
+
+try:
+    import orjson
+except ImportError:
+    # Responses are encoded with the json module of the standard library
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Responses are not available as Arrow and Parquet
+    pyarrow = None
+
+try:
+    import msgpack
+except ImportError:
+    # Responses are not available as MessagePack
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    # Responses are only compressed with gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+class Render:
+    """Class Render
+    description:
+        * Helper class to encode the responses of the analytics endpoints
+        * DataFrames are encoded column by column, without a dict of pandas values per row, with orjson if it is installed
+        * The rows are returned as records (default) or with the query parameter layout=columns as
+          {"columns": [...], "data": [[...], ...]}, the layout of DataFrame.to_dict('split') without the index
+        * Besides json the responses are returned as CSV, Apache Arrow IPC stream, Parquet or MessagePack, selected with
+          the query parameter format or the Accept header, see Render.format
+        * Arrow and Parquet need pyarrow, MessagePack needs msgpack, without them the formats are answered with 406
+        * The encoded responses are compressed with gzip or brotli if the client accepts it, see Render.encoding
+    """
+
+    # Media types of the formats
+    FORMATS = {
+        'json': 'application/json',
+        'csv': 'text/csv; charset=utf-8',
+        'arrow': 'application/vnd.apache.arrow.stream',
+        'parquet': 'application/vnd.apache.parquet',
+        'msgpack': 'application/msgpack',
+    }
+
+    # Formats that are encoded by Render.stream
+    STREAMS = ['csv', 'arrow', 'parquet', 'msgpack']
+
+    # Packages the formats need
+    PACKAGES = {'arrow': 'pyarrow', 'parquet': 'pyarrow', 'msgpack': 'msgpack'}
+
+    # Layouts of the rows, records returns one object per row
+    LAYOUTS = ['records', 'columns']
+    DEFAULT_LAYOUT = 'records'
+
+    # Layout of the DataFrames marked with Render.indexed, they are returned as {column: {index: value}}
+    # like DataFrame.to_dict no matter the layout of the request
+    INDEX_LAYOUT = 'index'
+
+    # Content encodings by preference, brotli only if it is installed
+    ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    # Responses smaller than this are not compressed, the headers would cost more than they save
+    MIN_COMPRESS_BYTES = 1024
+
+    def layout(params) -> str:
+        """layout
+        description:
+            * Parses the query parameter layout
+
+        Returns:
+            string: Layout of the rows, DEFAULT_LAYOUT if not given
+
+        Args:
+            params (QueryDict): Query parameters of the request, None for the default layout
+
+        Raises:
+            ValueError: If the layout is unknown
+
+        tests:
+            * Test if no parameter returns records
+            * Test if layout=rows raises a ValueError
+        """
+
+        if params is None or not params.get('layout'):
+            return Render.DEFAULT_LAYOUT
+        if params.get('layout') not in Render.LAYOUTS:
+            raise ValueError(f'layout must be one of {", ".join(Render.LAYOUTS)}, got "{params.get("layout")}"')
+        return params.get('layout')
+
+    def format(request) -> str:
+        """format
+        description:
+            * Returns the format of the response, the query parameter format or else the first format of the Accept header
+            * Requests of the rest framework are already negotiated with the renderers, see delyzer.renderers,
+              an unknown format falls back to the first renderer there and is refused here like without the rest framework
+
+        Returns:
+            string: Format of FORMATS, json if no other format is requested
+
+        Args:
+            request (HttpRequest): Request of the view
+
+        Raises:
+            ValueError: If the query parameter format is unknown
+
+        tests:
+            * Test if format=csv and the Accept header text/csv return csv
+            * Test if no format and the Accept header */* return json
+            * Test if format=xml raises a ValueError, also for a request of the rest framework
+        """
+
+        requested = request.GET.get('format')
+        renderer = getattr(request, 'accepted_renderer', None)
+        if requested and requested not in Render.FORMATS and (renderer is None or renderer.format != requested):
+            raise ValueError(f'format must be one of {", ".join(Render.FORMATS)}, got "{requested}"')
+        if renderer is not None:
+            return renderer.format if renderer.format in Render.FORMATS else 'json'
+        if requested:
+            return requested
+        return Render.accepted(request.headers.get('Accept'))
+
+    def accepted(accept:str) -> str:
+        """accepted
+        description:
+            * Returns the first format of the Accept header
+
+        Returns:
+            string: Format of FORMATS, json if the header accepts no other format
+
+        Args:
+            accept (string): Accept header of the request
+        """
+
+        media_types = {media_type.split(';')[0]: name for name, media_type in Render.FORMATS.items()}
+        for media_range in (accept or '').split(','):
+            name = media_types.get(media_range.split(';')[0].strip().lower())
+            if name is not None:
+                return name
+        return 'json'
+
+    def response(content:dict, request=None) -> HttpResponse:
+        """response
+        description:
+            * Returns the content in the format of the request, json like JsonResponse by default
+            * CSV, Arrow and Parquet contain the one DataFrame of the content, MessagePack the whole content like json
+
+        Returns:
+            HttpResponse: Response with the encoded content, 406 if the package of the format is not installed
+
+        Args:
+            content (dict): Content of the response, DataFrames inside of it are encoded in the layout of the request
+            request (HttpRequest): Request of the view, see Render.format and Render.layout, json records if not given
+
+        Raises:
+            ValueError: If the format or layout is unknown or the content has not one DataFrame for a table format
+
+        tests:
+            * Test if the decoded response equals the JsonResponse of the records of the DataFrames
+            * Test if layout=columns returns the columns and one list of values per row
+            * Test if format=parquet returns the DataFrame of the json response
+            * Test if format=arrow returns 406 without pyarrow
+        """
+
+        response_format = Render.format(request) if request is not None else 'json'
+        layout = Render.layout(request.GET if request is not None else None)
+        if response_format == 'json':
+            return HttpResponse(Render.json(Render.content(content, layout)), content_type=Render.FORMATS['json'])
+
+        not_acceptable = Render.unavailable(response_format)
+        if not_acceptable is not None:
+            return not_acceptable
+        if response_format == 'msgpack':
+            data = Render.msgpack(Render.content(content, layout))
+        else:
+            data = Render.table(Render.frame(content, response_format), response_format)
+        return HttpResponse(data, content_type=Render.FORMATS[response_format])
+
+    def streaming(frames, response_format:str) -> HttpResponse:
+        """streaming
+        description:
+            * Returns a response that encodes the DataFrames one after another while it is sent, see Render.stream
+
+        Returns:
+            HttpResponse: Streamed response, 406 if the package of the format is not installed
+
+        Args:
+            frames (Generator): DataFrames with the same columns
+            response_format (string): Format of STREAMS
+        """
+
+        not_acceptable = Render.unavailable(response_format)
+        if not_acceptable is not None:
+            return not_acceptable
+        return StreamingHttpResponse(Render.stream(frames, response_format), content_type=Render.FORMATS[response_format])
+
+    def unavailable(response_format:str) -> HttpResponse:
+        """unavailable
+        description:
+            * Returns 406 with the missing package if the format is not available in this installation
+
+        Returns:
+            HttpResponse: Response 406, None if the format is available
+
+        Args:
+            response_format (string): Format of FORMATS
+        """
+
+        package = Render.PACKAGES.get(response_format)
+        if package is None or (pyarrow if package == 'pyarrow' else msgpack) is not None:
+            return None
+        return JsonResponse(
+            {'error':f'format {response_format} is not available, the server needs the package {package}'},
+            status=status.HTTP_406_NOT_ACCEPTABLE
+        )
+
+    def frame(content, response_format:str) -> pd.DataFrame:
+        """frame
+        description:
+            * Returns the one DataFrame of the content for the table formats
+
+        Returns:
+            DataFrame: DataFrame of the content
+
+        Args:
+            content (dict): Content of the response
+            response_format (string): Format of the response for the error message
+
+        Raises:
+            ValueError: If the content has no or more than one DataFrame, e.g. the dashboard without fields=
+        """
+
+        frames = []
+        values = [content]
+        while values:
+            value = values.pop()
+            if isinstance(value, pd.DataFrame):
+                frames.append(value)
+            elif isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                values.extend(value)
+        if len(frames) != 1:
+            raise ValueError(f'format {response_format} returns one table but the response has {len(frames)}, select one with fields')
+        if frames[0].attrs.get('layout') == Render.INDEX_LAYOUT:
+            # The index of an indexed DataFrame becomes the first column of the table
+            frame = frames[0].reset_index()
+            frame.attrs = {}
+            return frame
+        return frames[0]
+
+    def table(frame:pd.DataFrame, response_format:str) -> bytes:
+        """table
+        description:
+            * Encodes a DataFrame as CSV, Arrow IPC stream or Parquet
+
+        Returns:
+            bytes: Encoded DataFrame
+
+        Args:
+            frame (pd.DataFrame): DataFrame to encode
+            response_format (string): csv, arrow or parquet
+        """
+
+        return b''.join(Render.stream([frame], response_format))
+
+    def stream(frames, response_format:str):
+        """stream
+        description:
+            * Encodes DataFrames with the same columns as one table, the encoded part of every DataFrame is yielded
+              as soon as it is written: CSV rows, an Arrow record batch or a Parquet row group
+            * The schema of Arrow and Parquet is taken from the first DataFrame
+            * MessagePack yields one object per row like newline delimited json
+
+        Returns:
+            Generator: Encoded parts of the table
+
+        Args:
+            frames (Generator): DataFrames with the same columns
+            response_format (string): csv, arrow, parquet or msgpack
+
+        tests:
+            * Test if the decoded table of several DataFrames equals their concatenation
+            * Test if every part is yielded before the next DataFrame is read
+        """
+
+        if response_format == 'csv':
+            header = True
+            for frame in frames:
+                yield frame.to_csv(index=False, header=header).encode('utf-8')
+                header = False
+
+        elif response_format == 'msgpack':
+            for frame in frames:
+                yield b''.join(Render.msgpack(row) for row in Render.content(frame))
+
+        else:
+            sink = Sink()
+            writer = None
+            for frame in frames:
+                table = pyarrow.Table.from_pandas(frame, schema=writer.schema if writer else None, preserve_index=False)
+                if writer is None:
+                    if response_format == 'parquet':
+                        writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+                    else:
+                        writer = pyarrow.ipc.new_stream(sink, table.schema)
+                writer.write_table(table)
+                yield sink.drain()
+            if writer is not None:
+                writer.close()
+                yield sink.drain()
+
+    def content(value, layout:str=DEFAULT_LAYOUT):
+        """content
+        description:
+            * Replaces the DataFrames inside of the content with their rows in the given layout
+            * The values of a column are read at once with Series.tolist, which returns python values and Timestamps
+
+        Returns:
+            dict: Content without DataFrames
+
+        Args:
+            value (dict): Content, DataFrames may be values of dicts and lists
+            layout (string): Layout of the rows, see Render.LAYOUTS
+        """
+
+        if isinstance(value, pd.DataFrame) and value.attrs.get('layout') == Render.INDEX_LAYOUT:
+            index = value.index.tolist()
+            return {str(column): dict(zip(index, series.tolist())) for column, series in value.items()}
+        if isinstance(value, pd.DataFrame):
+            columns = [str(column) for column in value.columns]
+            rows = zip(*[series.tolist() for _, series in value.items()])
+            if layout == 'columns':
+                return {'columns': columns, 'data': list(rows)}
+            return [dict(zip(columns, row)) for row in rows]
+        if isinstance(value, dict):
+            return {key: Render.content(item, layout) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [Render.content(item, layout) for item in value]
+        return value
+
+    def indexed(frame:pd.DataFrame) -> pd.DataFrame:
+        """indexed
+        description:
+            * Marks the DataFrame to be returned in the INDEX_LAYOUT, e.g. the stations by their id
+            * The table formats return the index as the first column
+
+        Returns:
+            DataFrame: Copy of the DataFrame with the layout in its attrs
+
+        Args:
+            frame (pd.DataFrame): DataFrame with a named index
+        """
+
+        frame = frame.copy(deep=False)
+        frame.attrs['layout'] = Render.INDEX_LAYOUT
+        return frame
+
+    def json(content) -> bytes:
+        """json
+        description:
+            * Encodes the content as json, with orjson if it is installed
+            * Dates, Timestamps and Decimals are encoded like JsonResponse does, NaN is encoded as null by orjson
+
+        Returns:
+            bytes: Encoded content
+
+        Args:
+            content (dict): Content without DataFrames, see Render.content
+        """
+
+        if orjson is not None:
+            return orjson.dumps(
+                content, default=DjangoJSONEncoder().default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+        return json.dumps(content, cls=DjangoJSONEncoder).encode('utf-8')
+
+    def msgpack(content) -> bytes:
+        """msgpack
+        description:
+            * Encodes the content as MessagePack, dates and Timestamps are encoded like json
+
+        Returns:
+            bytes: Encoded content
+
+        Args:
+            content (dict): Content without DataFrames, see Render.content
+        """
+
+        return msgpack.packb(content, default=lambda value: value.item() if hasattr(value, 'item') else DjangoJSONEncoder().default(value))
+
+    def encoding(accept_encoding:str) -> str:
+        """encoding
+        description:
+            * Returns the preferred content encoding of ENCODINGS the client accepts, encodings with q=0 are refused
+
+        Returns:
+            string: Content encoding, None if the response is not compressed
+
+        Args:
+            accept_encoding (string): Accept-Encoding header of the request
+
+        tests:
+            * Test if "gzip, deflate" returns gzip
+            * Test if "gzip;q=0" and no header return None
+        """
+
+        accepted = set()
+        for coding in (accept_encoding or '').split(','):
+            name, _, params = coding.strip().partition(';')
+            quality = params.strip().replace(' ', '')
+            if quality.startswith('q=') and quality[2:] in ('0', '0.0', '0.00', '0.000'):
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in Render.ENCODINGS:
+            if encoding in accepted or '*' in accepted:
+                return encoding
+        return None
+
+    def compress(content:bytes, encoding:str) -> bytes:
+        """compress
+        description:
+            * Compresses the content with the content encoding
+
+        Returns:
+            bytes: Compressed content
+
+        Args:
+            content (bytes): Content of the response
+            encoding (string): Content encoding, see Render.encoding
+
+        tests:
+            * Test if the decompressed content equals the content
+        """
+
+        if encoding == 'br':
+            return brotli.compress(content, quality=5)
+        # mtime=0 keeps the compressed content of the same response the same
+        return gzip.compress(content, compresslevel=6, mtime=0)
+
+
+
+class Sink:
+    """Class Sink
+    description:
+        * Output file of the Arrow and Parquet writers that keeps the written bytes until they are drained, so a table
+          is sent while it is written
+        * The position counts every written byte, Parquet saves the offsets of its row groups
+    """
+
+    def __init__(self) -> None:
+        self.__parts = []
+        self.__position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.__parts.append(bytes(data))
+        self.__position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.__position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        """drain
+        description:
+            * Returns the bytes written since the last drain
+
+        Returns:
+            bytes: Written bytes
+        """
+
+        data = b''.join(self.__parts)
+        self.__parts = []
+        return data
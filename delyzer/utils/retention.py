@@ -0,0 +1,177 @@
+# Dennis Hilgert
+
+from django.db import transaction
+from django.db.models import Count, QuerySet, Sum
+from django.utils import timezone
+from delyzer.models import Departure, DelayRollup, RetentionHorizon, TimeslotRollup, FINE_SLOT_MINUTES
+from delyzer.utils.cache import ResponseCache
+from delyzer.utils.rollup import Rollup
+import datetime, logging, time, numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Id of the single row of the retention horizon
+RETENTION_HORIZON_ID = 1
+
+class Retention:
+    """Class Retention
+    description:
+        * Helper class to age the departures of the database
+        * The departures of the service dates before the retention horizon are folded into the delay rollup and the
+          timeslot rollup and deleted, the analytics endpoints answer these service dates from the rollups
+        * Departures are deleted in small batches with a transaction each, so the collector is never blocked for long
+    """
+
+    def horizon() -> datetime.date:
+        """
+        Returns the first service date whose departures are kept in the database
+
+        Returns:
+            datetime.date: Retention horizon, None if no departures were deleted yet
+        """
+
+        return RetentionHorizon.objects.filter(pk=RETENTION_HORIZON_ID).values_list('service_date', flat=True).first()
+
+    def advance(service_date: datetime.date) -> datetime.date:
+        """
+        Moves the retention horizon forward to the given service date, it is never moved back because the departures
+        before it may be deleted already
+
+        Args:
+            service_date (datetime.date): New retention horizon
+
+        Returns:
+            datetime.date: Retention horizon after the change
+
+        Tests:
+            * Pass in a service date before the current horizon: Horizon should stay the same
+        """
+
+        with transaction.atomic():
+            horizon = RetentionHorizon.objects.select_for_update().filter(pk=RETENTION_HORIZON_ID).first()
+            if horizon is None:
+                RetentionHorizon.objects.create(pk=RETENTION_HORIZON_ID, service_date=service_date)
+            elif horizon.service_date < service_date:
+                horizon.service_date = service_date
+                horizon.updated = timezone.now()
+                horizon.save()
+            else:
+                return horizon.service_date
+            # Cached responses of the short timeslots change with the horizon
+            ResponseCache.bump()
+        return service_date
+
+    def fold(service_date: datetime.date) -> bool:
+        """
+        Makes sure that the delay rollup contains every departure of the service date before they are deleted.
+        The rollup is maintained by the collector, it is only rebuilt from the departures of the service date
+        if it counts fewer departures, e.g. for departures that were saved before the rollup existed.
+
+        Args:
+            service_date (datetime.date): Service date to fold
+
+        Returns:
+            bool: Wether the rollup of the service date was rebuilt
+
+        Tests:
+            * Pass in a service date that the collector saved: Rollup should stay the same and the function should return False
+            * Pass in a service date without rollup rows: Rollup should be rebuilt and the function should return True
+        """
+
+        departures = Departure.objects.filter(service_date=service_date).count()
+        folded = DelayRollup.objects.filter(service_date=service_date).aggregate(count=Sum('count'))['count'] or 0
+        # Departures that were archived and pruned before are only counted by the rollup, it must not be rebuilt then
+        if departures <= folded:
+            return False
+        logger.info('Rollup of %s counts %s of %s departures, rebuilding it', service_date, folded, departures)
+        Rollup.rebuild(service_date, service_date)
+        return True
+
+    def fold_timeslots(service_date: datetime.date, archive=None) -> int:
+        """
+        Folds the departures of the service date into the timeslot rollup, so its short timeslots are still answered
+        after the departures are deleted. Departures that were archived and pruned before are read from the archive.
+        A service date is only folded once, its departures may be deleted partly afterwards.
+
+        Args:
+            service_date (datetime.date): Service date to fold
+            archive (DepartureArchive): Archive of the pruned departures, None if there is none
+
+        Returns:
+            int: Number of saved timeslot rollup rows, 0 if the service date was folded before
+
+        Tests:
+            * Pass in a service date: Count and delay sum of every short timeslot should equal the ones of its departures
+            * Pass in a service date that was archived and pruned: Archived departures should be folded as well
+            * Pass in a service date twice: Second call should return 0 and keep the rows
+        """
+
+        if TimeslotRollup.objects.filter(service_date=service_date).exists():
+            return 0
+
+        departures = Departure.objects.named('line_number', 'direction').filter(service_date=service_date)
+        slots = departures.annotate(slot=Rollup.slot_expression(minutes=FINE_SLOT_MINUTES)) \
+            .values('line_number', 'direction', 'slot').annotate(count=Count('id'), delay_sum=Sum('delay')).order_by()
+        sums = {(row['line_number'], row['direction'], row['slot']): [row['count'], row['delay_sum']] for row in slots}
+
+        if archive is not None:
+            ids = np.sort(np.fromiter(departures.values_list('id', flat=True), dtype=np.int64))
+            archive_df = archive.frame(window={'since': service_date, 'until': service_date}, exclude=ids)
+            archive_df['slot'] = archive_df['seconds'] // (FINE_SLOT_MINUTES * 60)
+            archived = archive_df.groupby(['line_number', 'direction', 'slot'])['delay'].agg(['count', 'sum'])
+            for (line, direction, slot), count, delay_sum in zip(archived.index, archived['count'], archived['sum']):
+                previous = sums.setdefault((line, direction, int(slot)), [0, 0])
+                previous[0] += int(count)
+                previous[1] += int(delay_sum)
+
+        folded = sum(count for count, _ in sums.values())
+        expected = DelayRollup.objects.filter(service_date=service_date).aggregate(count=Sum('count'))['count'] or 0
+        if folded != expected:
+            logger.warning('Timeslot rollup of %s counts %s departures, the delay rollup %s', service_date, folded, expected)
+
+        rows = [
+            TimeslotRollup(
+                line_number=line, direction=direction, slot=slot, service_date=service_date,
+                weekday=service_date.isoweekday(), count=count, delay_sum=delay_sum
+            )
+            for (line, direction, slot), (count, delay_sum) in sums.items()
+        ]
+        with transaction.atomic():
+            TimeslotRollup.objects.bulk_create(rows, batch_size=2000)
+            # Cached responses of the short timeslots change with the folded service dates
+            ResponseCache.bump()
+        return len(rows)
+
+    def prune(departures: QuerySet, batch_size: int = 5000, pause: float = 0.0) -> int:
+        """
+        Deletes the given departures in batches with a transaction each. The generation of the data version is
+        incremented once at the end, so the departure store loads the departures again only once.
+
+        Args:
+            departures (QuerySet): Departures to delete
+            batch_size (int): Maximum number of departures per transaction
+            pause (float): Seconds to wait between two batches, so other writers get the database in between
+
+        Returns:
+            int: Number of deleted departures
+
+        Tests:
+            * Pass in more departures than the batch size: All of them should be deleted with several transactions
+        """
+
+        deleted = 0
+        try:
+            while True:
+                ids = list(departures.order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    return deleted
+                with transaction.atomic():
+                    count, _ = Departure.objects.filter(id__in=ids).delete()
+                deleted += count
+                if pause:
+                    time.sleep(pause)
+        finally:
+            # Also if a batch failed, the batches before it are deleted
+            if deleted:
+                with transaction.atomic():
+                    ResponseCache.bump(deleted=True)
@@ -0,0 +1,217 @@
+# Samuel Matzeit
+import numpy as np
+import pandas as pd
+import logging
+
+from ..models import LATE_DELAY
+
+logger = logging.getLogger(__name__)
+
+class Risk:
+    """Class Risk
+    description:
+        * Helper class to compute delay propabilities for any number of thresholds at once
+        * The delay histograms of the rollup rows have one bin per minute, they are added up per group with one bincount over all groups
+        * The propability of a delay > t is read from the cumulative histogram of the group
+    """
+
+    # Delays of 0 to BINS - 2 minutes have their own bin, the last bin counts all delays of BINS - 1 minutes or more.
+    # Early departures are counted as on time
+    BINS = 31
+
+    # Data type of the histograms that are saved in the delay rollup, little endian unsigned 16 bit integers
+    DTYPE = np.dtype('<u2')
+
+    # Threshold in minutes that is used if no threshold is given
+    DEFAULT_THRESHOLD = LATE_DELAY
+
+    def thresholds(value:str) -> list:
+        """thresholds
+        description:
+            * Parses the comma separated thresholds of the threshold query parameter
+
+        Returns:
+            list: Thresholds in minutes, the default threshold if no value is given
+
+        Args:
+            value (string): Comma separated thresholds in minutes, e.g. "2,3,5"
+
+        Raises:
+            ValueError: If a threshold is not a whole number between 0 and BINS - 2
+
+        tests:
+            * Test if no value returns the default threshold
+            * Test if "3,5" returns [3, 5]
+            * Test if a negative or too large threshold raises a ValueError
+        """
+
+        if not value:
+            return [Risk.DEFAULT_THRESHOLD]
+
+        thresholds = []
+        for item in value.split(','):
+            try:
+                threshold = int(item)
+            except ValueError:
+                raise ValueError(f'threshold must be a whole number of minutes, got "{item}"')
+            if not 0 <= threshold <= Risk.BINS - 2:
+                raise ValueError(f'threshold must be between 0 and {Risk.BINS - 2} minutes, got {threshold}')
+            thresholds.append(threshold)
+        return list(dict.fromkeys(thresholds))
+
+    def bins(delays) -> np.ndarray:
+        """bins
+        description:
+            * Returns the histogram bin of every delay
+
+        Returns:
+            ndarray: Bin index of every delay
+
+        Args:
+            delays (array_like): Delays in minutes
+        """
+
+        return np.clip(np.asarray(delays, dtype=np.int64), 0, Risk.BINS - 1)
+
+    def histogram(codes, n_groups:int, delays=None, counts=None) -> np.ndarray:
+        """histogram
+        description:
+            * Counts the delays of every group in one histogram per group with a single bincount
+            * Either raw delays or already counted histograms (e.g. of the rollup) are added up
+
+        Returns:
+            ndarray: Histogram matrix with one row per group and one column per bin
+
+        Args:
+            codes (array_like): Group code of every delay or every histogram
+            n_groups (int): Number of groups
+            delays (array_like): Delay of every departure in minutes
+            counts (ndarray): Histogram of every row, one row per code
+
+        tests:
+            * Test if the sum of the histogram of a group equals the number of its departures
+            * Test if raw delays and their histograms result in the same group histograms
+        """
+
+        codes = np.asarray(codes, dtype=np.int64)
+        if delays is not None:
+            flat = codes * Risk.BINS + Risk.bins(delays)
+            weights = None
+        else:
+            flat = (codes[:, None] * Risk.BINS + np.arange(Risk.BINS)).ravel()
+            weights = np.asarray(counts, dtype=np.int64).ravel()
+        histogram = np.bincount(flat, weights=weights, minlength=n_groups * Risk.BINS)
+        return histogram.astype(np.int64).reshape(n_groups, Risk.BINS)
+
+    def exceedance(histogram:np.ndarray, thresholds:list) -> np.ndarray:
+        """exceedance
+        description:
+            * Returns the propability of a delay > t in % of every group for every threshold t
+            * The tail sums of all thresholds are read from one reversed cumulative sum per group
+
+        Returns:
+            ndarray: Propabilities with one row per group and one column per threshold, rounded to 2 decimals
+
+        Args:
+            histogram (ndarray): Histogram matrix of the groups
+            thresholds (list): Thresholds in minutes
+
+        tests:
+            * Test if the propability value is between 0 and 100
+            * Test if the propability of a threshold of 2 equals the share of delays > 2
+            * Test if the propability falls with higher thresholds
+        """
+
+        # tail[:, b] is the number of delays that fall into bin b or a higher bin
+        tail = np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1]
+        total = tail[:, 0]
+        late = tail[:, np.asarray(thresholds, dtype=np.int64) + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            propability = np.where(total[:, None] > 0, late * 100 / total[:, None], np.nan)
+        return np.round(propability, 2)
+
+    def by_group(rollup_df:pd.DataFrame, group:list, thresholds:list, counts:np.ndarray) -> pd.DataFrame:
+        """by_group
+        description:
+            * Groups the rollup rows by the given columns, adds up their delay histograms and returns the delay
+              propabilities of every group
+            * Column delay holds the propability of the first threshold, column delay_gt_<t> every threshold if more than one is given
+            * Ordered by the propability of the first threshold
+
+        Returns:
+            DataFrame: Group columns and propabilities
+
+        Args:
+            rollup_df (pd.DataFrame): Rollup rows with the group columns
+            group (list): Columns to group by
+            thresholds (list): Thresholds in minutes
+            counts (ndarray): Delay histogram of every rollup row, see Risk.decode_all
+
+        tests:
+            * Test if every group is just once in the return value
+            * Test if the column delay equals the propability of the first threshold
+            * Test if return type is a DataFrame
+        """
+
+        columns = group + ['delay'] + ([f'delay_gt_{threshold}' for threshold in thresholds] if len(thresholds) > 1 else [])
+        if rollup_df.empty:
+            return pd.DataFrame(columns=columns)
+
+        # Groups are numbered in the order of their first row, like the rows kept by drop_duplicates
+        codes = rollup_df.groupby(group, sort=False, dropna=False).ngroup().to_numpy()
+        result_df = rollup_df[group].drop_duplicates().reset_index(drop=True)
+        histogram = Risk.histogram(codes, len(result_df), counts=counts)
+        propability = Risk.exceedance(histogram, thresholds)
+
+        result_df['delay'] = propability[:, 0]
+        if len(thresholds) > 1:
+            for index, threshold in enumerate(thresholds):
+                result_df[f'delay_gt_{threshold}'] = propability[:, index]
+
+        return result_df[columns].sort_values('delay', ascending=False, kind='stable').reset_index(drop=True)
+
+    def encode(histogram:np.ndarray) -> bytes:
+        """encode
+        description:
+            * Converts the histogram of one rollup row into the bytes that are saved in the database
+
+        Returns:
+            bytes: Histogram in the data type DTYPE
+
+        Args:
+            histogram (ndarray): Histogram with one value per bin
+        """
+
+        return np.asarray(histogram).astype(Risk.DTYPE).tobytes()
+
+    def decode(data:bytes) -> np.ndarray:
+        """decode
+        description:
+            * Converts the saved bytes of one rollup row into its histogram
+
+        Returns:
+            ndarray: Histogram with one value per bin, only zeros if no histogram was saved
+
+        Args:
+            data (bytes): Saved histogram
+        """
+
+        if not data:
+            return np.zeros(Risk.BINS, dtype=np.int64)
+        return np.frombuffer(bytes(data), dtype=Risk.DTYPE).astype(np.int64)
+
+    def decode_all(data:list) -> np.ndarray:
+        """decode_all
+        description:
+            * Converts the saved bytes of many rollup rows into a histogram matrix with one vectorized read
+
+        Returns:
+            ndarray: Histogram matrix with one row per rollup row
+
+        Args:
+            data (list): Saved histograms
+        """
+
+        empty = bytes(Risk.BINS * Risk.DTYPE.itemsize)
+        buffer = b''.join(bytes(item) if item else empty for item in data)
+        return np.frombuffer(buffer, dtype=Risk.DTYPE).reshape(len(data), Risk.BINS).astype(np.int64)
@@ -0,0 +1,217 @@
+# Dennis Hilgert
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import ExtractHour, ExtractMinute, Greatest, Least
+from delyzer.models import Departure, DelayRollup, PrunedDate, ROLLUP_KEY_FIELDS, SLOT_MINUTES, LATE_DELAY
+from delyzer.utils.cache import ResponseCache
+from delyzer.utils.risk import Risk
+import datetime, logging, numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Aggregated values of a rollup row in the order of the changes passed to Rollup.apply, followed by the change of the delay histogram
+ROLLUP_VALUE_FIELDS = ['count', 'delay_sum', 'delay_square_sum', 'late_count']
+
+class Rollup:
+    """Class Rollup
+    description:
+        * Helper class to maintain the delay rollup
+        * The rollup holds the count, sum of delay, sum of squared delay, count of late departures and
+          the delay histogram of every line, direction, station, timeslot and service date
+    """
+
+    def slot(planned_departure_time: datetime.time) -> int:
+        """
+        Returns the timeslot of the day a planned departure time belongs to
+
+        Args:
+            planned_departure_time (datetime.time): Planned departure time
+
+        Returns:
+            int: Index of the timeslot, 0 for the first timeslot after midnight
+        """
+
+        return (planned_departure_time.hour * 60 + planned_departure_time.minute) // SLOT_MINUTES
+
+    def slot_expression(field: str = 'planned_departure_time', minutes: int = SLOT_MINUTES):
+        """
+        Returns the database expression of the timeslot of a time field
+
+        Args:
+            field (str): Name of the time field
+            minutes (int): Length of the timeslots in minutes
+
+        Returns:
+            CombinedExpression: Expression of the index of the timeslot
+        """
+
+        return (ExtractHour(field) * 60 + ExtractMinute(field)) / minutes
+
+    def key(data: dict) -> tuple:
+        """
+        Returns the key of the rollup row the given departure data belongs to
+
+        Args:
+            data (dict): Departure data with line_number, direction, station_id, planned_departure_time and service_date
+
+        Returns:
+            tuple: Values of the rollup key fields
+        """
+
+        return (data['line_number'], data['direction'], data['station_id'], Rollup.slot(data['planned_departure_time']), data['service_date'])
+
+    def change(delay: int, previous_delay: int = None) -> tuple:
+        """
+        Returns the change of the aggregated values if a departure is saved with the given delay
+
+        Args:
+            delay (int): Saved delay in minutes
+            previous_delay (int): Delay the departure was saved with before, None for a new departure
+
+        Returns:
+            tuple: Changes of count, delay_sum, delay_square_sum, late_count and of the delay histogram
+
+        Tests:
+            * Pass in a new departure: Function should return a count of 1, the delay values and one more departure in the bin of the delay
+            * Pass in a departure whose delay changed from 1 to 3: Function should return a count of 0, a delay change of 2, one more late departure
+              and move one departure from the bin 1 to the bin 3
+        """
+
+        histogram = np.zeros(Risk.BINS, dtype=np.int64)
+        histogram[Risk.bins(delay)] += 1
+        if previous_delay is None:
+            return (1, delay, delay * delay, int(delay > LATE_DELAY), histogram)
+        histogram[Risk.bins(previous_delay)] -= 1
+        return (
+            0,
+            delay - previous_delay,
+            delay * delay - previous_delay * previous_delay,
+            int(delay > LATE_DELAY) - int(previous_delay > LATE_DELAY),
+            histogram
+        )
+
+    def apply(changes: dict, batch_size: int = 500) -> None:
+        """
+        Adds the given changes to the rollup rows, creates the rows that don't exist yet and increments the data version.
+        Has to be called inside of the transaction that saves the departures.
+
+        Args:
+            changes (dict): Changes of the aggregated values by rollup key
+            batch_size (int): Maximum number of rows that are written with one statement
+
+        Tests:
+            * Pass in changes of a new rollup key: Function should create the rollup row
+            * Pass in changes of an existing rollup key: Function should add the changes to the row
+        """
+
+        if not changes:
+            return
+
+        existing = DelayRollup.objects.filter(
+            line_number__in={key[0] for key in changes},
+            station_id__in={key[2] for key in changes},
+            service_date__in={key[4] for key in changes}
+        )
+        rows = {tuple(getattr(row, field) for field in ROLLUP_KEY_FIELDS): row for row in existing}
+
+        created, updated = [], []
+        for key, (*values, histogram) in changes.items():
+            row = rows.get(key)
+            if row is None:
+                created.append(DelayRollup(
+                    **dict(zip(ROLLUP_KEY_FIELDS, key)),
+                    **dict(zip(ROLLUP_VALUE_FIELDS, values)),
+                    weekday=key[4].isoweekday(),
+                    delay_histogram=Risk.encode(histogram)
+                ))
+                continue
+            for field, value in zip(ROLLUP_VALUE_FIELDS, values):
+                setattr(row, field, getattr(row, field) + value)
+            row.delay_histogram = Risk.encode(Risk.decode(row.delay_histogram) + histogram)
+            updated.append(row)
+
+        DelayRollup.objects.bulk_create(created, batch_size=batch_size)
+        DelayRollup.objects.bulk_update(updated, ROLLUP_VALUE_FIELDS + ['delay_histogram'], batch_size=batch_size)
+        ResponseCache.bump()
+
+    def rebuild(since: datetime.date = None, until: datetime.date = None, batch_size: int = 500) -> int:
+        """
+        Recomputes the rollup rows of the given service dates from the saved departures. Service dates that were
+        archived and pruned are skipped, the rollup is the only complete data of them in the database.
+
+        Args:
+            since (datetime.date): First service date to rebuild, all service dates up to until if None
+            until (datetime.date): Last service date to rebuild, all service dates from since if None
+            batch_size (int): Maximum number of rows that are written with one statement
+
+        Returns:
+            int: Number of rollup rows that were created
+
+        Tests:
+            * Rebuild the rollup after the collector ran: Rollup should be equal to the rollup maintained by the collector
+            * Rebuild one service date: Rollup rows of the other service dates should stay unchanged
+            * Rebuild after archive_departures --prune: Rollup rows of the pruned service dates should stay unchanged
+        """
+
+        pruned = PrunedDate.objects.values('service_date')
+        departures = Departure.objects.named('line_number', 'direction').exclude(service_date__in=pruned)
+        rollups = DelayRollup.objects.exclude(service_date__in=pruned)
+        if since is not None:
+            departures = departures.filter(service_date__gte=since)
+            rollups = rollups.filter(service_date__gte=since)
+        if until is not None:
+            departures = departures.filter(service_date__lte=until)
+            rollups = rollups.filter(service_date__lte=until)
+
+        aggregates = departures.annotate(slot=Rollup.slot_expression()).values(*ROLLUP_KEY_FIELDS).annotate(
+            count=Count('id'),
+            delay_sum=Sum('delay'),
+            delay_square_sum=Sum(F('delay') * F('delay')),
+            late_count=Count('id', filter=Q(delay__gt=LATE_DELAY))
+        ).order_by()
+        histograms = Rollup.histograms(departures)
+
+        created = 0
+        with transaction.atomic():
+            rollups.delete()
+            batch = []
+            for aggregate in aggregates.iterator(chunk_size=2000):
+                key = tuple(aggregate[field] for field in ROLLUP_KEY_FIELDS)
+                batch.append(DelayRollup(**aggregate, weekday=aggregate['service_date'].isoweekday(), delay_histogram=Risk.encode(histograms[key])))
+                if len(batch) >= batch_size:
+                    DelayRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            DelayRollup.objects.bulk_create(batch)
+            created += len(batch)
+            ResponseCache.bump()
+
+        logger.info('Rebuilt %s rollup rows', created)
+        return created
+
+    def histograms(departures) -> dict:
+        """
+        Counts the delay histograms of the rollup rows of the given departures in the database
+
+        Args:
+            departures (QuerySet): Departures to count
+
+        Returns:
+            dict: Delay histogram by rollup key
+
+        Tests:
+            * Pass in departures with delays of 0, 0 and 3 minutes: Histogram should count 2 departures in the bin 0 and 1 in the bin 3
+        """
+
+        delay_bin = Greatest(Least('delay', Value(Risk.BINS - 1)), Value(0))
+        counts = departures.annotate(slot=Rollup.slot_expression(), delay_bin=delay_bin) \
+            .values(*ROLLUP_KEY_FIELDS, 'delay_bin').annotate(count=Count('id')).order_by()
+
+        histograms = {}
+        for count in counts.iterator(chunk_size=2000):
+            key = tuple(count[field] for field in ROLLUP_KEY_FIELDS)
+            if key not in histograms:
+                histograms[key] = np.zeros(Risk.BINS, dtype=np.int64)
+            histograms[key][count['delay_bin']] += count['count']
+        return histograms
@@ -0,0 +1,237 @@
+# Dennis Hilgert
+
+from datetime import datetime
+import heapq, itertools, logging
+
+logger = logging.getLogger(__name__)
+
+class RequestBudget:
+    """
+    Token bucket that limits the requests to the vvs api to a global number of requests per second
+    """
+
+    def __init__(self, max_rps: float, burst: int = 1) -> None:
+        self.__rate = max_rps
+        self.__capacity = max(burst, 1)
+        self.__tokens = float(self.__capacity)
+        self.__updated: float = None
+
+
+
+    def refill(self, now: float) -> None:
+        """
+        Adds the tokens that were earned since the last refill
+
+        Args:
+            now (float): Current timestamp in seconds
+        """
+
+        if self.__updated is not None:
+            self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+        self.__updated = now
+
+
+
+    def available(self, now: float) -> int:
+        """
+        Returns the number of requests that may be sent right now
+
+        Args:
+            now (float): Current timestamp in seconds
+
+        Returns:
+            int: Number of available requests
+
+        Tests:
+            * Call it twice without consuming: Function should return the same number
+            * Call it after consuming all tokens: Function should return 0 until enough time passed
+        """
+
+        self.refill(now)
+        return int(self.__tokens)
+
+
+
+    def consume(self, now: float) -> None:
+        """
+        Takes the token of one request from the bucket
+
+        Args:
+            now (float): Current timestamp in seconds
+        """
+
+        self.refill(now)
+        self.__tokens -= 1
+
+
+
+    def seconds_until_available(self, now: float) -> float:
+        """
+        Returns the seconds until the next request may be sent
+
+        Args:
+            now (float): Current timestamp in seconds
+
+        Returns:
+            float: Seconds to wait, 0 if a request may be sent right now
+        """
+
+        self.refill(now)
+        if self.__tokens >= 1:
+            return 0
+        return (1 - self.__tokens) / self.__rate
+
+
+
+class PollScheduler:
+    """
+    Priority queue of the observed stations ordered by the time of their next poll.
+    The next poll of a station is derived from the departures it returned: stations are polled often shortly
+    before their next departure and rarely between sparse departures or at night.
+    If the request budget cannot keep up, the most overdue stations are polled first and the coverage shows
+    the fraction of stations that are still refreshed within their target window.
+    """
+
+    def __init__(self, min_intervall: float = 12, max_intervall: float = 900, lead_time: float = 300) -> None:
+        self.__min_intervall = min_intervall
+        self.__max_intervall = max_intervall
+        # Seconds before a departure from which on the station is polled in the minimum intervall
+        self.__lead_time = lead_time
+
+        self.__queue: list = []
+        # Sequence number that keeps the order of stations with the same poll time stable
+        self.__counter = itertools.count()
+        # Deadline until which every station has to be refreshed again by its station id
+        self.__deadlines: dict = {}
+
+
+
+    def __len__(self) -> int:
+        return len(self.__queue)
+
+
+
+    def add(self, station_id, when: float) -> None:
+        """
+        Schedules the next poll of a station
+
+        Args:
+            station_id (str | int): Id of the station
+            when (float): Timestamp of the next poll in seconds
+        """
+
+        heapq.heappush(self.__queue, (when, next(self.__counter), station_id))
+
+
+
+    def refreshed(self, station_id, now: float, intervall: float) -> None:
+        """
+        Records a successful poll of a station and schedules its next poll
+
+        Args:
+            station_id (str | int): Id of the station
+            now (float): Timestamp of the poll in seconds
+            intervall (float): Seconds until the next poll
+        """
+
+        # A station is counted as refreshed in time if its next poll is not later than one minimum intervall
+        self.__deadlines[station_id] = now + intervall + self.__min_intervall
+        self.add(station_id, now + intervall)
+
+
+
+    def coverage(self, stations: int, now: float) -> float:
+        """
+        Returns the fraction of stations that were refreshed within their target window
+
+        Args:
+            stations (int): Number of observed stations
+            now (float): Current timestamp in seconds
+
+        Returns:
+            float: Fraction between 0 and 1, stations that were never refreshed count as not covered
+
+        Tests:
+            * Call it before any station was polled: Function should return 0
+            * Call it while the budget keeps up with all stations: Function should return 1
+        """
+
+        if stations == 0:
+            return 0
+        covered = sum(1 for deadline in self.__deadlines.values() if deadline >= now)
+        return covered / stations
+
+
+
+    def pop_due(self, now: float, limit: int) -> list:
+        """
+        Removes the stations whose poll is due from the queue, the most overdue station first
+
+        Args:
+            now (float): Current timestamp in seconds
+            limit (int): Maximum number of stations to return
+
+        Returns:
+            list: Ids of the stations that have to be polled now
+
+        Tests:
+            * Call it before any poll is due: Function should return an empty list
+            * Call it with more due stations than the limit: Function should return the most overdue stations
+        """
+
+        due = []
+        while self.__queue and len(due) < limit and self.__queue[0][0] <= now:
+            due.append(heapq.heappop(self.__queue)[2])
+        return due
+
+
+
+    def seconds_until_due(self, now: float) -> float:
+        """
+        Returns the seconds until the next poll is due
+
+        Args:
+            now (float): Current timestamp in seconds
+
+        Returns:
+            float: Seconds to wait, 0 if a poll is due and None if no station is scheduled
+        """
+
+        if not self.__queue:
+            return None
+        return max(self.__queue[0][0] - now, 0)
+
+
+
+    def next_intervall(self, departures: list, now: datetime) -> float:
+        """
+        Computes the seconds until the next poll of a station from the departures it returned. This means:
+
+        * Find the next departure that has not left yet, by its real time if available
+        * Poll in the minimum intervall if it leaves within the lead time
+        * Otherwise poll again when the lead time of the departure starts, bound by the maximum intervall
+
+        Args:
+            departures (list): Departures returned by the vvs api for the station
+            now (datetime): Current local time
+
+        Returns:
+            float: Seconds until the next poll
+
+        Tests:
+            * Pass in no departures: Function should return the maximum intervall
+            * Pass in a departure that leaves within the lead time: Function should return the minimum intervall
+            * Pass in a departure that leaves in hours: Function should return the maximum intervall
+        """
+
+        upcoming = []
+        for departure in departures or []:
+            departure_time = getattr(departure, 'real_datetime', None) or departure.datetime
+            if departure_time is not None and departure_time >= now:
+                upcoming.append(departure_time)
+        if not upcoming:
+            return self.__max_intervall
+
+        seconds_until_departure = (min(upcoming) - now).total_seconds()
+        intervall = seconds_until_departure - self.__lead_time
+        return min(max(intervall, self.__min_intervall), self.__max_intervall)
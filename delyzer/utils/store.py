@@ -0,0 +1,413 @@
+# Samuel Matzeit
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+import numpy as np
+import pandas as pd
+import json
+import logging
+import os
+import shutil
+import threading
+
+from ..models import Departure
+from .archive import DepartureArchive
+from .cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+class DepartureStore:
+    """Class DepartureStore
+    description:
+        * Columnar copy of the departures inside of the process, so the Filter functions run without loading rows with the ORM
+        * Line, direction and station are saved as codes into their categories, the delay as int16 and the planned
+          departure time as seconds since midnight
+        * Loaded once and topped up with the departures that were saved or changed since the last refresh,
+          a refresh only reads the database if the data version changed
+        * If DEPARTURE_STORE_DIR is set, the store isn't loaded from the database but maps the columns that the
+          command publish_departures published into this directory, so every worker process shares them read only
+        * If DEPARTURE_ARCHIVE_DIR is set, the frames also contain the archived departures that were pruned from the
+          database, see DepartureArchive
+    """
+
+    # Values of the departures that are saved in the store
+    FIELDS = ['id', 'line_number', 'direction', 'station_id', 'delay', 'planned_departure_time', 'service_date', 'weekday']
+
+    # Data types of the columns
+    DTYPES = {
+        'id': np.int64,
+        'line': np.int16,
+        'direction': np.int16,
+        'station': np.int32,
+        'delay': np.int16,
+        'seconds': np.int32,
+        'day': np.int32,
+        'weekday': np.int8,
+    }
+
+    # Number of departures that are read from the database at once
+    CHUNK_SIZE = 5000
+
+    # Name of the file that describes the latest published columns, replaced at once when new columns are published
+    MANIFEST = 'manifest.json'
+    # Number of published versions that are kept, workers may still map the previous one
+    KEEP_PUBLISHED = 2
+
+    __instance = None
+    __lock = threading.Lock()
+
+    def __init__(self, directory:str=None, archive_directory:str=None) -> None:
+        # Directory of the published columns if the store maps them instead of loading the departures
+        self.__directory = directory
+        self.__manifest_mtime = None
+        # Archive of the departures that were pruned from the database
+        self.__archive = None
+        if archive_directory:
+            try:
+                self.__archive = DepartureArchive(archive_directory)
+            except ImportError as e:
+                logger.warning(f'{e}, the archived departures are left out')
+        self.clear()
+
+    def clear(self) -> None:
+        """clear
+        description:
+            * Removes every departure, the next refresh loads them again
+        """
+
+        self.__columns = {name: np.empty(0, dtype=dtype) for name, dtype in DepartureStore.DTYPES.items()}
+        self.__size = 0
+        # Categories of the codes and the code of every category
+        self.__categories = {'line': [], 'direction': [], 'station': []}
+        self.__codes = {'line': {}, 'direction': {}, 'station': {}}
+        # Data version and generation of the last refresh, the last loaded id and the last change time that was seen
+        self.__version = None
+        self.__generation = None
+        self.__last_id = 0
+        self.__last_change = None
+        # Wether the columns are mapped from published files
+        self.__mapped = False
+
+    @classmethod
+    def get(cls) -> 'DepartureStore':
+        """get
+        description:
+            * Returns the store of the process, refreshed to the current data version
+
+        Returns:
+            DepartureStore: Refreshed store
+
+        tests:
+            * Test if two calls return the same store
+            * Test if departures saved between two calls are in the store of the second call
+        """
+
+        with cls.__lock:
+            if cls.__instance is None:
+                cls.__instance = DepartureStore(
+                    getattr(settings, 'DEPARTURE_STORE_DIR', None), getattr(settings, 'DEPARTURE_ARCHIVE_DIR', None)
+                )
+            cls.__instance.refresh()
+            return cls.__instance
+
+    @classmethod
+    def preload(cls) -> None:
+        """preload
+        description:
+            * Loads the store in a background thread at the start of the process, so the first request doesn't wait for it
+            * The thread also keeps the database access out of the event loop of an ASGI server that imports the application
+            * Errors are only logged, e.g. if the database isn't migrated yet
+        """
+
+        def load():
+            try:
+                store = cls.get()
+                logger.info(f'Loaded {len(store)} departures into the departure store')
+            except Exception as e:
+                logger.warning(f'Failed to preload the departure store: {e}')
+            finally:
+                close_old_connections()
+
+        threading.Thread(target=load, name='delyzer-preload', daemon=True).start()
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def refresh(self) -> None:
+        """refresh
+        description:
+            * Appends the departures with an id greater than the last loaded id
+            * Updates the delay of loaded departures that changed since the last refresh
+            * Loads every departure again if departures were deleted, which is seen by the generation of the data version
+            * Maps the latest published columns instead if the store has a directory, see DepartureStore.attach
+
+        tests:
+            * Test if a refresh without a new data version doesn't read the departures
+            * Test if a changed delay of a loaded departure is updated
+            * Test if the store is loaded again after departures were deleted
+        """
+
+        if self.__directory is not None and self.attach():
+            return
+
+        version, generation = ResponseCache.generation()
+        if version == self.__version:
+            return
+        if self.__generation is not None and generation != self.__generation:
+            logger.info('Departures were deleted, loading the departure store again')
+            self.clear()
+
+        # The change time is read before the departures, so a change that is committed meanwhile is read again next time
+        last_change = Departure.objects.aggregate(last_change=Max('current_date'))['last_change']
+        if self.__last_change is not None and self.__size:
+            changed = Departure.objects.filter(id__lte=self.__last_id, current_date__gte=self.__last_change).values_list('id', 'delay')
+            self.update(list(changed))
+
+        last_id = self.__last_id
+        departures = Departure.objects.named('line_number', 'direction').filter(id__gt=last_id).order_by('id').values_list(*DepartureStore.FIELDS)
+        chunk = []
+        for row in departures.iterator(chunk_size=DepartureStore.CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) >= DepartureStore.CHUNK_SIZE:
+                self.append(chunk)
+                chunk = []
+        if chunk:
+            self.append(chunk)
+
+        self.__version = version
+        self.__generation = generation
+        self.__last_change = last_change
+
+    def publish(self, directory:str) -> bool:
+        """publish
+        description:
+            * Writes the columns into a new subdirectory of the given directory and replaces the manifest at once,
+              so a worker either maps the previous or the new columns but never a part of them
+            * Only the newest KEEP_PUBLISHED versions are kept
+
+        Returns:
+            bool: Wether new columns were published, False if the published columns already have the data version
+
+        Args:
+            directory (string): Directory of the published columns
+
+        tests:
+            * Test if a store attached to the directory returns the same frame as the publishing store
+            * Test if publishing the same data version twice writes nothing
+        """
+
+        manifest = DepartureStore.manifest(directory)
+        if manifest is not None and manifest['version'] == self.__version:
+            return False
+
+        name = f'v{self.__version}-{os.getpid()}'
+        path = os.path.join(directory, name)
+        os.makedirs(path, exist_ok=True)
+        for column, values in self.__columns.items():
+            np.save(os.path.join(path, column + '.npy'), values[:self.__size])
+
+        manifest = {
+            'version': self.__version,
+            'size': self.__size,
+            'path': name,
+            'categories': self.__categories,
+        }
+        temporary = os.path.join(directory, DepartureStore.MANIFEST + '.tmp')
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary, os.path.join(directory, DepartureStore.MANIFEST))
+
+        published = sorted(
+            (entry for entry in os.scandir(directory) if entry.is_dir()),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        for entry in published[DepartureStore.KEEP_PUBLISHED:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        return True
+
+    def attach(self) -> bool:
+        """attach
+        description:
+            * Maps the columns of the latest manifest of the directory read only, without copying them
+            * Only reads the manifest again if it was replaced since the last call
+
+        Returns:
+            bool: Wether published columns are mapped, False if nothing was published into the directory yet
+
+        tests:
+            * Test if a worker maps the columns again after a new version was published
+            * Test if the store loads the departures itself as long as nothing was published
+        """
+
+        try:
+            mtime = os.stat(os.path.join(self.__directory, DepartureStore.MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            if self.__mapped:
+                return True
+            if self.__manifest_mtime is None:
+                logger.warning(f'No departures published into {self.__directory}, loading them from the database')
+                self.__manifest_mtime = 0
+            return False
+        if mtime == self.__manifest_mtime:
+            return True
+
+        manifest = DepartureStore.manifest(self.__directory)
+        if manifest['version'] != self.__version or not self.__mapped:
+            columns_path = os.path.join(self.__directory, manifest['path'])
+            self.__columns = {
+                column: np.load(os.path.join(columns_path, column + '.npy'), mmap_mode='r')
+                for column in DepartureStore.DTYPES
+            }
+            self.__size = manifest['size']
+            self.__categories = manifest['categories']
+            self.__codes = {name: {value: code for code, value in enumerate(values)} for name, values in self.__categories.items()}
+            self.__version = manifest['version']
+            self.__mapped = True
+            logger.info(f'Mapped {self.__size} published departures of data version {self.__version}')
+        self.__manifest_mtime = mtime
+        return True
+
+    @staticmethod
+    def manifest(directory:str) -> dict:
+        """manifest
+        description:
+            * Reads the manifest of the published columns
+
+        Returns:
+            dict: Data version, number of departures, subdirectory of the columns and categories, None if nothing was published
+
+        Args:
+            directory (string): Directory of the published columns
+        """
+
+        try:
+            with open(os.path.join(directory, DepartureStore.MANIFEST)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def append(self, rows:list) -> None:
+        """append
+        description:
+            * Appends departures ordered by id to the columns, the columns grow by doubling their capacity
+
+        Args:
+            rows (list): Values of FIELDS of every departure
+        """
+
+        ids, lines, directions, stations, delays, times, dates, weekdays = zip(*rows)
+        values = {
+            'id': ids,
+            'line': self.encode('line', lines),
+            'direction': self.encode('direction', directions),
+            'station': self.encode('station', stations),
+            'delay': delays,
+            'seconds': [time.hour * 3600 + time.minute * 60 + time.second for time in times],
+            'day': [date.toordinal() for date in dates],
+            'weekday': weekdays,
+        }
+
+        size = self.__size + len(rows)
+        for name, column in self.__columns.items():
+            if size > len(column):
+                grown = np.empty(max(size, 2 * len(column)), dtype=column.dtype)
+                grown[:self.__size] = column[:self.__size]
+                self.__columns[name] = column = grown
+            column[self.__size:size] = values[name]
+        self.__size = size
+        self.__last_id = ids[-1]
+
+    def update(self, rows:list) -> None:
+        """update
+        description:
+            * Overwrites the delay of loaded departures, departures that are not loaded are skipped
+
+        Args:
+            rows (list): Id and delay of every changed departure
+        """
+
+        if not rows:
+            return
+        ids, delays = (np.asarray(values) for values in zip(*rows))
+        loaded = self.__columns['id'][:self.__size]
+        positions = np.minimum(np.searchsorted(loaded, ids), max(self.__size - 1, 0))
+        found = loaded[positions] == ids
+        self.__columns['delay'][positions[found]] = delays[found]
+
+    def encode(self, name:str, values) -> list:
+        """encode
+        description:
+            * Returns the codes of the values in the categories of the column, new values are added to the categories
+
+        Returns:
+            list: Code of every value
+
+        Args:
+            name (string): Column with categories, one of line, direction and station
+            values (Iterable): Values of the column
+        """
+
+        codes = self.__codes[name]
+        categories = self.__categories[name]
+        for value in set(values).difference(codes):
+            codes[value] = len(categories)
+            categories.append(value)
+        return [codes[value] for value in values]
+
+    def frame(self, line:str=None, direction:str=None, window:dict=None) -> pd.DataFrame:
+        """frame
+        description:
+            * Returns the departures of the line, direction and time window as delay data for the Filter functions
+            * The filters are applied on the codes and numbers before any row is built
+            * Archived departures that are not in the database anymore are added, see DepartureArchive.frame
+
+        Returns:
+            DataFrame: Delay data with the columns id, line_number, direction, station_id, delay, seconds and weekday
+
+        Args:
+            line (string): Line name
+            direction (string): Direction name
+            window (dict): Time window, see Window.params
+
+        tests:
+            * Test if the result equals the delay data loaded with the ORM
+            * Test if a line that doesn't exist returns an empty DataFrame
+        """
+
+        columns = {name: column[:self.__size] for name, column in self.__columns.items()}
+        mask = np.ones(self.__size, dtype=bool)
+        for name, value in [('line', line), ('direction', direction)]:
+            if value is not None:
+                mask &= columns[name] == self.__codes[name].get(value, -1)
+
+        window = window or {}
+        if 'since' in window:
+            mask &= columns['day'] >= window['since'].toordinal()
+        if 'until' in window:
+            mask &= columns['day'] <= window['until'].toordinal()
+        if 'weekdays' in window:
+            mask &= np.isin(columns['weekday'], window['weekdays'])
+        if 'hours' in window:
+            mask &= np.isin(columns['seconds'] // 3600, window['hours'])
+
+        lines = np.asarray(self.__categories['line'], dtype=object)
+        directions = np.asarray(self.__categories['direction'], dtype=object)
+        stations = np.asarray(self.__categories['station'], dtype=np.int64)
+        delay_df = pd.DataFrame({
+            'id': columns['id'][mask],
+            'line_number': lines[columns['line'][mask]],
+            'direction': directions[columns['direction'][mask]],
+            'station_id': stations[columns['station'][mask]],
+            'delay': columns['delay'][mask].astype(np.int64),
+            'seconds': columns['seconds'][mask],
+            'weekday': columns['weekday'][mask],
+        })
+        if self.__archive is None:
+            return delay_df
+
+        # Departures that are archived and still in the database are taken from the store
+        archive_df = self.__archive.frame(line, direction, window, exclude=columns['id'])
+        if archive_df.empty:
+            return delay_df
+        return pd.concat([archive_df, delay_df], ignore_index=True)
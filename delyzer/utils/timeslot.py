@@ -0,0 +1,208 @@
+# Samuel Matzeit
+import numpy as np
+import pandas as pd
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Timeslot:
+    """Class Timeslot
+    description:
+        * Helper class to group delays into timeslots of the day
+        * The timeslot of a departure is its planned departure time in seconds since midnight divided by the width of the timeslots
+        * Contains independet functions that return the modified object
+    """
+
+    # Allowed widths of the timeslots in minutes
+    WIDTHS = [5, 10, 15, 30, 60]
+    DEFAULT_WIDTH = 30
+
+    # Ways to handle timeslots without departures between the first and the last timeslot
+    #   previous: take the delay of the previous timeslot
+    #   none: delay is null
+    #   zero: delay is 0
+    FILLS = ['previous', 'none', 'zero']
+    DEFAULT_FILL = 'previous'
+
+    # Days of the timeslots if they are split into weekdays and weekend, by ISO weekday (1 = monday)
+    WEEKDAY = 'weekday'
+    WEEKEND = 'weekend'
+
+    def params(params) -> dict:
+        """params
+        description:
+            * Parses the query parameters slot, fill and split of the time endpoints
+
+        Returns:
+            dict: Arguments width, fill and split of by_time
+
+        Args:
+            params (QueryDict): Query parameters of the request
+
+        Raises:
+            ValueError: If one of the parameters is invalid
+        """
+
+        return {
+            'width': Timeslot.width(params.get('slot')),
+            'fill': Timeslot.fill(params.get('fill')),
+            'split': Timeslot.split(params.get('split')),
+        }
+
+    def width(value:str) -> int:
+        """width
+        description:
+            * Parses the query parameter slot, the width of the timeslots in minutes
+
+        Returns:
+            int: Width in minutes, DEFAULT_WIDTH if no value is given
+
+        Args:
+            value (string): Width in minutes
+
+        Raises:
+            ValueError: If the width is not one of WIDTHS
+
+        tests:
+            * Test if no value returns 30
+            * Test if "15" returns 15
+            * Test if "7" raises a ValueError
+        """
+
+        if not value:
+            return Timeslot.DEFAULT_WIDTH
+        if value not in [str(width) for width in Timeslot.WIDTHS]:
+            raise ValueError(f'slot must be one of {", ".join(str(width) for width in Timeslot.WIDTHS)} minutes, got "{value}"')
+        return int(value)
+
+    def fill(value:str) -> str:
+        """fill
+        description:
+            * Parses the query parameter fill, how timeslots without departures are returned
+
+        Returns:
+            string: One of FILLS, DEFAULT_FILL if no value is given
+
+        Args:
+            value (string): Way to fill empty timeslots
+
+        Raises:
+            ValueError: If the value is not one of FILLS
+        """
+
+        if not value:
+            return Timeslot.DEFAULT_FILL
+        if value not in Timeslot.FILLS:
+            raise ValueError(f'fill must be one of {", ".join(Timeslot.FILLS)}, got "{value}"')
+        return value
+
+    def split(value:str) -> bool:
+        """split
+        description:
+            * Parses the query parameter split, split=days returns the timeslots of weekdays and weekend separately
+
+        Returns:
+            bool: Wether the timeslots are split into weekdays and weekend
+
+        Args:
+            value (string): Value of the query parameter
+
+        Raises:
+            ValueError: If the value is not days
+        """
+
+        if not value:
+            return False
+        if value != 'days':
+            raise ValueError(f'split must be days, got "{value}"')
+        return True
+
+    def seconds(times:pd.Series) -> np.ndarray:
+        """seconds
+        description:
+            * Converts planned departure times to seconds since midnight without a loop in python
+
+        Returns:
+            ndarray: Seconds since midnight of every time
+
+        Args:
+            times (pd.Series): Planned departure times as datetime.time
+        """
+
+        return pd.to_timedelta(times.astype(str)).dt.total_seconds().to_numpy(dtype=np.int64)
+
+    def days(weekdays) -> np.ndarray:
+        """days
+        description:
+            * Returns weekday or weekend for ISO weekdays
+
+        Returns:
+            ndarray: WEEKDAY or WEEKEND of every weekday
+
+        Args:
+            weekdays (array_like): ISO weekdays, 1 is monday and 7 is sunday
+        """
+
+        return np.where(np.asarray(weekdays) >= 6, Timeslot.WEEKEND, Timeslot.WEEKDAY)
+
+    def frame(slot_df:pd.DataFrame, width:int, fill:str=DEFAULT_FILL, split:bool=False) -> pd.DataFrame:
+        """frame
+        description:
+            * Converts the summed up delays per timeslot index to the average delay per timeslot of today
+            * Every timeslot between the first and the last timeslot is returned, timeslots without departures
+              have a count of 0 and a delay depending on fill
+            * If split, the timeslots of weekdays and weekend are returned one after another with the column days
+
+        Returns:
+            DataFrame: Delay data with the columns timeslot_start, delay and count (and days) ordered by time
+
+        Args:
+            slot_df (pd.DataFrame): Delay data with the columns slot, delay_sum and count (and days)
+            width (int): Width of the timeslots in minutes
+            fill (string): Way to fill timeslots without departures, one of FILLS
+            split (bool): Wether slot_df has the column days
+
+        tests:
+            * Test if the timeslots have the given width
+            * Test if a timeslot without departures has a count of 0
+            * Test if fill=none returns no delay for a timeslot without departures
+            * Test if split returns the weekdays before the weekend
+        """
+
+        columns = (['days'] if split else []) + ['timeslot_start', 'delay', 'count']
+        if slot_df.empty:
+            return pd.DataFrame(columns=columns)
+
+        groups = [(None, slot_df)]
+        if split:
+            groups = [(days, slot_df[slot_df['days'] == days]) for days in [Timeslot.WEEKDAY, Timeslot.WEEKEND]]
+
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        frames = []
+        for days, group_df in groups:
+            if group_df.empty:
+                continue
+            sums_df = group_df.groupby('slot')[['delay_sum', 'count']].sum()
+            slots = np.arange(sums_df.index.min(), sums_df.index.max() + 1)
+            sums_df = sums_df.reindex(slots, fill_value=0)
+
+            counts = sums_df['count'].to_numpy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delays = np.where(counts > 0, sums_df['delay_sum'].to_numpy() / counts, np.nan)
+            delay_series = pd.Series(delays).round(2)
+            if fill == 'previous':
+                delay_series = delay_series.ffill()
+            elif fill == 'zero':
+                delay_series = delay_series.fillna(0.0)
+
+            frame_df = pd.DataFrame({
+                'timeslot_start': today + pd.to_timedelta(slots * width, unit='min'),
+                'delay': delay_series.astype(object).where(delay_series.notna(), None),
+                'count': counts.astype(int),
+            })
+            if split:
+                frame_df.insert(0, 'days', days)
+            frames.append(frame_df)
+
+        return pd.concat(frames, ignore_index=True)[columns]
@@ -0,0 +1,206 @@
+# Samuel Matzeit
+from django.db.models import Q, QuerySet
+import pandas as pd
+import datetime
+import logging
+
+from ..models import SLOT_MINUTES
+
+logger = logging.getLogger(__name__)
+
+class Window:
+    """Class Window
+    description:
+        * Helper class to restrict the analytics endpoints to a time window
+        * The window is given by the query parameters from, to (service dates), weekdays (ISO weekdays) and hours (hours of the day)
+        * Every restriction is applied as a predicate on an indexed or precomputed column, the service date, the weekday
+          and the timeslot of the rollup
+    """
+
+    def params(params) -> dict:
+        """params
+        description:
+            * Parses the query parameters from, to, weekdays and hours
+            * from and to are service dates in the format YYYY-MM-DD and both included
+            * weekdays and hours are comma separated numbers or ranges, e.g. weekdays=1-5 or hours=6-9,16-18
+
+        Returns:
+            dict: Window with the keys since, until, weekdays and hours, only the given restrictions are included
+
+        Args:
+            params (QueryDict): Query parameters of the request
+
+        Raises:
+            ValueError: If one of the parameters is invalid or since or until is given
+
+        tests:
+            * Test if no parameters return an empty window
+            * Test if since=2023-05-01 raises a ValueError instead of being ignored
+            * Test if weekdays=1-5 returns the weekdays 1 to 5
+            * Test if hours=24 raises a ValueError
+        """
+
+        # since and until are the names of departures/, ignoring them would return every service date
+        for name, alias in [('since', 'from'), ('until', 'to')]:
+            if params.get(name):
+                raise ValueError(f'{name} only applies to departures/, use {alias}')
+
+        window = {}
+        if params.get('from'):
+            window['since'] = Window.date(params.get('from'), 'from')
+        if params.get('to'):
+            window['until'] = Window.date(params.get('to'), 'to')
+        if params.get('weekdays'):
+            window['weekdays'] = Window.numbers(params.get('weekdays'), 'weekdays', 1, 7)
+        if params.get('hours'):
+            window['hours'] = Window.numbers(params.get('hours'), 'hours', 0, 23)
+        if 'since' in window and 'until' in window and window['since'] > window['until']:
+            raise ValueError('from must not be after to')
+        return window
+
+    def clamp(window:dict, since:datetime.date=None, until:datetime.date=None) -> dict:
+        """clamp
+        description:
+            * Restricts the service dates of the window to the given range, the other restrictions are kept
+
+        Returns:
+            dict: Window inside of the range, None if it has no service date inside of the range
+
+        Args:
+            window (dict): Window, see Window.params
+            since (datetime.date): First service date of the range, no restriction if not given
+            until (datetime.date): Last service date of the range, no restriction if not given
+
+        tests:
+            * Test if a window from 2023-05-01 clamped since 2023-05-10 starts at 2023-05-10
+            * Test if a window until 2023-05-01 clamped since 2023-05-10 returns None
+        """
+
+        window = dict(window or {})
+        if since is not None:
+            window['since'] = max(window.get('since', since), since)
+        if until is not None:
+            window['until'] = min(window.get('until', until), until)
+        if 'since' in window and 'until' in window and window['since'] > window['until']:
+            return None
+        return window
+
+    def rollups(rollups:QuerySet, window:dict, minutes:int=SLOT_MINUTES) -> QuerySet:
+        """rollups
+        description:
+            * Restricts rollup rows to the window, hours are converted to the timeslots of the rollup
+
+        Returns:
+            QuerySet: Rollup rows inside of the window
+
+        Args:
+            rollups (QuerySet): Rollup rows
+            window (dict): Window, see Window.params
+            minutes (int): Length of the timeslots of the rollup
+        """
+
+        if not window:
+            return rollups
+        rollups = rollups.filter(Window.dates(window))
+        if 'hours' in window:
+            slots_per_hour = 60 // minutes
+            rollups = rollups.filter(slot__in=[hour * slots_per_hour + slot for hour in window['hours'] for slot in range(slots_per_hour)])
+        return rollups
+
+    def frame(delay_df:pd.DataFrame, window:dict) -> pd.DataFrame:
+        """frame
+        description:
+            * Restricts delay data that is already loaded to the window
+
+        Returns:
+            DataFrame: Delay data inside of the window
+
+        Args:
+            delay_df (pd.DataFrame): Delay data with the columns service_date and planned_departure_time
+            window (dict): Window, see Window.params
+        """
+
+        if not window:
+            return delay_df
+        mask = pd.Series(True, index=delay_df.index)
+        if 'since' in window:
+            mask &= delay_df['service_date'] >= window['since']
+        if 'until' in window:
+            mask &= delay_df['service_date'] <= window['until']
+        if 'weekdays' in window:
+            mask &= (pd.to_datetime(delay_df['service_date']).dt.dayofweek + 1).isin(window['weekdays'])
+        if 'hours' in window:
+            mask &= (pd.to_timedelta(delay_df['planned_departure_time'].astype(str)).dt.components['hours']).isin(window['hours'])
+        return delay_df[mask]
+
+    def dates(window:dict) -> Q:
+        """dates
+        description:
+            * Returns the predicate of the service dates and weekdays of the window, shared by departures and rollup rows
+
+        Returns:
+            Q: Predicate of the columns service_date and weekday
+
+        Args:
+            window (dict): Window, see Window.params
+        """
+
+        dates = Q()
+        if 'since' in window:
+            dates &= Q(service_date__gte=window['since'])
+        if 'until' in window:
+            dates &= Q(service_date__lte=window['until'])
+        if 'weekdays' in window:
+            dates &= Q(weekday__in=window['weekdays'])
+        return dates
+
+    def numbers(value:str, name:str, low:int, high:int) -> list:
+        """numbers
+        description:
+            * Parses comma separated numbers and ranges, e.g. "1-5,7"
+
+        Returns:
+            list: Sorted numbers without duplicates
+
+        Args:
+            value (string): Value of the query parameter
+            name (string): Name of the query parameter for the error message
+            low (int): Lowest allowed number
+            high (int): Highest allowed number
+
+        Raises:
+            ValueError: If a part is not a number or range between low and high
+        """
+
+        numbers = set()
+        for part in value.split(','):
+            first, _, last = part.partition('-')
+            try:
+                first, last = int(first), int(last or first)
+            except ValueError:
+                raise ValueError(f'{name} must be numbers or ranges like {low}-{high}, got "{part}"')
+            if not low <= first <= last <= high:
+                raise ValueError(f'{name} must be between {low} and {high}, got "{part}"')
+            numbers.update(range(first, last + 1))
+        return sorted(numbers)
+
+    def date(value:str, name:str) -> datetime.date:
+        """date
+        description:
+            * Parses a query parameter that has to be a date in the format YYYY-MM-DD
+
+        Returns:
+            date: Parsed date
+
+        Args:
+            value (string): Value of the query parameter
+            name (string): Name of the query parameter for the error message
+
+        Raises:
+            ValueError: If the value is not a date
+        """
+
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a date in the format YYYY-MM-DD, got "{value}"')
@@ -1,28 +1,47 @@
 # Samuel Matzeit
 from .models import Departure
 from .serializers import DepartureSerializer
-from rest_framework.decorators import api_view
+from .renderers import ArrowRenderer, CSVRenderer, MessagePackRenderer, NDJSONRenderer, ParquetRenderer
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework import status
-import pandas as pd
 import logging
 
-from .utils.filter import Filter
+from .utils.cache import cached_response
+from .utils.export import Export
+from .utils.query import Query
+from .utils.ranking import Ranking
+from .utils.render import Render
+from .utils.risk import Risk
+from .utils.timeslot import Timeslot
+from .utils.window import Window
 
 logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer, CSVRenderer, ArrowRenderer, ParquetRenderer, MessagePackRenderer])
 def departure_list(request):
     """departure_list
     description:
-        * GET: returns a list of all departures in the database
+        * GET: returns the departures in the database page by page, ordered by id
+        * The next page is requested with the cursor of the field next
+        * With format=ndjson or the Accept header application/x-ndjson all matching departures are streamed
+          as newline delimited json, one departure per line
+        * With format=csv|arrow|parquet|msgpack or the Accept header of the format all matching departures are streamed
+          as one table in record batches, 406 if the server doesn't have the package of the format
 
     Returns:
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters are
+            * line, direction, station: filter by line, direction and station id
+            * since, until: filter by the service date (YYYY-MM-DD, both included)
+            * cursor: id of the last departure of the previous page
+            * limit: number of departures of a page (default 1000, max 10000)
+            * format: ndjson, csv, arrow, parquet or msgpack to stream all departures instead of one page
 
     Example:
         ```
@@ -38,7 +57,8 @@ def departure_list(request):
                 "line_name": "S-Bahn",
                 "planned_departure_time": "11:40:00",
                 "delay": 1,
-                "current_date": "2023-05-15T11:01:35.190999+02:00"
+                "current_date": "2023-05-15T11:01:35.190999+02:00",
+                "service_date": "2023-05-15"
             },
             {
                 "id": 53970,
@@ -50,15 +70,22 @@ def departure_list(request):
                 "line_name": "S-Bahn",
                 "planned_departure_time": "11:49:00",
                 "delay": 1,
-                "current_date": "2023-05-15T11:01:35.196941+02:00"
+                "current_date": "2023-05-15T11:01:35.196941+02:00",
+                "service_date": "2023-05-15"
             },
             ...
-        ]}
+        ],
+        "next": "http://localhost:8000/departures/?cursor=54968"
+        }
         ```
     
     tests:
         * Test that the API returns a list of departures.
         * Test that the API returns the correct departure data.
+        * Test that following the next links returns every departure exactly once.
+        * Test that format=ndjson returns the same departures as the pages.
+        * Test that format=parquet returns the same departures as the pages.
+        * Test that the API returns 400 for an invalid filter, cursor or limit
         * Test that the API returns 500 when there are any DB Problems
     """
 
@@ -66,10 +93,35 @@ def departure_list(request):
         try:
             logger.info("GET request for departure_list")
 
-            departures_data = Departure.objects.all()
-            serializer = DepartureSerializer(departures_data, many=True)
-            return JsonResponse({'departures':serializer.data})
+            # An unknown format falls back to another renderer, see FormatNegotiation
+            requested = request.query_params.get('format')
+            if requested and requested != request.accepted_renderer.format:
+                raise ValueError(f'format must be one of ndjson, {", ".join(Render.FORMATS)}, got "{requested}"')
+
+            filters = Export.filters(request.query_params)
+            departures_data = Export.departures(filters, Export.cursor(request.query_params))
+
+            if request.accepted_renderer.format == 'ndjson':
+                return StreamingHttpResponse(Export.ndjson(departures_data), content_type='application/x-ndjson')
+
+            if request.accepted_renderer.format in Render.STREAMS:
+                # MessagePack keeps the values of the json formats, the table formats the typed columns
+                frames = Export.frames(departures_data, serialized=request.accepted_renderer.format == 'msgpack')
+                return Render.streaming(frames, request.accepted_renderer.format)
+
+            departures, next_cursor = Export.page(departures_data, Export.limit(request.query_params))
+
+            next_url = None
+            if next_cursor is not None:
+                params = request.query_params.copy()
+                params['cursor'] = next_cursor
+                next_url = request.build_absolute_uri(request.path + '?' + params.urlencode())
+
+            return JsonResponse({'departures':departures, 'next':next_url})
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -121,7 +173,7 @@ def departure_detail(request, id: int):
         try:
             logger.info("GET request for departure_detail")
 
-            departure_data = Departure.objects.get(pk=id)
+            departure_data = Departure.objects.named().values(*DepartureSerializer.Meta.fields).get(pk=id)
 
             serializer = DepartureSerializer(departure_data)
             return JsonResponse({'departure':serializer.data})
@@ -135,6 +187,7 @@ def departure_detail(request, id: int):
     
 
 @api_view(['GET'])
+@cached_response
 def lines(request):
 
     """lines
@@ -173,20 +226,13 @@ def lines(request):
         try:
             logger.info("GET request for lines")
 
-            lines_df = pd.DataFrame(Departure.objects.values('line_number',
-            'id',
-            'direction',
-            'line_name'))
-
-            lines_df = lines_df.drop_duplicates(subset=['line_number','direction'])
-            lines_df = lines_df.sort_values(['line_number','direction'])
-
-            lines_df_selection = lines_df[['line_number','direction']]
+            lines_df = Query.lines()
             
-            lines_dict = lines_df_selection.to_dict('records')
-            
-            return JsonResponse({'lines':lines_dict})
+            return Render.response({'lines':lines_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -195,6 +241,7 @@ def lines(request):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@cached_response
 def stations(request):
     """stations
     description:
@@ -228,20 +275,13 @@ def stations(request):
     if request.method == 'GET':
         try:
             logger.info("GET request for stations")
-            stations_df = pd.DataFrame(Departure.objects.values('station_id'))
-
-            stations_df_unique = stations_df.drop_duplicates(subset='station_id')
-            stations_df_unique = stations_df_unique.reset_index(drop = True)
-            
-            stations_df_unique = Filter.join_station_name(stations_df_unique)
-
-            stations_df_sub = pd.DataFrame(stations_df_unique['Name mit Ort'])
-
-            stations_dict = stations_df_sub.to_dict()
+            stations_df = Query.stations()
 
-
-            return JsonResponse({'stations':stations_dict})
+            return Render.response({'stations':Render.indexed(stations_df[['Name mit Ort']])}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -250,6 +290,7 @@ def stations(request):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@cached_response
 def lines_by_delay(request):
     """lines_by_delay
     description:
@@ -259,7 +300,17 @@ def lines_by_delay(request):
         _type_: HttpResponse
     
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters from, to, weekdays and hours restrict the time window
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
 
     Example:
         ```
@@ -290,18 +341,16 @@ def lines_by_delay(request):
         try:
             logger.info("GET request for lines_by_delay")
 
-            delay_df = pd.DataFrame(Departure.objects.values('line_number',
-            'id',
-            'direction',
-            'delay',
-            'line_name'))
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_df = Filter.by_delay(delay_df)
+            delay_df = Query.by_delay(window=window, ranking=ranking)
             
-            delay_dict = delay_df.to_dict('records')
-
-            return JsonResponse({'delays':delay_dict})
+            return Render.response({'delays':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -309,7 +358,8 @@ def lines_by_delay(request):
     else:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-api_view(['GET'])
+@api_view(['GET'])
+@cached_response
 def line_by_delay(request, line, direction):
 
     """line_by_delay
@@ -320,10 +370,15 @@ def line_by_delay(request, line, direction):
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters from, to, weekdays and hours restrict the time window
         line (string): Line name
         direction (string): Direction name    
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
     Example:
         ```
             {
@@ -347,20 +402,15 @@ def line_by_delay(request, line, direction):
         try:
             logger.info("GET request for line_by_delay")
 
-            delay_df = pd.DataFrame(Departure.objects.values('line_number',
-            'id',
-            'direction',
-            'delay',
-            'line_name'))
-            
-            delay_df = Filter.by_line(delay_df, line, direction)
-
-            delay_df = Filter.by_delay(delay_df)
+            window = Window.params(request.query_params)
 
-            delay_dict = delay_df.to_dict('records')
+            delay_df = Query.by_delay(line, direction, window=window)
 
-            return JsonResponse({'delays':delay_dict})
+            return Render.response({'delays':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -369,6 +419,7 @@ def line_by_delay(request, line, direction):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@cached_response
 def delay_at_time(request):
 
     """delay_at_time
@@ -379,7 +430,16 @@ def delay_at_time(request):
         _type_: HttpResponse
     
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters are
+            * slot: width of the timeslots in minutes, 5, 10, 15, 30 or 60 (default 30)
+            * fill: delay of timeslots without departures, previous, none or zero (default previous)
+            * split: days to return the timeslots of weekdays and weekend separately
+            * from, to, weekdays, hours: time window, see below
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
 
     Example:
         ```    
@@ -388,11 +448,13 @@ def delay_at_time(request):
                     [
                         {
                             "timeslot_start": "2023-05-28T00:00:00",
-                            "delay": 0.0
+                            "delay": 0.0,
+                            "count": 12
                         },
                         {
                             "timeslot_start": "2023-05-28T00:30:00",
-                            "delay": 0.0
+                            "delay": 0.0,
+                            "count": 9
                         },
                         ...
                     ]
@@ -402,7 +464,7 @@ def delay_at_time(request):
 
     tests:
         * Test that the API returns a list of times.
-        * Test that the API returns 24 times in half hour steps.
+        * Test that the API returns the times in steps of the given slot width.
         * Test that the API returns 404 at any request other than GET
     """
     
@@ -410,19 +472,15 @@ def delay_at_time(request):
         try:
             logger.info("GET request for delay_at_time")
 
-            delay_df = pd.DataFrame(Departure.objects.values('line_number',
-            'id',
-            'direction',
-            'delay',
-            'line_name',
-            'planned_departure_time'))
-            
-            delay_df = Filter.by_time(delay_df)
+            window = Window.params(request.query_params)
 
-            delay_dict = delay_df.to_dict('records')
-            
-            return JsonResponse({'times':[delay_dict]})
+            delay_df = Query.by_time(**Timeslot.params(request.query_params), window=window)
+
+            return Render.response({'times':[delay_df]}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)        
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -431,6 +489,7 @@ def delay_at_time(request):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@cached_response
 def line_delay_at_time(request, line, direction):
 
     """line_delay_at_time
@@ -441,10 +500,19 @@ def line_delay_at_time(request, line, direction):
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters are
+            * slot: width of the timeslots in minutes, 5, 10, 15, 30 or 60 (default 30)
+            * fill: delay of timeslots without departures, previous, none or zero (default previous)
+            * split: days to return the timeslots of weekdays and weekend separately
+            * from, to, weekdays, hours: time window, see below
         line (string): Line name
         direction (string): Direction name    
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
     Example:
         ```    
             {
@@ -452,7 +520,8 @@ def line_delay_at_time(request, line, direction):
                     [
                         {
                             "timeslot_start": "2023-05-28T00:00:00",
-                            "delay": 0.0
+                            "delay": 0.0,
+                            "count": 12
                         }
                     ]
                 ]
@@ -461,7 +530,7 @@ def line_delay_at_time(request, line, direction):
 
     tests:
         * Test that the API returns a list of times.
-        * Test that the API returns 24 times in half hour steps.
+        * Test that the API returns the times in steps of the given slot width.
         * Test that the API returns 404 at any request other than GET
     """
     
@@ -469,21 +538,15 @@ def line_delay_at_time(request, line, direction):
         try:
             logger.info("GET request for line_delay_at_time")
 
-            delay_df = pd.DataFrame(Departure.objects.values('line_number',
-            'id',
-            'direction',
-            'delay',
-            'line_name',
-            'planned_departure_time'))
-
-            delay_df = Filter.by_line(delay_df, line, direction)
+            window = Window.params(request.query_params)
 
-            delay_df = Filter.by_time(delay_df)
+            delay_df = Query.by_time(line, direction, **Timeslot.params(request.query_params), window=window)
 
-            delay_dict = delay_df.to_dict('records')
-            
-            return JsonResponse({'times':[delay_dict]})
+            return Render.response({'times':[delay_df]}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -494,6 +557,7 @@ def line_delay_at_time(request, line, direction):
 
     
 @api_view(['GET'])
+@cached_response
 def line_delay_at_station(request, line, direction):
 
     """line_delay_at_station
@@ -504,10 +568,20 @@ def line_delay_at_station(request, line, direction):
         _type_: HttpResponse
         
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters from, to, weekdays and hours restrict the time window
         line (string): Line name
         direction (string): Direction name    
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
+
     Example:
         ```    
             {
@@ -536,20 +610,16 @@ def line_delay_at_station(request, line, direction):
         try:
             logger.info("GET request for line_delay_at_station")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'line_number',
-            'direction',
-            'station_id',
-            'delay'))
-
-            delay_df = Filter.by_line(delay_df, line, direction)
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_df = Filter.delay_at_station(delay_df)
+            delay_df = Query.delay_at_station(line, direction, window=window, ranking=ranking)
 
-            delay_dict = delay_df.to_dict('records')
-
-            return JsonResponse({'delays':delay_dict})
+            return Render.response({'delays':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -558,6 +628,7 @@ def line_delay_at_station(request, line, direction):
         return Response(status=status.HTTP_404_NOT_FOUND)
     
 @api_view(['GET'])
+@cached_response
 def delay_at_station(request):
 
     """delay_at_station
@@ -568,7 +639,17 @@ def delay_at_station(request):
         _type_: HttpResponse
         
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameters from, to, weekdays and hours restrict the time window
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
 
     Example:
         ```    
@@ -598,17 +679,16 @@ def delay_at_station(request):
         try:
             logger.info("GET request for delay_at_station")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'station_id',
-            'delay'))
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_df = Filter.delay_at_station(delay_df)
-            
+            delay_df = Query.delay_at_station(window=window, ranking=ranking)
 
-            delay_dic = delay_df.to_dict('records')
-
-            return JsonResponse({'delays':delay_dic})
+            return Render.response({'delays':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -617,6 +697,7 @@ def delay_at_station(request):
         return Response(status=status.HTTP_404_NOT_FOUND)
     
 @api_view(['GET'])
+@cached_response
 def propability_at_station(request, station: str):
 
     """propability_at_station
@@ -627,9 +708,20 @@ def propability_at_station(request, station: str):
         _type_: HttpResponse
         
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
         station (string): Station name
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
+
     Example:
         ```    
             {
@@ -653,18 +745,18 @@ def propability_at_station(request, station: str):
         try:
             logger.info("GET request for propability_at_station")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'station_id',
-            'delay'))
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
 
-            delay_df = Filter.propability_at_station(delay_df)
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_df = delay_df.loc[delay_df['Name mit Ort'] == station]
+            delay_df = Query.propability_at_station(station=station, thresholds=thresholds, window=window, ranking=ranking)
             
-            delay_dict = delay_df.to_dict('records')
-
-            return JsonResponse({'propability':delay_dict})
+            return Render.response({'propability':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -673,6 +765,7 @@ def propability_at_station(request, station: str):
         return Response(status=status.HTTP_404_NOT_FOUND)
     
 @api_view(['GET'])
+@cached_response
 def propability_at_stations(request):
 
     """propability_at_stations
@@ -683,7 +776,18 @@ def propability_at_stations(request):
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
 
     Example:
         ```    
@@ -713,16 +817,18 @@ def propability_at_stations(request):
         try:
             logger.info("GET request for propability_at_stations")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'station_id',
-            'delay'))
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
 
-            delay_df = Filter.propability_at_station(delay_df)
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_dic = delay_df.to_dict('records')
+            delay_df = Query.propability_at_station(thresholds=thresholds, window=window, ranking=ranking)
 
-            return JsonResponse({'propability':delay_dic})
+            return Render.response({'propability':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -731,6 +837,7 @@ def propability_at_stations(request):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@cached_response
 def propability_of_line(request, line, direction):
 
     """propability_of_line
@@ -741,10 +848,21 @@ def propability_of_line(request, line, direction):
         _type_: HttpResponse
         
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
         line (string): Line name
         direction (string): Direction name  
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
+
     Example:
         ```    
             {
@@ -769,19 +887,18 @@ def propability_of_line(request, line, direction):
         try:
             logger.info("GET request for propability_of_line")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'line_number',
-            'direction',
-            'delay'))
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
 
-            delay_df = Filter.by_line(delay_df, line, direction)
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            delay_df = Filter.propability_of_line(delay_df)
+            delay_df = Query.propability_of_line(line, direction, thresholds=thresholds, window=window, ranking=ranking)
 
-            delay_dict = delay_df.to_dict('records')
-            
-            return JsonResponse({'propability':delay_dict})
+            return Render.response({'propability':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -791,6 +908,7 @@ def propability_of_line(request, line, direction):
     
 
 @api_view(['GET'])
+@cached_response
 def propability_of_lines(request):
 
     """propability_of_lines
@@ -801,7 +919,18 @@ def propability_of_lines(request):
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
 
     Example:
         ```    
@@ -833,18 +962,18 @@ def propability_of_lines(request):
         try:
             logger.info("GET request for propability_of_lines")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'line_number',
-            'direction',
-            'delay'))
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
 
-            delay_df = Filter.propability_of_line(delay_df)
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
 
-            
-            delay_dict = delay_df.to_dict('records')
+            delay_df = Query.propability_of_line(thresholds=thresholds, window=window, ranking=ranking)
 
-            return JsonResponse({'propability':delay_dict})
+            return Render.response({'propability':delay_df}, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -854,6 +983,7 @@ def propability_of_lines(request):
     
 
 @api_view(['GET'])
+@cached_response
 def propability_at_stations_of_line(request, line, direction):
 
     """propability_of_lines
@@ -864,10 +994,21 @@ def propability_at_stations_of_line(request, line, direction):
         _type_: HttpResponse
 
     Args:
-        request (Request): Information about the call
+        request (Request): Information about the call, the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
         line (string): Line name
         direction (string): Direction name  
 
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of rows, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures
+
     Example:
         ```    
             {
@@ -896,20 +1037,119 @@ def propability_at_stations_of_line(request, line, direction):
         try:
             logger.info("GET request for propability_at_stations_of_line")
 
-            delay_df = pd.DataFrame(Departure.objects.values('id',
-            'line_number',
-            'direction',
-            'station_id',
-            'delay'))
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
+
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
+
+            delay_df = Query.propability_at_station(line, direction, thresholds=thresholds, window=window, ranking=ranking)
+
+            return Render.response({'propability':delay_df}, request)
+        
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            logger.error(e)
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    else:
+        return Response(status=status.HTTP_404_NOT_FOUND)
 
-            delay_df = Filter.by_line(delay_df, line, direction)
 
-            delay_df = Filter.propability_at_station(delay_df)
+@api_view(['GET'])
+@cached_response
+def line_dashboard(request, line, direction):
 
-            delay_dict = delay_df.to_dict('records')
+    """line_dashboard
+    description:
+        * GET: returns every statistic of a line by its direction in one response, computed from one read of the line
+        * summary: average delay, delay propability and number of departures of the line
+        * delays: average delay ordered by stations
+        * propability: delay propability ordered by stations
+        * times: average delay ordered by time
 
-            return JsonResponse({'propability':delay_dict})
+    Returns:
+        _type_: HttpResponse
+
+    Args:
+        request (Request): Information about the call, the query parameter fields selects the comma separated
+            fields of the response (default all), the query parameter threshold selects the comma separated
+            thresholds in minutes a delay has to exceed (default 2), from, to, weekdays and hours restrict the time window
+        line (string): Line name
+        direction (string): Direction name
+
+    Time window:
+        * from, to: first and last service date (YYYY-MM-DD)
+        * weekdays: ISO weekdays, e.g. 1-5 for monday to friday
+        * hours: hours of the planned departure time, e.g. 6-9,16-18
+
+    Ranking:
+        * limit: number of stations of delays and propability, e.g. 10 for the top 10
+        * order: desc (default) for the highest delays first, asc for the lowest
+        * min_samples: minimum number of departures of a station
+
+    Example:
+        ```    
+            {
+                "summary": [
+                    {
+                        "line_number": "S1",
+                        "direction": "Herrenberg",
+                        "delay": 0.11,
+                        "propability": 1.0,
+                        "count": 5120
+                    }
+                ],
+                "delays": [
+                    {
+                        "Name mit Ort": "Stadtmitte",
+                        "delay": 0.93
+                    },
+                    ...
+                ],
+                "propability": [
+                    {
+                        "Name mit Ort": "Gärtringen",
+                        "delay": 1.36
+                    },
+                    ...
+                ],
+                "times": [
+                    {
+                        "timeslot_start": "2023-05-28T00:00:00",
+                        "delay": 0.0,
+                        "count": 12
+                    },
+                    ...
+                ]
+            }
+        ```    
+
+    tests:
+        * Test that every field equals the response of its single endpoint.
+        * Test that only the fields given in fields are returned.
+        * Test that the API returns 400 for an unknown field or threshold.
+        (* Test that the API returns 404 at any request other than GET)
+    """
+    
+    if request.method == 'GET':
+        try:
+            logger.info("GET request for line_dashboard")
+
+            fields = [field for field in request.query_params.get('fields', '').split(',') if field]
+            thresholds = Risk.thresholds(request.query_params.get('threshold'))
+
+            window = Window.params(request.query_params)
+            ranking = Ranking.params(request.query_params)
+
+            dashboard = Query.dashboard(line, direction, fields, thresholds, window, ranking)
+
+            return Render.response(dashboard, request)
         
+        except ValueError as e:
+            return JsonResponse({'error':str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             logger.error(e)
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
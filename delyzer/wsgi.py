@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'delyzer.settings')
 
 application = get_wsgi_application()
+
+# Load the departures before the first request, see DepartureStore
+from delyzer.utils.store import DepartureStore
+
+DepartureStore.preload()
@@ -39,10 +39,37 @@ class VvsData:
     def __init__(self, logger):
         self.url = "http://127.0.0.1:8000/"
         self.logger = logger
+        self.session = requests.Session()
+        # Last successful response of every endpoint, revalidated with its ETag
+        self.responses = {}
+
+    def get(self, endpoint):
+        """
+        Requests an endpoint of the backend. If the data didn't change since the last request
+        the backend answers 304 and the last response is returned instead.
+        """
+        headers = {}
+        cached = self.responses.get(endpoint)
+        if cached is not None and 'ETag' in cached.headers:
+            headers['If-None-Match'] = cached.headers['ETag']
+        response = self.session.get(self.url + endpoint, headers=headers, timeout=10)
+        if response.status_code == 304 and cached is not None:
+            self.logger.info('Data of the backend did not change')
+            return cached
+        if response.status_code == 200:
+            self.responses[endpoint] = response
+        return response
+
+    def get_dashboard(self, line):
+        """
+        Requests all statistics of a line at once. The plots of the same line share the response,
+        switching between them only revalidates it. Only the top 10 stations are requested.
+        """
+        return self.get("dashboard/" + line.line_number + '/' + line.direction + '?limit=10')
 
     def get_avg_line_delay(self) -> List[AvgLineDelay]:
         self.logger.info('Get line data')
-        response = requests.get(self.url + "delay/lines", timeout=10)
+        response = self.get("delay/lines")
         if response.status_code == 200:
             self.logger.info('Request to backend was successful')
             data = response.json()
@@ -58,11 +85,11 @@ class VvsData:
 
     def get_avg_station_delay(self, line) -> List[AvgLineDelay]:
         self.logger.info('Get station data')
-        response = requests.get(self.url + "delay/stations/"+line.line_number + '/' + line.direction, timeout=10)
+        response = self.get_dashboard(line)
         if response.status_code == 200:
             self.logger.info('Request to backend was successful')
             data = response.json()
-            delay_data = data['delays'][:10]
+            delay_data = data['delays']
             try:
                 avg_station_delays = [AvgStationDelay(item['Name mit Ort'], item['delay']) for item in delay_data]
             except ValueError:
@@ -74,11 +101,11 @@ class VvsData:
         
     def get_avg_station_risk(self, line) -> List[AvgStationRisk]:
         self.logger.info('Get station risk data')
-        response = requests.get(self.url + "propability/stations/"+line.line_number + '/' + line.direction, timeout=10)
+        response = self.get_dashboard(line)
         if response.status_code == 200:
             self.logger.info('Request to backend was successful')
             data = response.json()
-            delay_data = data['propability'][:10]
+            delay_data = data['propability']
             try:
                 avg_station_delays = [AvgStationRisk(item['Name mit Ort'], item['delay']) for item in delay_data]
             except ValueError:
@@ -93,13 +120,13 @@ class VvsData:
     
     def get_avg_time_delay(self, line) -> List[AvgLineDelay]:
         self.logger.info('Get time data')
-        response = requests.get(self.url + "delay/times/" + line.line_number + '/' + line.direction, timeout=10)
+        response = self.get_dashboard(line)
         if response.status_code == 200:
             self.logger.info('Request to backend was successful')
             data = response.json()
             delay_data = data['times']
             try:
-                avg_time_delays = [AvgTimeDelay(item['timeslot_start'], item['delay']) for inner_list in delay_data for item in inner_list]
+                avg_time_delays = [AvgTimeDelay(item['timeslot_start'], item['delay']) for item in delay_data]
             except ValueError:
                 self.logger.error('Failed to create AvgTimeDelay list. Propably wrong data format.')
             return avg_time_delays
@@ -110,7 +137,7 @@ class VvsData:
 
     def get_lines(self) -> List[AvgLineDelay]:
         self.logger.info('Get lines')
-        response = requests.get(self.url + "lines", timeout=10)
+        response = self.get("lines")
         if response.status_code == 200:
             self.logger.info('Request to backend was successful')
             data = response.json()['lines']